@@ -3,28 +3,28 @@ from typing import Annotated, Sequence, TypedDict
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
 from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
-import google.generativeai as genai
 import asyncio
+import logging
 from langchain_core.tools import tool
 import os
 from dotenv import load_dotenv
-import json
+from agents.models import create_model
+from responses import dumps_text, loads
+from versions import SUMMARIES, bump_versions
+from database import db, customers_collection, convosummary_collection
+from interaction_store import append_interaction, count_interactions, last_interaction_by_sender
+from agents.llm_cache import generate_text
+from agents.summary_queue import summary_queue
+from agents.prompt_builder import ITEM_TOKENS, fit_prompt, truncate_to_tokens
 
 load_dotenv()
 
-ATLAS_URI = os.getenv("MONGODB_URI")  # Changed to match your other code
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+logger = logging.getLogger(__name__)
 
-client = AsyncIOMotorClient(ATLAS_URI)
-db = client["crm_db"]
-customers_collection = db["customers"]  
-interactions_collection = db["interactions"] 
-convosummary_collection = db["convosummary"]
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-genai.configure(api_key=GEMINI_API_KEY)
-llm = genai.GenerativeModel('gemini-2.5-flash')
+llm = create_model('gemini-2.5-flash', GEMINI_API_KEY)
 
 # ============= TOOLS =============
 
@@ -47,20 +47,16 @@ async def add_customer_response(customer_id: str, sender: str, interaction_type:
             "summary": interaction_summary
         }
         
-        result = await interactions_collection.update_one(
-            {"_id": object_id},
-            {"$push": {"interactions": interaction}},
-            upsert=True
-        )
+        await append_interaction(object_id, interaction)
         
-        return json.dumps({
+        return dumps_text({
             "success": True, 
             "message": f"Customer response added successfully"
         })
     except Exception as e:
         error_msg = f"Error adding customer response: {e}"
-        print(error_msg)
-        return json.dumps({"success": False, "error": error_msg})
+        logger.error(error_msg)
+        return dumps_text({"success": False, "error": error_msg})
 
 @tool    
 async def update_conversation_summary(customer_id: str, summary: str):
@@ -83,15 +79,16 @@ async def update_conversation_summary(customer_id: str, summary: str):
             },
             upsert=True
         )
+        await bump_versions(db, SUMMARIES)
         
-        return json.dumps({
+        return dumps_text({
             "success": True, 
             "message": "Summary updated successfully"
         })
     except Exception as e:
         error_msg = f"Error updating summary: {e}"
-        print(error_msg)
-        return json.dumps({"success": False, "error": error_msg})
+        logger.error(error_msg)
+        return dumps_text({"success": False, "error": error_msg})
 
 @tool
 async def fetch_summary(customer_id: str):
@@ -101,47 +98,40 @@ async def fetch_summary(customer_id: str):
         document = await convosummary_collection.find_one({"_id": object_id})
         
         if document:
-            document["_id"] = str(document["_id"])
-            if "customer_id" in document:
-                document["customer_id"] = str(document["customer_id"])
-            return json.dumps(document, default=str)
+            return dumps_text(document)
         else:
-            return json.dumps({
+            return dumps_text({
                 "summary": "No previous interactions recorded.", 
                 "message": "First customer response"
             })
     except Exception as e:
         error_msg = f"Error fetching summary: {e}"
-        print(error_msg)
-        return json.dumps({"error": error_msg})
+        logger.error(error_msg)
+        return dumps_text({"error": error_msg})
 
 @tool
 async def fetch_last_agent_message(customer_id: str):
     """Fetch the last message sent by the agent to provide context"""
     try:
         object_id = ObjectId(customer_id)
-        document = await interactions_collection.find_one({"_id": object_id})
-        
-        if document and "interactions" in document:
-            # Find last interaction from "me" (the agent)
-            agent_messages = [i for i in document["interactions"] if i.get("sender") == "me"]
-            if agent_messages:
-                last_msg = agent_messages[-1]
-                return json.dumps({
-                    "found": True,
-                    "type": last_msg.get("type"),
-                    "summary": last_msg.get("summary"),
-                    "date": str(last_msg.get("date"))
-                }, default=str)
+        # Find last interaction from "me" (the agent)
+        last_msg = await last_interaction_by_sender(object_id, "me")
+        if last_msg:
+            return dumps_text({
+                "found": True,
+                "type": last_msg.get("type"),
+                "summary": last_msg.get("summary"),
+                "date": str(last_msg.get("date"))
+            })
         
-        return json.dumps({
+        return dumps_text({
             "found": False, 
             "message": "No previous agent message found"
         })
     except Exception as e:
         error_msg = f"Error fetching last message: {e}"
-        print(error_msg)
-        return json.dumps({"error": error_msg})
+        logger.error(error_msg)
+        return dumps_text({"error": error_msg})
 
 # ============= STATE DEFINITION =============
 
@@ -158,16 +148,16 @@ class CustomerResponseState(TypedDict):
 
 async def fetch_context_node(state: CustomerResponseState):
     """Node 1: Fetch current summary and last agent message for context"""
-    print("📥 Fetching conversation context...")
+    logger.debug("Fetching conversation context")
     
     try:
         # Fetch summary
         summary_result = await fetch_summary.ainvoke({"customer_id": state["customer_id"]})
-        summary_data = json.loads(summary_result)
+        summary_data = loads(summary_result)
         
         # Fetch last agent message
         last_msg_result = await fetch_last_agent_message.ainvoke({"customer_id": state["customer_id"]})
-        last_msg_data = json.loads(last_msg_result)
+        last_msg_data = loads(last_msg_result)
         
         last_msg_text = ""
         if last_msg_data.get("found"):
@@ -175,7 +165,7 @@ async def fetch_context_node(state: CustomerResponseState):
         else:
             last_msg_text = "No previous agent message (this may be inbound inquiry)"
         
-        print(f"   ✅ Context fetched")
+        logger.debug("Context fetched")
         
         return {
             **state,
@@ -183,7 +173,7 @@ async def fetch_context_node(state: CustomerResponseState):
             "last_agent_message": last_msg_text
         }
     except Exception as e:
-        print(f"   ❌ Error fetching context: {e}")
+        logger.error("Error fetching context: %s", e)
         return {
             **state,
             "current_summary": "Error fetching summary",
@@ -192,7 +182,7 @@ async def fetch_context_node(state: CustomerResponseState):
 
 async def store_customer_response_node(state: CustomerResponseState):
     """Node 2: Store the customer's response in interactions collection"""
-    print("💾 Storing customer response...")
+    logger.debug("Storing customer response")
     
     try:
         result = await add_customer_response.ainvoke({
@@ -202,31 +192,36 @@ async def store_customer_response_node(state: CustomerResponseState):
             "interaction_summary": state["customer_response"]
         })
         
-        result_data = json.loads(result)
+        result_data = loads(result)
         if result_data.get("success"):
-            print(f"   ✅ Customer response stored")
+            logger.debug("Customer response stored")
         else:
-            print(f"   ⚠️ Storage issue: {result_data.get('error')}")
+            logger.warning("Storage issue: %s", result_data.get('error'))
         
         return state
     except Exception as e:
-        print(f"   ❌ Error storing response: {e}")
+        logger.error("Error storing response: %s", e)
         return state
 
 async def generate_updated_summary_node(state: CustomerResponseState):
     """Node 3: Generate updated summary using LLM"""
-    print("🤖 Generating updated summary with customer response...")
+    logger.debug("Generating updated summary with customer response")
+    
+    # The response itself is kept nearly whole; summary and the last agent
+    # message give way first when the prompt is over budget
+    customer_response = truncate_to_tokens(state["customer_response"], ITEM_TOKENS * 4)
     
-    summary_prompt = f"""
+    def render(summary, lines, omitted):
+        return f"""
 PREVIOUS CONVERSATION SUMMARY:
-{state["current_summary"]}
+{summary}
 
 LAST AGENT MESSAGE:
-{state["last_agent_message"]}
+{lines[0] if lines else "(omitted)"}
 
 NEW CUSTOMER RESPONSE:
 Type: {state["interaction_type"]}
-Customer said: {state["customer_response"]}
+Customer said: {customer_response}
 
 ---
 
@@ -248,18 +243,25 @@ Focus on:
 Write from a neutral, analytical perspective.
 """
     
+    summary_prompt = fit_prompt(
+        "customer_response_summary",
+        render,
+        state["current_summary"],
+        [state["last_agent_message"]],
+        str
+    )
+    
     try:
-        summary_response = await llm.generate_content_async(summary_prompt)
-        new_summary = summary_response.text
+        new_summary = await generate_text(llm, summary_prompt, agent="adder")
         
-        print(f"   ✅ Summary generated")
+        logger.debug("Summary generated")
         
         return {
             **state,
             "updated_summary": new_summary
         }
     except Exception as e:
-        print(f"   ❌ Error generating summary: {e}")
+        logger.error("Error generating summary: %s", e)
         return {
             **state,
             "updated_summary": state["current_summary"]  # Fallback to old summary
@@ -267,7 +269,7 @@ Write from a neutral, analytical perspective.
 
 async def update_summary_db_node(state: CustomerResponseState):
     """Node 4: Store the updated summary in database"""
-    print("📝 Updating conversation summary in database...")
+    logger.debug("Updating conversation summary in database")
     
     try:
         result = await update_conversation_summary.ainvoke({
@@ -275,17 +277,34 @@ async def update_summary_db_node(state: CustomerResponseState):
             "summary": state["updated_summary"]
         })
         
-        result_data = json.loads(result)
+        result_data = loads(result)
         if result_data.get("success"):
-            print(f"   ✅ Summary updated in database")
+            logger.debug("Summary updated in database")
         else:
-            print(f"   ⚠️ Update issue: {result_data.get('error')}")
+            logger.warning("Update issue: %s", result_data.get('error'))
         
         return state
     except Exception as e:
-        print(f"   ❌ Error updating summary: {e}")
+        logger.error("Error updating summary: %s", e)
         return state
 
+async def enqueue_summary_node(state: CustomerResponseState):
+    """Write-behind variant of nodes 3-4: queue the summary update for the background workers"""
+    logger.debug("Queueing conversation summary update")
+    
+    try:
+        await summary_queue.enqueue(
+            state["customer_id"],
+            "customer",
+            state["interaction_type"],
+            state["customer_response"]
+        )
+        logger.debug("Summary update queued")
+    except Exception as e:
+        logger.error("Error queueing summary update: %s", e)
+    
+    return state
+
 # ============= BUILD GRAPH =============
 
 def create_customer_response_workflow():
@@ -308,6 +327,21 @@ def create_customer_response_workflow():
     
     return workflow.compile()
 
+def create_write_behind_response_workflow():
+    """Store the response and queue the summary update instead of waiting on the LLM.
+    Used by the API; the summary is rewritten by agents/summary_queue.py workers."""
+    
+    workflow = StateGraph(CustomerResponseState)
+    
+    workflow.add_node("store_response", store_customer_response_node)
+    workflow.add_node("enqueue_summary", enqueue_summary_node)
+    
+    workflow.set_entry_point("store_response")
+    workflow.add_edge("store_response", "enqueue_summary")
+    workflow.add_edge("enqueue_summary", END)
+    
+    return workflow.compile()
+
 # ============= MAIN EXECUTION =============
 
 async def main():
@@ -334,9 +368,8 @@ async def main():
         print(f"✅ Found customer: {customer.get('name', 'Unknown')}")
         
         # Check if they have interaction history
-        interaction_doc = await interactions_collection.find_one({"_id": object_id})
-        if interaction_doc:
-            interaction_count = len(interaction_doc.get("interactions", []))
+        interaction_count = await count_interactions(object_id)
+        if interaction_count:
             print(f"   📊 Existing interactions: {interaction_count}")
         else:
             print(f"   📊 No previous interactions (this will be the first)")
@@ -0,0 +1,180 @@
+"""Incremental assignment of new customers to the nearest existing campaign, and the drift check
+that recommends a full rebuild."""
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError
+
+from database import db
+from agents.segmentation import SEGMENTATION_MODELS_COLLECTION, FeatureSpace, squared_distances
+from stats import record_mappings_added
+from versions import MAPPINGS, bump_versions
+
+logger = logging.getLogger(__name__)
+
+DRIFT_GROWTH = float(os.getenv("CAMPAIGN_DRIFT_GROWTH", "0.5"))
+DRIFT_OUTLIER_RATE = float(os.getenv("CAMPAIGN_DRIFT_OUTLIER_RATE", "0.25"))
+DRIFT_DISTANCE_RATIO = float(os.getenv("CAMPAIGN_DRIFT_DISTANCE_RATIO", "1.5"))
+DRIFT_MIN_SAMPLES = int(os.getenv("CAMPAIGN_DRIFT_MIN_SAMPLES", "50"))
+
+
+class CampaignModel:
+    """The parts of a segmentation_models document needed to place customers"""
+
+    def __init__(self, doc):
+        self.id = doc["_id"]
+        self.space = FeatureSpace.from_doc(doc["space"])
+        self.centroids = np.asarray([segment["centroid"] for segment in doc["segments"]], dtype=np.float32)
+        self.campaign_ids = [segment["campaign_id"] for segment in doc["segments"]]
+        self.outlier_distances = np.asarray(
+            [segment.get("distance_p95", np.inf) for segment in doc["segments"]], dtype=np.float32
+        )
+
+    def nearest(self, customers):
+        """(segment index, distance) per customer"""
+        distances = squared_distances(self.space.transform(customers), self.centroids)
+        segments = distances.argmin(axis=1)
+        return segments, np.sqrt(distances[np.arange(len(customers)), segments])
+
+
+class CampaignAssigner:
+    def __init__(self, db):
+        self.db = db
+        self.models = db[SEGMENTATION_MODELS_COLLECTION]
+        self._model = None
+
+    async def active_model(self):
+        """The active model, re-read only when a rebuild has replaced it"""
+        current = await self.models.find_one(
+            {"active": True}, {"_id": 1}, sort=[("created_at", DESCENDING)]
+        )
+        if current is None:
+            self._model = None
+            return None
+        if self._model is None or self._model.id != current["_id"]:
+            doc = await self.models.find_one({"_id": current["_id"]})
+            self._model = CampaignModel(doc)
+        return self._model
+
+    async def assign(self, customers):
+        """Map inserted customer documents to their nearest campaign.
+
+        Returns {customer _id: campaign_id}; empty when no campaigns exist yet.
+        """
+        customers = [customer for customer in customers if customer.get("_id") is not None]
+        if not customers:
+            return {}
+        model = await self.active_model()
+        if model is None:
+            return {}
+
+        segments, distances = await asyncio.to_thread(model.nearest, customers)
+        now = datetime.now()
+        mappings = [
+            {
+                "campaign_id": model.campaign_ids[segment],
+                "customer_obj_id": customer["_id"],
+                "distance": round(float(distance), 4),
+                "mapped_at": now,
+                "assigned": "incremental",
+                "model_id": model.id
+            }
+            for customer, segment, distance in zip(customers, segments, distances)
+        ]
+        try:
+            inserted = len((await self.db["mapcamp"].insert_many(mappings, ordered=False)).inserted_ids)
+        except BulkWriteError as e:
+            # Already mapped, e.g. by a campaign rebuild that ran meanwhile
+            inserted = e.details.get("nInserted", 0)
+
+        if await self.models.find_one({"_id": model.id, "active": True}, {"_id": 1}) is None:
+            # A rebuild started meanwhile and is clearing these campaign ids;
+            # it maps these customers itself once the new model is active
+            await self.db["mapcamp"].delete_many({
+                "model_id": model.id,
+                "customer_obj_id": {"$in": [mapping["customer_obj_id"] for mapping in mappings]}
+            })
+            self._model = None
+            return {}
+
+        await record_mappings_added(self.db, inserted)
+        await bump_versions(self.db, MAPPINGS)
+
+        outliers = int((distances > model.outlier_distances[segments]).sum())
+        await self.models.update_one(
+            {"_id": model.id},
+            {"$inc": {
+                "drift.assigned": len(mappings),
+                "drift.outliers": outliers,
+                "drift.distance_sum": float(distances.sum())
+            }}
+        )
+        return {mapping["customer_obj_id"]: mapping["campaign_id"] for mapping in mappings}
+
+    async def check_drift(self):
+        """Compare new customers against the active model; stored on the model and returned"""
+        customers = await self.db["customers"].estimated_document_count()
+        doc = await self.models.find_one({"active": True}, sort=[("created_at", DESCENDING)])
+        if doc is None:
+            return {
+                "model_id": None,
+                "customers": customers,
+                "rebuild_recommended": customers > 0,
+                "reasons": ["no segmentation model yet; run campaign creation"] if customers else [],
+                "checked_at": datetime.now()
+            }
+
+        drift = doc.get("drift", {})
+        assigned = drift.get("assigned", 0)
+        clustered = doc.get("customers", 0)
+        growth = (customers - clustered) / clustered if clustered else 0.0
+        outlier_rate = drift.get("outliers", 0) / assigned if assigned else 0.0
+        mean_distance = drift.get("distance_sum", 0.0) / assigned if assigned else 0.0
+        baseline = doc.get("mean_distance") or 0.0
+        distance_ratio = mean_distance / baseline if baseline else 0.0
+
+        reasons = []
+        if growth > DRIFT_GROWTH:
+            reasons.append(f"customer base grew {growth:.0%} since the campaigns were built")
+        if assigned >= DRIFT_MIN_SAMPLES:
+            if outlier_rate > DRIFT_OUTLIER_RATE:
+                reasons.append(f"{outlier_rate:.0%} of new customers fit no campaign well")
+            if distance_ratio > DRIFT_DISTANCE_RATIO:
+                reasons.append(f"new customers are {distance_ratio:.1f}x farther from their campaign than clustered ones")
+
+        report = {
+            "model_id": str(doc["_id"]),
+            "model_created_at": doc["created_at"],
+            "customers": customers,
+            "clustered_customers": clustered,
+            "assigned_since": assigned,
+            "growth": round(growth, 3),
+            "outlier_rate": round(outlier_rate, 3),
+            "distance_ratio": round(distance_ratio, 3),
+            "rebuild_recommended": bool(reasons),
+            "reasons": reasons,
+            "checked_at": datetime.now()
+        }
+        await self.models.update_one({"_id": doc["_id"]}, {"$set": {"last_drift_check": report}})
+        return report
+
+
+async def drift_check_loop(assigner, interval_seconds):
+    """Background job: check campaign drift every interval_seconds"""
+    if interval_seconds <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            report = await assigner.check_drift()
+            if report["rebuild_recommended"]:
+                logger.warning("Campaign rebuild recommended: %s", "; ".join(report["reasons"]))
+        except Exception:
+            logger.exception("Campaign drift check failed")
+
+
+campaign_assigner = CampaignAssigner(db)
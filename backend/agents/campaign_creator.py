@@ -1,36 +1,44 @@
 
 from langgraph.graph import StateGraph, END
+import logging
 import os
-from langchain_core.messages import SystemMessage, AIMessage
+import time
+from langchain_core.messages import AIMessage
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
-import json
-import google.generativeai as genai
-from bson.objectid import ObjectId
-from langchain_core.tools import tool
-from langgraph.prebuilt import ToolNode
-from typing import Annotated, Sequence, TypedDict, List
-from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from typing import Annotated, Optional, Sequence, TypedDict, List
+from datetime import datetime, timedelta
+from agents.models import LLM_BACKEND, create_model
+from agents.llm_cache import generate_text
+from agents.llm_gateway import BATCH
+from agents.campaign_assignment import campaign_assigner
+from agents.campaign_next_actions import DRAFTS_COLLECTION
+from agents.segmentation import SEGMENTATION_MODELS_COLLECTION, build_naming_prompt, parse_segment_names, segment_customers
+from projections import SEGMENTATION_FIELDS, to_projection
+from database import db, customers_collection, campaigns_collection, mapcamp_collection
+from agents.registry import get_workflow
+from versions import CAMPAIGNS, MAPPINGS, bump_versions
+from stats import record_campaigns_added, record_mappings_added, reset_campaign_stats
 import asyncio
 
 # Load environment variables
 load_dotenv()
 
-ATLAS_URI = os.getenv("MONGODB_URI")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+logger = logging.getLogger(__name__)
 
-if not ATLAS_URI:
-    raise ValueError("ATLAS_URI not found in .env file")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-if not GEMINI_API_KEY:
+if not GEMINI_API_KEY and LLM_BACKEND != "fake":
     raise ValueError("GOOGLE_API_KEY not found in .env file")
 
-# MongoDB connection
-client = AsyncIOMotorClient(ATLAS_URI)
-db = client["crm_db"]
-customers_collection = db["customers"]
-campaigns_collection = db["campaigns"]
-mapcamp_collection = db["mapcamp"]
+CUSTOMER_FEATURE_FIELDS = to_projection(SEGMENTATION_FIELDS)
+MAPPING_CHUNK_SIZE = 1000
+# ObjectIds from different workers are only ordered to the second
+CATCH_UP_OVERLAP = timedelta(seconds=5)
+
+segmentation_models_collection = db[SEGMENTATION_MODELS_COLLECTION]
+drafts_collection = db[DRAFTS_COLLECTION]
 
 # Define state for LangGraph
 class CampaignState(TypedDict):
@@ -38,185 +46,218 @@ class CampaignState(TypedDict):
     customer_data: List[dict]
     campaigns_created: List[dict]
     mappings_created: List[dict]
+    segmentation: dict
+    segment_names: dict
+    loaded_at: Optional[datetime]
 
-# Tools for the LangGraph workflow
-@tool
-async def fetch_crm_data():
-    """Fetch all customer data from the database for analysis"""
-    try:
-        customer_data = await customers_collection.find().to_list(None)
-        # Convert ObjectId to string for JSON serialization
-        for customer in customer_data:
-            customer["_id"] = str(customer["_id"])
-        
-        print(f"Fetched {len(customer_data)} customers from database")
-        return json.dumps(customer_data, default=str)
-    except Exception as e:
-        print(f"Error fetching data: {str(e)}")
-        return f"Error fetching data: {str(e)}"
+# Initialize LLM; it only names the segments found locally
+llm = create_model('gemini-2.5-flash', GEMINI_API_KEY)
 
-@tool
-async def campaign_creation(campaign_custom_id: int, campaign_parameter: str):
-    """Create a new campaign in the database with given ID and parameters"""
-    try:
-        document = {
-            "campaign_id": campaign_custom_id,
-            "parameter_description": campaign_parameter,
-            "created_at": datetime.now()
-        }
-        
-        result = await campaigns_collection.insert_one(document)
-        success_msg = f"Campaign {campaign_custom_id} created: {campaign_parameter}"
-        print(f"✅ {success_msg}")
-        return success_msg
-    except Exception as e:
-        error_msg = f"Error creating campaign: {str(e)}"
-        print(f"❌ {error_msg}")
-        return error_msg
+# Define workflow nodes
+async def segment_node(state: CampaignState):
+    """Load customer features and cluster them in-process"""
+    loaded_at = datetime.utcnow()
+    customers = await customers_collection.find({}, CUSTOMER_FEATURE_FIELDS).to_list(None)
+    logger.info("Fetched %d customers from database", len(customers))
+    if not customers:
+        return {"customer_data": [], "segmentation": {}, "loaded_at": loaded_at}
 
-@tool
-async def campaign_mapping(customer_obj_id: str, suitable_campaign_id: int):
-    """Map customer to appropriate campaign based on analysis"""
+    started = time.perf_counter()
+    # k-means is CPU-bound; keep it off the event loop
+    segmentation = await asyncio.to_thread(segment_customers, customers)
+    logger.info(
+        "%d segments over %d features in %.2fs",
+        len(segmentation["segments"]), segmentation["space"].dimensions, time.perf_counter() - started
+    )
+    return {"customer_data": customers, "segmentation": segmentation, "loaded_at": loaded_at}
+
+async def name_node(state: CampaignState):
+    """Ask the LLM to name each segment from its statistics and samples"""
+    segments = state["segmentation"].get("segments", [])
+    if not segments:
+        return {"segment_names": {}}
+
+    logger.info("Calling AI model to name segments")
     try:
-        document = {
-            "customer_obj_id": customer_obj_id,
-            "campaign_id": suitable_campaign_id,
-            "mapped_at": datetime.now()
-        }
-        
-        result = await mapcamp_collection.insert_one(document)
-        success_msg = f"Customer {customer_obj_id[:8]}... mapped to campaign {suitable_campaign_id}"
-        print(f"📍 {success_msg}")
-        return success_msg
-    except Exception as e:
-        error_msg = f"Error mapping customer: {str(e)}"
-        print(f"❌ {error_msg}")
-        return error_msg
+        # Campaign runs are background work and yield to interactive calls in the gateway
+        text = await generate_text(llm, build_naming_prompt(segments), priority=BATCH, agent="campaign_creator")
+    except Exception:
+        logger.exception("Error calling Gemini model")
+        text = ""
+    return {
+        "segment_names": parse_segment_names(text, segments),
+        "messages": [AIMessage(content=text or "Segment names generated locally")]
+    }
 
-# Initialize tools
-tools = [fetch_crm_data, campaign_creation, campaign_mapping]
+async def write_node(state: CampaignState):
+    """Store the segmentation model, one campaign per segment and every mapping in bulk"""
+    segmentation = state["segmentation"]
+    segments = segmentation.get("segments", [])
+    if not segments:
+        return {"campaigns_created": [], "mappings_created": []}
 
-# Initialize LLM with tools
-genai.configure(api_key=GEMINI_API_KEY)
-llm = genai.GenerativeModel('gemini-2.5-flash')
+    customers = state["customer_data"]
+    names = state["segment_names"]
+    now = datetime.now()
 
-# Define workflow nodes
-async def call_model(state: CampaignState):
-    """Call the LLM to analyze data and create campaigns """
-    system_prompt = SystemMessage(
-        content="""You are a professional CRM analyst and campaign strategist. Your task is to:
+    # Empty clusters are dropped, so campaign ids are assigned over the kept segments
+    campaign_ids = {segment["segment"]: index + 1 for index, segment in enumerate(segments)}
+    model = {
+        "created_at": now,
+        # Activated once its campaigns and mappings exist
+        "active": False,
+        "customers": len(customers),
+        "inertia": segmentation["inertia"],
+        "mean_distance": round(float(segmentation["distances"].mean()), 4),
+        # Counters bumped by incremental assignment, read by the drift check
+        "drift": {"assigned": 0, "outliers": 0, "distance_sum": 0.0},
+        "space": segmentation["space"].to_doc(),
+        "segments": [
+            {
+                "campaign_id": campaign_ids[segment["segment"]],
+                "centroid": [float(value) for value in segmentation["centroids"][segment["segment"]]],
+                "size": segment["size"],
+                "mean_distance": segment["mean_distance"],
+                "distance_p95": segment["distance_p95"]
+            }
+            for segment in segments
+        ]
+    }
+    model_id = (await segmentation_models_collection.insert_one(model)).inserted_id
 
-1. First, use fetch_crm_data tool to get all customer data
-2. Analyze the customer data to identify patterns (location, business type, size, etc.)
-3. Create  campaigns using campaign_creation tool with:
-   - campaign_custom_id: Use integers 1, 2, 3, etc.
-   - campaign_parameter: Describe the campaign focus (e.g., "Mumbai-based retail businesses", "Small tech companies")
-4. Finally, use campaign_mapping tool to assign each customer to appropriate campaigns
-5. Use the campaign to group people in the database with common parameters that you think should be the best
-Be systematic and thorough in your analysis. Create campaigns that make business sense based on the actual customer data patterns you observe."""
-    )
-    
-    messages = [system_prompt] + state.get("messages", [])
-    print("🤖 Calling AI model for analysis...")
+    campaigns = [
+        {
+            "campaign_id": campaign_ids[segment["segment"]],
+            "name": names[segment["segment"]]["name"],
+            "parameter_description": names[segment["segment"]]["description"] or names[segment["segment"]]["name"],
+            "segment": {key: segment[key] for key in ("size", "cities", "sizes", "services", "localities", "mean_distance", "distance_p95")},
+            "model_id": model_id,
+            "created_at": now
+        }
+        for segment in segments
+    ]
+    await campaigns_collection.insert_many(campaigns)
+    await record_campaigns_added(db, len(campaigns))
+    for campaign in campaigns:
+        logger.info("Campaign %s created: %s", campaign["campaign_id"], campaign["parameter_description"])
 
-    # Convert messages to a format compatible with Gemini
-    prompt = "\n".join([msg.content for msg in messages])
-    
-    try:
-        # Use generate_content_async for the Gemini model
-        response = await llm.generate_content_async(prompt)
-        # Wrap the response content in an AIMessage for compatibility with LangGraph
-        ai_message = AIMessage(content=response.text)
-        return {"messages": [ai_message]}
-    except Exception as e:
-        print(f"Error calling Gemini model: {str(e)}")
-        return {"messages": [AIMessage(content=f"Error: {str(e)}")]}
-async def execute_tools(state: CampaignState):
-    """Execute any tool calls from the LLM response"""
-    last_message = state["messages"][-1]
-    
-    if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-        print(f"🔧 Executing {len(last_message.tool_calls)} tool calls...")
-        tool_node = ToolNode(tools)
-        result = await tool_node.ainvoke(state)
-        return result
-    
-    return state
+    labels, distances = segmentation["labels"], segmentation["distances"]
+    mapped = 0
+    for offset in range(0, len(customers), MAPPING_CHUNK_SIZE):
+        chunk = [
+            {
+                "campaign_id": campaign_ids[int(labels[i])],
+                "customer_obj_id": customers[i]["_id"],
+                "distance": round(float(distances[i]), 4),
+                "mapped_at": now,
+                "model_id": model_id
+            }
+            for i in range(offset, min(offset + MAPPING_CHUNK_SIZE, len(customers)))
+        ]
+        # Each customer ends up in exactly one campaign: drop whatever mapping
+        # it picked up since the campaigns were cleared
+        await mapcamp_collection.delete_many({"customer_obj_id": {"$in": [mapping["customer_obj_id"] for mapping in chunk]}})
+        try:
+            mapped += len((await mapcamp_collection.insert_many(chunk, ordered=False)).inserted_ids)
+        except BulkWriteError as e:
+            mapped += e.details.get("nInserted", 0)
+    await record_mappings_added(db, mapped)
 
-def should_continue(state: CampaignState):
-    """Determine if workflow should continue or end"""
-    last_message = state["messages"][-1]
-    
-    if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-        return "execute_tools"
-    else:
-        return END
+    await segmentation_models_collection.update_one({"_id": model_id}, {"$set": {"active": True}})
+    await segmentation_models_collection.update_many({"_id": {"$ne": model_id}, "active": True}, {"$set": {"active": False}})
+    await bump_versions(db, CAMPAIGNS, MAPPINGS)
+    logger.info("%d customers mapped to %d campaigns", mapped, len(campaigns))
+
+    # Customers created while the rebuild ran were skipped by incremental
+    # assignment (no active model); place them with the new one
+    clustered = {customer["_id"] for customer in customers}
+    since = ObjectId.from_datetime(state["loaded_at"] - CATCH_UP_OVERLAP)
+    created_during = [
+        customer
+        for customer in await customers_collection.find({"_id": {"$gte": since}}, CUSTOMER_FEATURE_FIELDS).to_list(None)
+        if customer["_id"] not in clustered
+    ]
+    if created_during:
+        already_mapped = set(await mapcamp_collection.distinct(
+            "customer_obj_id", {"customer_obj_id": {"$in": [customer["_id"] for customer in created_during]}}
+        ))
+        caught_up = await campaign_assigner.assign(
+            [customer for customer in created_during if customer["_id"] not in already_mapped]
+        )
+        logger.info("%d customers created during the run assigned to the new campaigns", len(caught_up))
+
+    return {"campaigns_created": campaigns, "mappings_created": [{"count": mapped}]}
 
 # Create the workflow graph
 def create_campaign_workflow():
     workflow = StateGraph(CampaignState)
     
     # Add nodes
-    workflow.add_node("call_model", call_model)
-    workflow.add_node("execute_tools", ToolNode(tools))
+    workflow.add_node("segment", segment_node)
+    workflow.add_node("name", name_node)
+    workflow.add_node("write", write_node)
     
     # Add edges
-    workflow.set_entry_point("call_model")
-    workflow.add_conditional_edges("call_model", should_continue)
-    workflow.add_edge("execute_tools", "call_model")
+    workflow.set_entry_point("segment")
+    workflow.add_edge("segment", "name")
+    workflow.add_edge("name", "write")
+    workflow.add_edge("write", END)
     
     return workflow.compile()
 
 # Main execution function
-async def run_campaign_creation():
-    """Main function to run the campaign creation workflow"""
+async def run_campaign_creation(progress=None):
+    """Main function to run the campaign creation workflow
+
+    progress, when given, is awaited as progress(stage, **fields) so a
+    background job can report how far the run has got.
+    """
+    async def report(stage, **fields):
+        if progress:
+            await progress(stage, **fields)
+
     try:
-        print("=" * 60)
-        print("🚀 Starting AI Campaign Creation Workflow")
-        print("=" * 60)
-        
-        # Clear existing campaigns and mappings (optional - for testing)
+        logger.info("Starting campaign creation workflow")
+
+        # Clear existing campaigns, mappings and next-action drafts (campaign
+        # ids are reused by the new run). The old model goes inactive first so
+        # incremental assignment stops handing out its campaign ids
+        await report("clearing")
+        await segmentation_models_collection.update_many({"active": True}, {"$set": {"active": False}})
         campaigns_deleted = await campaigns_collection.delete_many({})
         mappings_deleted = await mapcamp_collection.delete_many({})
-        print(f"🗑️  Cleared {campaigns_deleted.deleted_count} existing campaigns")
-        print(f"🗑️  Cleared {mappings_deleted.deleted_count} existing mappings")
-        print()
+        drafts_deleted = await drafts_collection.delete_many({})
+        await reset_campaign_stats(db)
+        await bump_versions(db, CAMPAIGNS, MAPPINGS)
+        logger.info(
+            "Cleared %d campaigns, %d mappings and %d next-action drafts",
+            campaigns_deleted.deleted_count, mappings_deleted.deleted_count, drafts_deleted.deleted_count
+        )
         
         # Create and run workflow
-        workflow = create_campaign_workflow()
+        workflow = get_workflow("campaign")
         
         initial_state = CampaignState(
             messages=[],
             customer_data=[],
             campaigns_created=[],
-            mappings_created=[]
+            mappings_created=[],
+            segmentation={},
+            segment_names={},
+            loaded_at=None
         )
         
-        print("🔄 Running LangGraph workflow...")
+        logger.info("Running campaign workflow")
+        await report("running_workflow")
         final_state = await workflow.ainvoke(initial_state)
         
         # Get final results
+        await report("summarizing")
         campaigns_count = await campaigns_collection.count_documents({})
         mappings_count = await mapcamp_collection.count_documents({})
         
-        print()
-        print("=" * 60)
-        print("📊 CAMPAIGN CREATION SUMMARY")
-        print("=" * 60)
-        print(f"✅ Campaigns Created: {campaigns_count}")
-        print(f"✅ Customer Mappings: {mappings_count}")
-        print(f"✅ Workflow Messages: {len(final_state.get('messages', []))}")
-        
-        if campaigns_count > 0:
-            print("\n📋 Campaign Details:")
-            campaigns = await campaigns_collection.find().to_list(100)
-            for campaign in campaigns:
-                customer_count = await mapcamp_collection.count_documents({
-                    "campaign_id": campaign["campaign_id"]
-                })
-                print(f"   Campaign {campaign['campaign_id']}: {campaign['parameter_description']}")
-                print(f"   └── {customer_count} customers assigned")
-        
+        logger.info("Campaign creation finished: %d campaigns, %d mappings", campaigns_count, mappings_count)
+
         result = {
             "status": "success",
             "campaigns_created": campaigns_count,
@@ -224,12 +265,11 @@ async def run_campaign_creation():
             "workflow_messages": len(final_state.get("messages", []))
         }
         
-        print("\n🎉 Campaign creation workflow completed successfully!")
         return result
-        
+
     except Exception as e:
         error_msg = f"Campaign creation failed: {str(e)}"
-        print(f"❌ {error_msg}")
+        logger.exception("Campaign creation failed")
         return {"status": "error", "message": error_msg}
 
 # Terminal execution
@@ -254,10 +294,10 @@ async def main():
     result = await run_campaign_creation()
     
     if result["status"] == "success":
-        print(f"\n✅ Success! Check your database for the new campaigns and mappings.")
+        print(f"\n✅ Success! {result['campaigns_created']} campaigns and {result['customer_mappings']} customer mappings created.")
     else:
         print(f"\n❌ Failed: {result.get('message', 'Unknown error')}")
 
 if __name__ == "__main__":
-
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""Batch next-action drafts for every customer in a campaign, stored in `next_action_drafts` and approved one by one."""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from database import db, mapcamp_collection
+from agents.context import load_customer_context, load_customer_contexts
+from agents.llm_cache import generate_text, llm_cache
+from agents.llm_gateway import BATCH, LLMGatewayBusy
+from agents.nextmove import AgentState, build_suggestion_prompt, llm, store_interaction_node
+
+logger = logging.getLogger(__name__)
+
+DRAFTS_COLLECTION = "next_action_drafts"
+PAGE_SIZE = int(os.getenv("NEXT_ACTION_BATCH_PAGE_SIZE", "200"))
+DEFAULT_CONCURRENCY = int(os.getenv("NEXT_ACTION_BATCH_CONCURRENCY", "4"))
+GATEWAY_RETRIES = 3
+# Statuses the batch job never overwrites
+LOCKED_STATUSES = ["approving", "approved"]
+# An approval that has not finished by then (e.g. the worker died) can be retried
+APPROVING_TIMEOUT = timedelta(seconds=60)
+
+drafts_collection = db[DRAFTS_COLLECTION]
+
+
+def _state_for(customer_id, context, bypass_cache=False):
+    has_history = context["has_history"]
+    return AgentState(
+        messages=[],
+        customer_id=str(customer_id),
+        has_history=has_history,
+        interaction_data={"interactions": context["interactions"] if has_history else []},
+        conversation_summary=context["summary"] if has_history else "First contact with this lead",
+        next_action="",
+        user_approved=False,
+        bypass_cache=bypass_cache
+    )
+
+
+async def _generate(customer_id, context, semaphore, bypass_cache):
+    """Suggestion text for one customer; a busy gateway is retried after its hint"""
+    prompt = build_suggestion_prompt(_state_for(customer_id, context, bypass_cache))
+    async with semaphore:
+        for attempt in range(GATEWAY_RETRIES + 1):
+            try:
+                return await generate_text(llm, prompt, bypass_cache=bypass_cache, priority=BATCH, agent="campaign_next_actions")
+            except LLMGatewayBusy as e:
+                if attempt == GATEWAY_RETRIES:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+
+async def _approved_ids(campaign_id, customer_ids):
+    docs = await drafts_collection.find(
+        {"campaign_id": campaign_id, "customer_id": {"$in": customer_ids}, "status": {"$in": LOCKED_STATUSES}},
+        {"customer_id": 1}
+    ).to_list(None)
+    return {doc["customer_id"] for doc in docs}
+
+
+async def run_campaign_next_actions(campaign_id, progress=None, concurrency=None, bypass_cache=False):
+    """Generate and store a draft next action for every customer in the campaign
+
+    progress, when given, is awaited as progress(stage, **fields) after each page.
+    """
+    async def report(stage, **fields):
+        if progress:
+            await progress(stage, **fields)
+
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    total = await mapcamp_collection.count_documents({"campaign_id": campaign_id})
+    logger.info("Generating next actions for %d customers in campaign %s (concurrency %d)", total, campaign_id, concurrency)
+
+    started = time.perf_counter()
+    hits_before = llm_cache.counters["memory_hits"] + llm_cache.counters["mongo_hits"]
+    counts = {"generated": 0, "failed": 0, "skipped_approved": 0, "skipped_missing": 0}
+    processed = 0
+    last_id = None
+    await report("generating", total=total, processed=0, **counts)
+
+    while True:
+        query = {"campaign_id": campaign_id}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        mappings = await mapcamp_collection.find(query, {"customer_obj_id": 1}).sort("_id", 1).limit(PAGE_SIZE).to_list(PAGE_SIZE)
+        if not mappings:
+            break
+        last_id = mappings[-1]["_id"]
+
+        customer_ids = [ObjectId(mapping["customer_obj_id"]) for mapping in mappings]
+        contexts, approved = await asyncio.gather(
+            load_customer_contexts(customer_ids),
+            _approved_ids(campaign_id, customer_ids)
+        )
+        counts["skipped_approved"] += len(approved)
+
+        pending = []
+        for customer_id in customer_ids:
+            if customer_id in approved:
+                continue
+            if not contexts[customer_id]["exists"]:
+                counts["skipped_missing"] += 1
+                continue
+            pending.append(customer_id)
+
+        results = await asyncio.gather(
+            *(_generate(customer_id, contexts[customer_id], semaphore, bypass_cache) for customer_id in pending),
+            return_exceptions=True
+        )
+
+        now = datetime.utcnow()
+        operations = []
+        for customer_id, result in zip(pending, results):
+            if isinstance(result, Exception):
+                counts["failed"] += 1
+                fields = {"status": "failed", "suggestion": None, "error": str(result)}
+            else:
+                counts["generated"] += 1
+                fields = {"status": "draft", "suggestion": result, "error": None}
+            operations.append(UpdateOne(
+                # Never overwrite a draft that was approved while the job ran
+                {"campaign_id": campaign_id, "customer_id": customer_id, "status": {"$nin": LOCKED_STATUSES}},
+                {"$set": {**fields, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+                upsert=True
+            ))
+        if operations:
+            try:
+                await drafts_collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                # An upsert racing an approval hits the unique index; that draft stays approved
+                logger.warning("Some drafts were not written for campaign %s: %s", campaign_id, e)
+
+        processed += len(mappings)
+        elapsed = time.perf_counter() - started
+        await report(
+            "generating",
+            total=total,
+            processed=processed,
+            per_minute=round(counts["generated"] / elapsed * 60, 1) if elapsed else 0.0,
+            **counts
+        )
+        logger.debug("Campaign %s: %d/%d customers processed", campaign_id, processed, total)
+
+    elapsed = time.perf_counter() - started
+    cache_hits = llm_cache.counters["memory_hits"] + llm_cache.counters["mongo_hits"] - hits_before
+    result = {
+        "campaign_id": campaign_id,
+        "customers": total,
+        **counts,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 2),
+        "per_minute": round(counts["generated"] / elapsed * 60, 1) if elapsed else 0.0,
+        "avg_seconds_per_customer": round(elapsed / counts["generated"], 3) if counts["generated"] else None,
+        "cache_hits": cache_hits
+    }
+    logger.info("Campaign %s: %d drafts in %.1fs (%s/min)", campaign_id, counts["generated"], elapsed, result["per_minute"])
+    return result
+
+
+async def approve_draft(campaign_id, customer_id, suggestion=None):
+    """Store a draft (optionally edited) as the customer's next interaction"""
+    object_id = ObjectId(customer_id)
+    draft = await drafts_collection.find_one({"campaign_id": campaign_id, "customer_id": object_id})
+    if draft is None:
+        return None
+    if draft["status"] == "approved" or (
+        draft["status"] == "approving" and draft["updated_at"] >= datetime.utcnow() - APPROVING_TIMEOUT
+    ):
+        return draft
+
+    text = suggestion or draft.get("suggestion")
+    if not text:
+        raise ValueError("Draft has no suggestion to approve")
+
+    # Only the approval that moves the draft to approving stores the interaction
+    now = datetime.utcnow()
+    claimed = await drafts_collection.find_one_and_update(
+        {
+            "_id": draft["_id"],
+            "$or": [
+                {"status": {"$nin": LOCKED_STATUSES}},
+                {"status": "approving", "updated_at": {"$lt": now - APPROVING_TIMEOUT}}
+            ]
+        },
+        {"$set": {"status": "approving", "updated_at": now}}
+    )
+    if claimed is None:
+        # Approved (or being approved) by a concurrent request
+        return await drafts_collection.find_one({"_id": draft["_id"]})
+
+    try:
+        context = await load_customer_context(customer_id)
+        state = _state_for(object_id, context)
+        state["next_action"] = text
+        state["user_approved"] = True
+        await store_interaction_node(state)
+    except BaseException:
+        # Put the draft back so the approval can be retried
+        await drafts_collection.update_one(
+            {"_id": draft["_id"], "status": "approving"},
+            {"$set": {"status": "draft" if claimed["status"] == "approving" else claimed["status"], "updated_at": datetime.utcnow()}}
+        )
+        raise
+
+    now = datetime.utcnow()
+    return await drafts_collection.find_one_and_update(
+        {"_id": draft["_id"]},
+        {"$set": {"status": "approved", "suggestion": text, "approved_at": now, "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
@@ -0,0 +1,76 @@
+"""Concurrent customer, interaction and summary loading for the next-action workflow, memoized per request."""
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from bson import ObjectId
+from database import customers_collection, convosummary_collection
+from interaction_store import recent_interactions, recent_interactions_many
+
+RECENT_INTERACTIONS = 5
+
+_memo: ContextVar[Optional[dict]] = ContextVar("customer_context_memo", default=None)
+
+
+@contextmanager
+def request_scope():
+    """Share context loads between everything awaited inside this block"""
+    token = _memo.set({})
+    try:
+        yield
+    finally:
+        _memo.reset(token)
+
+
+async def _load(customer_id: str, recent_limit: int) -> dict:
+    object_id = ObjectId(customer_id)
+    customer, (interactions, _), summary_doc = await asyncio.gather(
+        customers_collection.find_one({"_id": object_id}, {"name": 1, "city": 1, "size": 1}),
+        recent_interactions(object_id, limit=recent_limit),
+        convosummary_collection.find_one({"_id": object_id}, {"summary": 1})
+    )
+    return {
+        "exists": customer is not None,
+        "customer": customer,
+        "interactions": interactions,
+        "has_history": customer is not None and bool(interactions),
+        "summary": summary_doc.get("summary", "") if summary_doc else ""
+    }
+
+
+async def load_customer_context(customer_id: str, recent_limit: int = RECENT_INTERACTIONS) -> dict:
+    """Customer, recent interactions (oldest first) and summary in one parallel pass"""
+    memo = _memo.get()
+    if memo is None:
+        return await _load(customer_id, recent_limit)
+
+    key = (customer_id, recent_limit)
+    task = memo.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load(customer_id, recent_limit))
+        memo[key] = task
+    return await task
+
+
+async def load_customer_contexts(customer_ids, recent_limit: int = RECENT_INTERACTIONS) -> dict:
+    """load_customer_context() for many customers at once, keyed by ObjectId"""
+    object_ids = [ObjectId(customer_id) for customer_id in customer_ids]
+    customers, recent, summaries = await asyncio.gather(
+        customers_collection.find({"_id": {"$in": object_ids}}, {"name": 1, "city": 1, "size": 1}).to_list(None),
+        recent_interactions_many(object_ids, limit=recent_limit),
+        convosummary_collection.find({"_id": {"$in": object_ids}}, {"summary": 1}).to_list(None)
+    )
+    customers = {doc["_id"]: doc for doc in customers}
+    summaries = {doc["_id"]: doc.get("summary", "") for doc in summaries}
+    contexts = {}
+    for object_id in object_ids:
+        customer = customers.get(object_id)
+        interactions = recent.get(object_id, [])
+        contexts[object_id] = {
+            "exists": customer is not None,
+            "customer": customer,
+            "interactions": interactions,
+            "has_history": customer is not None and bool(interactions),
+            "summary": summaries.get(object_id, "")
+        }
+    return contexts
@@ -0,0 +1,189 @@
+"""Two-tier (in-process LRU and optional Mongo) cache of LLM text responses keyed by model and prompt."""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from database import db
+from metrics import LLM_CACHE_LOOKUPS, LLM_LATENCY, LLM_REQUESTS
+from agents.llm_gateway import INTERACTIVE, PRIORITY_NAMES, LLMGatewayBusy, llm_gateway
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_COLLECTION = "llm_cache"
+
+
+class LLMCache:
+    def __init__(self, max_entries=512, ttl_seconds=3600, collection=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self._entries = OrderedDict()  # key -> (expires_at monotonic, text)
+        self.counters = {
+            "memory_hits": 0,
+            "mongo_hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+
+    @staticmethod
+    def make_key(model_name, prompt):
+        return hashlib.sha256(f"{model_name}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, text, ttl_seconds):
+        self._entries[key] = (time.monotonic() + ttl_seconds, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry:
+            expires_at, text = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                LLM_CACHE_LOOKUPS.labels("memory_hit").inc()
+                return text
+            del self._entries[key]
+            self.counters["expirations"] += 1
+
+        if self.collection is not None:
+            try:
+                doc = await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+            except Exception as e:
+                logger.warning("LLM cache lookup failed: %s", e)
+                doc = None
+            if doc:
+                remaining = (doc["expires_at"] - datetime.utcnow()).total_seconds()
+                self._remember(key, doc["text"], remaining)
+                self.counters["mongo_hits"] += 1
+                LLM_CACHE_LOOKUPS.labels("mongo_hit").inc()
+                return doc["text"]
+
+        self.counters["misses"] += 1
+        LLM_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    async def set(self, key, text, model_name=None):
+        self._remember(key, text, self.ttl_seconds)
+        self.counters["stores"] += 1
+        if self.collection is not None:
+            now = datetime.utcnow()
+            try:
+                await self.collection.update_one(
+                    {"_id": key},
+                    {"$set": {
+                        "text": text,
+                        "model": model_name,
+                        "created_at": now,
+                        "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                    }},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.warning("LLM cache store failed: %s", e)
+
+    def stats(self):
+        lookups = self.counters["memory_hits"] + self.counters["mongo_hits"] + self.counters["misses"]
+        hits = self.counters["memory_hits"] + self.counters["mongo_hits"]
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "shared_tier": self.collection is not None,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+
+llm_cache = LLMCache(
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512")),
+    ttl_seconds=int(os.getenv("LLM_CACHE_TTL_SECONDS", "3600")),
+    collection=db[LLM_CACHE_COLLECTION] if os.getenv("LLM_CACHE_MONGO", "0") == "1" else None
+)
+
+
+@asynccontextmanager
+async def model_call(agent, priority):
+    """Hold a gateway slot for one model call and record its latency and outcome"""
+    priority_name = PRIORITY_NAMES[priority]
+    try:
+        async with llm_gateway.slot(priority):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                yield
+                outcome = "ok"
+            except (asyncio.CancelledError, GeneratorExit):
+                # The caller went away (e.g. a closed stream), not a model failure
+                outcome = "cancelled"
+                raise
+            finally:
+                LLM_LATENCY.labels(agent, priority_name, outcome).observe(time.perf_counter() - started)
+                LLM_REQUESTS.labels(agent, priority_name, outcome).inc()
+    except LLMGatewayBusy:
+        LLM_REQUESTS.labels(agent, priority_name, "busy").inc()
+        raise
+
+
+async def generate_text(llm, prompt, bypass_cache=False, cache=None, priority=INTERACTIVE, agent="other"):
+    """Return llm's text response for prompt, served from the cache when possible"""
+    cache = cache or llm_cache
+    model_name = getattr(llm, "model_name", type(llm).__name__)
+    key = cache.make_key(model_name, prompt)
+
+    if bypass_cache:
+        cache.counters["bypasses"] += 1
+        LLM_CACHE_LOOKUPS.labels("bypass").inc()
+    else:
+        cached = await cache.get(key)
+        if cached is not None:
+            return cached
+
+    async with model_call(agent, priority):
+        response = await llm.generate_content_async(prompt)
+    text = response.text
+    if text:
+        await cache.set(key, text, model_name)
+    return text
+
+
+async def stream_text(llm, prompt, bypass_cache=False, cache=None, priority=INTERACTIVE, agent="other"):
+    """Async-iterate llm's response to prompt as text chunks as they arrive.
+
+    A cache hit is yielded as a single chunk; a completed stream is stored
+    so the non-streaming path can reuse it.
+    """
+    cache = cache or llm_cache
+    model_name = getattr(llm, "model_name", type(llm).__name__)
+    key = cache.make_key(model_name, prompt)
+
+    if bypass_cache:
+        cache.counters["bypasses"] += 1
+        LLM_CACHE_LOOKUPS.labels("bypass").inc()
+    else:
+        cached = await cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    # The slot is held until the stream is fully consumed
+    async with model_call(agent, priority):
+        response = await llm.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            text = chunk.text
+            if text:
+                parts.append(text)
+                yield text
+
+    if parts:
+        await cache.set(key, "".join(parts), model_name)
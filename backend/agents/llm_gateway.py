@@ -0,0 +1,186 @@
+"""Admission control for every Gemini call: a concurrency limit, a token bucket and a bounded priority queue."""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from metrics import LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_REJECTIONS
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class LLMGatewayBusy(Exception):
+    """Raised when a model call is rejected instead of queued"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency=4, rate_per_second=1.0, burst=4, max_queue=50, queue_timeout=30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_per_second = rate_per_second
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._queued = {INTERACTIVE: 0, BATCH: 0}
+        self._timer = None
+        self._waits = deque(maxlen=1000)  # recent queue waits in seconds
+        self.counters = {
+            "admitted": 0,
+            "admitted_immediately": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "max_queue_depth": 0
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate_per_second > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_second)
+        else:
+            self._tokens = float(self.burst)
+        self._refilled_at = now
+
+    def _can_admit(self):
+        self._refill()
+        return self._in_flight < self.max_concurrency and self._tokens >= 1
+
+    def _admit(self):
+        self._in_flight += 1
+        LLM_IN_FLIGHT.inc()
+        if self.rate_per_second > 0:
+            self._tokens -= 1
+        self.counters["admitted"] += 1
+
+    def _release(self):
+        self._in_flight -= 1
+        LLM_IN_FLIGHT.dec()
+        self._dispatch()
+
+    def _queue_depth(self):
+        return sum(self._queued.values())
+
+    def _dispatch(self):
+        """Hand free slots to waiters in priority order"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                # Timed out or cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit():
+                break
+            heapq.heappop(self._waiters)
+            self._admit()
+            future.set_result(None)
+
+        if self._waiters and self._in_flight < self.max_concurrency and self.rate_per_second > 0:
+            # Only the token bucket is holding waiters back; wake up when it refills
+            delay = max(0.0, (1 - self._tokens) / self.rate_per_second)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def retry_after(self):
+        """Rough seconds until a newly queued call would be admitted"""
+        if self.rate_per_second <= 0:
+            return 1
+        return max(1, math.ceil((self._queue_depth() + 1) / self.rate_per_second))
+
+    @asynccontextmanager
+    async def slot(self, priority=INTERACTIVE):
+        """Hold one admitted model call for the duration of the block"""
+        queued_at = time.monotonic()
+        if self._queue_depth() == 0 and self._can_admit():
+            self._admit()
+            self.counters["admitted_immediately"] += 1
+        else:
+            if self._queue_depth() >= self.max_queue:
+                self.counters["rejected_queue_full"] += 1
+                LLM_REJECTIONS.labels(PRIORITY_NAMES[priority], "queue_full").inc()
+                raise LLMGatewayBusy("LLM queue is full, try again later", self.retry_after())
+
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future))
+            self._queued[priority] += 1
+            LLM_QUEUE_DEPTH.labels(PRIORITY_NAMES[priority]).inc()
+            self.counters["max_queue_depth"] = max(self.counters["max_queue_depth"], self._queue_depth())
+            try:
+                self._dispatch()
+                await asyncio.wait({future}, timeout=self.queue_timeout)
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Admitted just as the caller went away; give the slot back
+                    self._release()
+                future.cancel()
+                raise
+            finally:
+                self._queued[priority] -= 1
+                LLM_QUEUE_DEPTH.labels(PRIORITY_NAMES[priority]).dec()
+
+            # Checked on the future itself: a slot may have been granted
+            # between the timeout firing and this task resuming
+            if not future.done():
+                future.cancel()
+                self.counters["rejected_timeout"] += 1
+                LLM_REJECTIONS.labels(PRIORITY_NAMES[priority], "timeout").inc()
+                raise LLMGatewayBusy(
+                    f"Waited {self.queue_timeout:g}s for an LLM slot, try again later",
+                    self.retry_after()
+                )
+
+        waited = time.monotonic() - queued_at
+        self._waits.append(waited)
+        LLM_QUEUE_WAIT.labels(PRIORITY_NAMES[priority]).observe(waited)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        self._refill()
+        waits = sorted(self._waits)
+        return {
+            **self.counters,
+            "in_flight": self._in_flight,
+            "queued": {PRIORITY_NAMES[p]: n for p, n in self._queued.items()},
+            "tokens_available": round(self._tokens, 2),
+            "wait_ms": {
+                "samples": len(waits),
+                "avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                "max": round(waits[-1] * 1000, 1) if waits else 0.0
+            },
+            "limits": {
+                "max_concurrency": self.max_concurrency,
+                "rate_per_second": self.rate_per_second,
+                "burst": self.burst,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout
+            }
+        }
+
+
+_workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+llm_gateway = LLMGateway(
+    max_concurrency=max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "8")) // _workers),
+    rate_per_second=float(os.getenv("LLM_RATE_PER_MINUTE", "120")) / _workers / 60,
+    burst=max(1, int(os.getenv("LLM_BURST", "8")) // _workers),
+    max_queue=int(os.getenv("LLM_QUEUE_SIZE", "50")),
+    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+)
@@ -0,0 +1,60 @@
+"""Model construction for the agents; LLM_BACKEND=fake gives an offline FakeGenerativeModel."""
+import asyncio
+import hashlib
+import os
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStreamResponse:
+    def __init__(self, chunks, delay):
+        self._chunks = chunks
+        self._delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGenerativeModel:
+    """Deterministic stand-in for genai.GenerativeModel"""
+
+    def __init__(self, model_name="fake-llm", chunk_delay=0.02):
+        self.model_name = model_name
+        self.chunk_delay = chunk_delay
+
+    def reply_for(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return (
+            "- Recommended Action: Email\n"
+            f"- Reasoning: Offline fake model reply {digest} for a {len(prompt)}-character prompt.\n"
+            "- Content: Hi, following up on our last conversation about your salon. "
+            "Would you have 15 minutes this week for a quick call?"
+        )
+
+    async def generate_content_async(self, prompt, stream=False):
+        text = self.reply_for(prompt)
+        if not stream:
+            return FakeResponse(text)
+        words = text.split(" ")
+        chunks = [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+        return FakeStreamResponse(chunks, self.chunk_delay)
+
+
+def create_model(model_name, api_key=None):
+    """Build the configured model; LLM_BACKEND=fake selects the offline fake"""
+    if LLM_BACKEND == "fake":
+        return FakeGenerativeModel(model_name=f"fake-{model_name}")
+
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
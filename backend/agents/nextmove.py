@@ -4,30 +4,30 @@ from langchain_core.messages import BaseMessage, SystemMessage, AIMessage, Human
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode
 from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
-import google.generativeai as genai
 import asyncio
+import logging
 from langchain_core.tools import tool
 import os
 from dotenv import load_dotenv
-import json
+from agents.models import create_model
+from responses import dumps_text
+from versions import SUMMARIES, bump_versions
+from database import db, customers_collection, convosummary_collection
+from interaction_store import append_interaction, count_interactions, recent_interactions
+from agents.context import load_customer_context, request_scope
+from agents.llm_cache import generate_text
+from agents.summary_queue import summary_queue
+from agents.prompt_builder import fit_prompt
 
 load_dotenv()
 
-ATLAS_URI = os.getenv("MONGODB_URI")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+logger = logging.getLogger(__name__)
 
-# MongoDB connection
-client = AsyncIOMotorClient(ATLAS_URI)
-db = client["crm_db"]
-customers_collection = db["customers"]  
-interactions_collection = db["interactions"] 
-convosummary_collection = db["convosummary"]
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 # Configure Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-llm = genai.GenerativeModel('gemini-2.5-flash')
+llm = create_model('gemini-2.5-flash', GEMINI_API_KEY)
 
 # ============= STATE DEFINITION =============
 class AgentState(TypedDict):
@@ -38,6 +38,7 @@ class AgentState(TypedDict):
     conversation_summary: str
     next_action: str
     user_approved: bool
+    bypass_cache: bool
 
 # ============= TOOLS =============
 
@@ -48,46 +49,44 @@ async def checkid(customer_id: str):
     try:
         object_id = ObjectId(customer_id)
         
-        # Check if customer exists in customers collection first
-        customer = await customers_collection.find_one({"_id": object_id})
+        # Check if customer exists in customers collection first (only _id is needed)
+        customer = await customers_collection.find_one({"_id": object_id}, {"_id": 1})
         if not customer:
-            return json.dumps({"exists": False, "error": "Customer not found in customers collection"})
+            return dumps_text({"exists": False, "error": "Customer not found in customers collection"})
         
-        # Check if interactions document exists
-        interaction_doc = await interactions_collection.find_one({"_id": object_id})
+        # Check if any interaction buckets exist
+        interaction_count = await count_interactions(object_id)
         
-        if interaction_doc and "interactions" in interaction_doc:
-            return json.dumps({
+        if interaction_count:
+            return dumps_text({
                 "exists": True, 
                 "has_history": True,
-                "interaction_count": len(interaction_doc["interactions"])
+                "interaction_count": interaction_count
             })
         else:
-            return json.dumps({
+            return dumps_text({
                 "exists": True,
                 "has_history": False,
                 "interaction_count": 0
             })
     except Exception as e:
-        return json.dumps({"exists": False, "error": str(e)})
+        return dumps_text({"exists": False, "error": str(e)})
 
 @tool
-async def fetch_interactions(customer_id: str):
-    """Fetch all past interactions for a customer from interactions collection"""
+async def fetch_interactions(customer_id: str, limit: int = 5):
+    """Fetch the most recent past interactions for a customer (oldest first)"""
     try:
         object_id = ObjectId(customer_id)
-        document = await interactions_collection.find_one({"_id": object_id})
+        interactions, _ = await recent_interactions(object_id, limit=limit)
         
-        if document:
-            # Convert ObjectId to string for JSON serialization
-            document["_id"] = str(document["_id"])
-            return json.dumps(document, default=str)
+        if interactions:
+            return dumps_text({"_id": customer_id, "interactions": interactions})
         else:
-            return json.dumps({"interactions": [], "message": "No interactions found"})
+            return dumps_text({"interactions": [], "message": "No interactions found"})
     except Exception as e:
         error_msg = f"Error fetching interactions: {e}"
-        print(error_msg)
-        return json.dumps({"error": error_msg})
+        logger.error(error_msg)
+        return dumps_text({"error": error_msg})
 
 @tool
 async def fetch_summary(customer_id: str):
@@ -97,14 +96,13 @@ async def fetch_summary(customer_id: str):
         document = await convosummary_collection.find_one({"_id": object_id})
         
         if document:
-            document["_id"] = str(document["_id"])
-            return json.dumps(document, default=str)
+            return dumps_text(document)
         else:
-            return json.dumps({"summary": "", "message": "No summary found - first interaction"})
+            return dumps_text({"summary": "", "message": "No summary found - first interaction"})
     except Exception as e:
         error_msg = f"Error fetching summary: {e}"
-        print(error_msg)
-        return json.dumps({"error": error_msg})
+        logger.error(error_msg)
+        return dumps_text({"error": error_msg})
 
 @tool
 async def add_interaction(customer_id: str, sender: str, interaction_type: str, interaction_summary: str):
@@ -125,18 +123,14 @@ async def add_interaction(customer_id: str, sender: str, interaction_type: str,
             "summary": interaction_summary
         }
         
-        result = await interactions_collection.update_one(
-            {"_id": object_id},
-            {"$push": {"interactions": interaction}},
-            upsert=True
-        )
+        bucket = await append_interaction(object_id, interaction)
         
-        if result.modified_count > 0 or result.upserted_id:
+        if bucket:
             return f"✅ Interaction added successfully for customer {customer_id}"
         return f"No changes made for customer {customer_id}"
     except Exception as e:
         error_msg = f"❌ Error adding interaction: {e}"    
-        print(error_msg)
+        logger.error(error_msg)
         return error_msg
 
 @tool 
@@ -155,13 +149,14 @@ async def update_summary(customer_id: str, summary: str):
             },
             upsert=True
         )
+        await bump_versions(db, SUMMARIES)
         
         if result.modified_count > 0 or result.upserted_id:
             return f"✅ Summary updated for customer {customer_id}"
         return f"No changes made to summary"
     except Exception as e:
         error_msg = f"❌ Error updating summary: {e}"
-        print(error_msg)
+        logger.error(error_msg)
         return error_msg
 
 # Initialize tools
@@ -171,17 +166,20 @@ tools = [checkid, fetch_interactions, fetch_summary, add_interaction, update_sum
 
 async def check_customer_node(state: AgentState):
     """Node 1: Check if customer has interaction history"""
-    print("🔍 Checking customer history...")
+    logger.debug("Checking customer history")
     
     customer_id = state["customer_id"]
     
-    # Call checkid tool
-    check_result = await checkid.ainvoke({"customer_id": customer_id})
-    result_data = json.loads(check_result)
-    
-    has_history = result_data.get("has_history", False)
+    # Loads customer, recent interactions and summary in one parallel pass;
+    # fetch_context_node reuses the same result within the request scope
+    try:
+        context = await load_customer_context(customer_id)
+        has_history = context["has_history"]
+    except Exception as e:
+        logger.error("Error loading customer context: %s", e)
+        has_history = False
     
-    print(f"   Customer has history: {has_history}")
+    logger.debug("Customer has history: %s", has_history)
     
     return {
         **state,
@@ -190,57 +188,57 @@ async def check_customer_node(state: AgentState):
 
 async def fetch_context_node(state: AgentState):
     """Node 2: Fetch interaction history and summary if exists"""
-    print("📥 Fetching customer context...")
+    logger.debug("Fetching customer context")
     
     customer_id = state["customer_id"]
     
     if state["has_history"]:
-        # Fetch interactions
-        interactions_result = await fetch_interactions.ainvoke({"customer_id": customer_id})
-        interactions_data = json.loads(interactions_result)
-        
-        # Fetch summary
-        summary_result = await fetch_summary.ainvoke({"customer_id": customer_id})
-        summary_data = json.loads(summary_result)
+        # Memoized: no extra round trip after check_customer_node
+        context = await load_customer_context(customer_id)
         
-        print(f"   Found {len(interactions_data.get('interactions', []))} past interactions")
+        logger.debug("Found %s past interactions", len(context['interactions']))
         
         return {
             **state,
-            "interaction_data": interactions_data,
-            "conversation_summary": summary_data.get("summary", "")
+            "interaction_data": {"_id": customer_id, "interactions": context["interactions"]},
+            "conversation_summary": context["summary"]
         }
     else:
-        print("   No previous interactions - new lead")
+        logger.debug("No previous interactions - new lead")
         return {
             **state,
             "interaction_data": {"interactions": []},
             "conversation_summary": "First contact with this lead"
         }
 
-async def generate_suggestion_node(state: AgentState):
-    """Node 3: Generate next action suggestion using LLM"""
-    print("🤖 Generating next action suggestion...")
-    
+def format_interaction(interaction) -> str:
+    return f"- {interaction['date']}: [{interaction['type']}] {interaction['sender']}: {interaction['summary']}"
+
+def build_suggestion_prompt(state: AgentState) -> str:
+    """Prompt for the next best action, shared by the node and the streaming endpoint.
+    Summary and interactions are fitted to the prompt token budget."""
     customer_id = state["customer_id"]
     has_history = state["has_history"]
     conversation_summary = state.get("conversation_summary", "")
     interactions = state.get("interaction_data", {}).get("interactions", [])
     
-    # Build context for LLM
-    if has_history:
-        context = f"""
+    def render(summary, lines, omitted):
+        # Build context for LLM
+        if has_history:
+            context = f"""
 CONVERSATION SUMMARY:
-{conversation_summary}
+{summary}
 
-RECENT INTERACTIONS (Last 5):
+RECENT INTERACTIONS (Last {len(lines)}):
 """
-        for interaction in interactions[-5:]:
-            context += f"- {interaction['date']}: [{interaction['type']}] {interaction['sender']}: {interaction['summary']}\n"
-    else:
-        context = "This is the FIRST contact with this lead. No previous interaction history."
-    
-    system_prompt = f"""You are an expert sales assistant helping with lead conversion.
+            if omitted:
+                context += f"({omitted} older interactions omitted)\n"
+            for line in lines:
+                context += line + "\n"
+        else:
+            context = "This is the FIRST contact with this lead. No previous interaction history."
+        
+        return f"""You are an expert sales assistant helping with lead conversion.
 
 CUSTOMER ID: {customer_id}
 
@@ -261,12 +259,25 @@ Format your response clearly with:
 - Reasoning: [Why this action]
 - Content: [Email text / Call script / Meeting agenda]
 """
+    
+    return fit_prompt(
+        "next_action",
+        render,
+        conversation_summary if has_history else "",
+        interactions[-5:] if has_history else [],
+        format_interaction
+    )
 
-    # Generate suggestion
-    response = await llm.generate_content_async(system_prompt)
-    suggestion = response.text
+async def generate_suggestion_node(state: AgentState):
+    """Node 3: Generate next action suggestion using LLM"""
+    logger.debug("Generating next action suggestion")
+    
+    system_prompt = build_suggestion_prompt(state)
+
+    # Generate suggestion (cached per prompt unless the caller asked for a fresh one)
+    suggestion = await generate_text(llm, system_prompt, bypass_cache=state.get("bypass_cache", False), agent="nextmove")
     
-    print(f"   ✅ Suggestion generated")
+    logger.debug("Suggestion generated")
     
     return {
         **state,
@@ -300,8 +311,8 @@ async def present_to_user_node(state: AgentState):
         }
 
 async def store_interaction_node(state: AgentState):
-    """Node 5: Store approved interaction and update summary"""
-    print("💾 Storing interaction in database...")
+    """Node 5: Store approved interaction and queue a summary update"""
+    logger.debug("Storing interaction in database")
     
     customer_id = state["customer_id"]
     next_action = state["next_action"]
@@ -313,42 +324,22 @@ async def store_interaction_node(state: AgentState):
     elif "meeting" in next_action.lower():
         interaction_type = "meeting"
     
-    # Add interaction
-    await add_interaction.ainvoke({
+    # Add interaction; the tool reports failures as its result text
+    result = await add_interaction.ainvoke({
         "customer_id": customer_id,
         "sender": "me",
         "interaction_type": interaction_type,
         "interaction_summary": next_action
     })
+    if not result.startswith("✅"):
+        raise RuntimeError(result)
     
-    # Update summary with LLM
-    print(" Updating conversation summary...")
-    
-    summary_prompt = f"""
-Previous Summary:
-{state.get('conversation_summary', 'No previous summary')}
-
-New Interaction:
-{next_action}
-
-Create a concise updated summary (max 200 words) that captures:
-1. Key points from previous interactions
-2. This new action taken
-3. Current status of the lead
-4. Next expected steps
-
-Keep it brief and focused on actionable insights.
-"""
+    # The summary is rewritten in the background (agents/summary_queue.py)
+    # so approval returns as soon as the interaction is stored
+    await summary_queue.enqueue(customer_id, "me", interaction_type, next_action)
+    logger.debug("Conversation summary update queued")
     
-    summary_response = await llm.generate_content_async(summary_prompt)
-    new_summary = summary_response.text
-    
-    await update_summary.ainvoke({
-        "customer_id": customer_id,
-        "summary": new_summary
-    })
-    
-    print("✅ Database updated successfully!")
+    logger.debug("Database updated successfully")
     
     return state
 
@@ -436,11 +427,17 @@ async def main():
         interaction_data={},
         conversation_summary="",
         next_action="",
-        user_approved=False
+        user_approved=False,
+        bypass_cache=False
     )
     
     print("🔄 Running workflow...\n")
-    final_state = await workflow.ainvoke(initial_state)
+    with request_scope():
+        final_state = await workflow.ainvoke(initial_state)
+    
+    # No background workers in a terminal run; apply the queued summary now
+    print("📝 Updating conversation summary...")
+    await summary_queue.drain(customer_id)
     
     print("\n" + "="*60)
     print("🎉 Workflow completed successfully!")
@@ -0,0 +1,95 @@
+"""Token-budgeted assembly of the agent prompts, with per-kind size stats."""
+import math
+import os
+
+CHARS_PER_TOKEN = 4
+TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+SUMMARY_TOKENS = int(os.getenv("PROMPT_SUMMARY_TOKENS", "600"))
+ITEM_TOKENS = int(os.getenv("PROMPT_ITEM_TOKENS", "200"))
+ELLIPSIS = " […] "
+
+_stats = {}
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens, keep_end=False):
+    """Cut text to about max_tokens; keep_end keeps its head and tail instead of just the head"""
+    text = text or ""
+    max_chars = max(0, max_tokens) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= len(ELLIPSIS):
+        return ""
+    room = max_chars - len(ELLIPSIS)
+    if keep_end:
+        head = room // 2
+        return text[:head].rstrip() + ELLIPSIS + text[len(text) - (room - head):].lstrip()
+    return text[:room].rstrip() + ELLIPSIS.rstrip()
+
+
+def _record(name, tokens, original_tokens, dropped, summary_compacted):
+    entry = _stats.setdefault(name, {
+        "calls": 0, "tokens_total": 0, "tokens_max": 0,
+        "trimmed_calls": 0, "tokens_saved": 0, "items_dropped": 0, "summaries_compacted": 0
+    })
+    entry["calls"] += 1
+    entry["tokens_total"] += tokens
+    entry["tokens_max"] = max(entry["tokens_max"], tokens)
+    if original_tokens > tokens:
+        entry["trimmed_calls"] += 1
+        entry["tokens_saved"] += original_tokens - tokens
+    entry["items_dropped"] += dropped
+    entry["summaries_compacted"] += int(summary_compacted)
+
+
+def fit_prompt(name, render, summary, items, format_item, budget=None,
+               summary_tokens=None, item_tokens=None):
+    """Build render(summary, item_lines, omitted) within the token budget.
+
+    items are oldest first; format_item turns one into a line of text. The
+    oldest lines are the first to go; omitted is how many were dropped so
+    the template can say so.
+    """
+    budget = budget or TOKEN_BUDGET
+    summary_tokens = summary_tokens or SUMMARY_TOKENS
+    item_tokens = item_tokens or ITEM_TOKENS
+
+    full_lines = [format_item(item) for item in items]
+    original_tokens = estimate_tokens(render(summary or "", full_lines, 0))
+
+    lines = [truncate_to_tokens(line, item_tokens) for line in full_lines]
+    summary_text = truncate_to_tokens(summary, summary_tokens, keep_end=True)
+    summary_compacted = summary_text != (summary or "")
+    omitted = 0
+    prompt = render(summary_text, lines, omitted)
+
+    # The newest line is the last to go, after the summary has been squeezed
+    while estimate_tokens(prompt) > budget and len(lines) > 1:
+        lines = lines[1:]
+        omitted += 1
+        prompt = render(summary_text, lines, omitted)
+
+    overflow = estimate_tokens(prompt) - budget
+    if overflow > 0 and summary_text:
+        summary_text = truncate_to_tokens(summary_text, estimate_tokens(summary_text) - overflow, keep_end=True)
+        summary_compacted = True
+        prompt = render(summary_text, lines, omitted)
+
+    if estimate_tokens(prompt) > budget and lines:
+        lines = []
+        omitted += 1
+        prompt = render(summary_text, lines, omitted)
+
+    _record(name, estimate_tokens(prompt), original_tokens, omitted, summary_compacted)
+    return prompt
+
+
+def prompt_stats():
+    """Per prompt kind: calls, average/max estimated tokens and how much trimming happened"""
+    return {
+        name: {**entry, "tokens_avg": round(entry["tokens_total"] / entry["calls"], 1) if entry["calls"] else 0.0}
+        for name, entry in _stats.items()
+    }
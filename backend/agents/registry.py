@@ -0,0 +1,62 @@
+"""Compile-once registry of the agent LangGraph workflows, warmed up from the app lifespan."""
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# workflow name -> (module, factory function)
+WORKFLOWS = {
+    "adder": ("agents.adder", "create_customer_response_workflow"),
+    "adder_write_behind": ("agents.adder", "create_write_behind_response_workflow"),
+    "nextmove": ("agents.nextmove", "create_conversation_workflow"),
+    "campaign": ("agents.campaign_creator", "create_campaign_workflow"),
+}
+
+_compiled = {}
+_timings = {}
+
+
+def _build(name):
+    module_name, factory_name = WORKFLOWS[name]
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    imported = time.perf_counter()
+    workflow = getattr(module, factory_name)()
+    compiled = time.perf_counter()
+
+    _compiled[name] = workflow
+    _timings[name] = {
+        "import_ms": round((imported - started) * 1000, 1),
+        "compile_ms": round((compiled - imported) * 1000, 1)
+    }
+    return workflow
+
+
+def warm_up():
+    """Import and compile every registered workflow, logging per-stage timings.
+
+    A workflow that fails to build (e.g. a missing API key) is logged and
+    left for get_workflow() to retry, so one agent can't stop the API booting.
+    """
+    for name in WORKFLOWS:
+        try:
+            _build(name)
+            timing = _timings[name]
+            logger.info("Workflow %s: import %sms, compile %sms", name, timing["import_ms"], timing["compile_ms"])
+        except Exception as e:
+            _timings[name] = {"error": str(e)}
+            logger.warning("Workflow %s failed to warm up: %s", name, e)
+    return dict(_timings)
+
+
+def get_workflow(name):
+    """Return the compiled workflow, compiling it now if warm_up() didn't"""
+    workflow = _compiled.get(name)
+    if workflow is None:
+        workflow = _build(name)
+    return workflow
+
+
+def timings():
+    return dict(_timings)
@@ -0,0 +1,335 @@
+"""Local k-means segmentation of customers for campaign creation; the LLM only names the segments."""
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from projections import customer_name
+
+SEGMENTATION_MODELS_COLLECTION = "segmentation_models"
+MAX_SEGMENTS = int(os.getenv("CAMPAIGN_MAX_SEGMENTS", "12"))
+CITY_VOCAB = 20
+SIZE_VOCAB = 10
+TERM_VOCAB = 60
+LOCALITY_VOCAB = 40
+SAMPLES_PER_SEGMENT = 3
+BLOCK_WEIGHTS = {"city": 1.0, "size": 0.5, "services": 1.0, "locality": 0.75}
+
+TOKEN_RE = re.compile(r"[a-z][a-z\-]{2,}")
+URL_RE = re.compile(r"(https?://|www\.)\S+|\S+@\S+")
+PIN_RE = re.compile(r"\b(\d{3})\s?(\d{3})\b")
+STOPWORDS = {
+    "and", "the", "for", "with", "our", "all", "are", "you", "your", "from", "offers", "offer",
+    "services", "service", "salon", "salons", "studio", "specializing", "specialized", "specialist",
+    "known", "full", "range", "one", "stop", "solution", "solutions", "also", "run", "runs", "by",
+    "expert", "experts", "expertise", "professional", "premium", "quality", "high", "best", "new",
+    "years", "more", "than", "into", "only", "own", "owned", "near", "opp", "opposite"
+}
+CITY_WORDS = {"delhi", "new delhi", "nd", "india", "ncr"}
+
+
+def service_terms(description):
+    """Distinct service keywords in a free-text description"""
+    text = URL_RE.sub(" ", (description or "").lower()).replace("clip in", "clip-in").replace("tape in", "tape-in")
+    return sorted({token.strip("-") for token in TOKEN_RE.findall(text) if token.strip("-") not in STOPWORDS})
+
+
+def locality_of(address):
+    """PIN code when the address has one, else its last non-city part"""
+    address = URL_RE.sub(" ", (address or "").lower())
+    pin = PIN_RE.search(address)
+    if pin:
+        return f"pin {pin.group(1)}{pin.group(2)}"
+    parts = [re.sub(r"[^a-z ]", "", part).strip() for part in address.split(",")]
+    parts = [part for part in parts if part and part not in CITY_WORDS]
+    return parts[-1] if parts else None
+
+
+def city_of(customer):
+    city = (customer.get("city") or "").strip().lower()
+    return city or "unknown"
+
+
+def name_of(customer):
+    # Rows loaded by populate.py keep the sheet's "Salon / Parlour" header
+    return customer_name(customer)
+
+
+def size_of(customer):
+    size = str(customer.get("size") or "").strip().lower()
+    return size or "unknown"
+
+
+def _l2_rows(block):
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return block / norms
+
+
+class FeatureSpace:
+    """Vocabularies learned from the customers at clustering time"""
+
+    def __init__(self, cities, sizes, terms, idf, localities, weights=None):
+        self.cities = list(cities)
+        self.sizes = list(sizes)
+        self.terms = list(terms)
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.localities = list(localities)
+        self.weights = dict(weights or BLOCK_WEIGHTS)
+        self._city_index = {value: i for i, value in enumerate(self.cities)}
+        self._size_index = {value: i for i, value in enumerate(self.sizes)}
+        self._term_index = {value: i for i, value in enumerate(self.terms)}
+        self._locality_index = {value: i for i, value in enumerate(self.localities)}
+
+    @classmethod
+    def fit(cls, customers):
+        cities = Counter(city_of(c) for c in customers)
+        sizes = Counter(size_of(c) for c in customers)
+        term_df = Counter(term for c in customers for term in service_terms(c.get("description")))
+        localities = Counter(locality_of(c.get("address")) for c in customers)
+        localities.pop(None, None)
+
+        n = max(1, len(customers))
+        # Terms/localities seen once carry no grouping signal
+        terms = [term for term, df in term_df.most_common(TERM_VOCAB) if df >= 2]
+        idf = [math.log((1 + n) / (1 + term_df[term])) + 1 for term in terms]
+        return cls(
+            cities=[city for city, _ in cities.most_common(CITY_VOCAB)],
+            sizes=[size for size, _ in sizes.most_common(SIZE_VOCAB)],
+            terms=terms,
+            idf=idf,
+            localities=[loc for loc, count in localities.most_common(LOCALITY_VOCAB) if count >= 2]
+        )
+
+    @property
+    def dimensions(self):
+        # +1 "other" column for city and size
+        return len(self.cities) + 1 + len(self.sizes) + 1 + len(self.terms) + len(self.localities)
+
+    def transform(self, customers):
+        n = len(customers)
+        city = np.zeros((n, len(self.cities) + 1), dtype=np.float32)
+        size = np.zeros((n, len(self.sizes) + 1), dtype=np.float32)
+        services = np.zeros((n, len(self.terms)), dtype=np.float32)
+        locality = np.zeros((n, len(self.localities)), dtype=np.float32)
+
+        for row, customer in enumerate(customers):
+            city[row, self._city_index.get(city_of(customer), len(self.cities))] = 1.0
+            size[row, self._size_index.get(size_of(customer), len(self.sizes))] = 1.0
+            for term in service_terms(customer.get("description")):
+                column = self._term_index.get(term)
+                if column is not None:
+                    services[row, column] = 1.0
+            column = self._locality_index.get(locality_of(customer.get("address")))
+            if column is not None:
+                locality[row, column] = 1.0
+
+        if len(self.terms):
+            services *= self.idf
+        blocks = [
+            _l2_rows(city) * self.weights["city"],
+            _l2_rows(size) * self.weights["size"],
+            _l2_rows(services) * self.weights["services"],
+            _l2_rows(locality) * self.weights["locality"]
+        ]
+        return np.hstack(blocks).astype(np.float32)
+
+    def to_doc(self):
+        return {
+            "cities": self.cities,
+            "sizes": self.sizes,
+            "terms": self.terms,
+            "idf": [float(value) for value in self.idf],
+            "localities": self.localities,
+            "weights": self.weights
+        }
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(doc["cities"], doc["sizes"], doc["terms"], doc["idf"], doc["localities"], doc.get("weights"))
+
+
+def squared_distances(X, centroids):
+    """n x k squared euclidean distances without materializing n x k x d"""
+    distances = (
+        np.einsum("ij,ij->i", X, X)[:, None]
+        - 2 * X @ centroids.T
+        + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+    )
+    return np.maximum(distances, 0)
+
+
+def _kmeans_pp(X, k, rng):
+    centroids = np.empty((k, X.shape[1]), dtype=X.dtype)
+    centroids[0] = X[rng.integers(len(X))]
+    closest = squared_distances(X, centroids[:1])[:, 0].astype(np.float64)
+    for i in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            centroids[i:] = X[rng.integers(len(X), size=k - i)]
+            break
+        centroids[i] = X[rng.choice(len(X), p=closest / total)]
+        closest = np.minimum(closest, squared_distances(X, centroids[i:i + 1])[:, 0])
+    return centroids
+
+
+def kmeans(X, k, n_init=4, max_iter=100, seed=42):
+    """Best of n_init k-means++ runs: (labels, centroids, inertia)"""
+    rng = np.random.default_rng(seed)
+    best = None
+    for _ in range(n_init):
+        centroids = _kmeans_pp(X, k, rng)
+        labels = None
+        for _ in range(max_iter):
+            distances = squared_distances(X, centroids)
+            new_labels = distances.argmin(axis=1)
+            if labels is not None and np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            # Empty clusters are re-seeded with the worst-served points, a
+            # different one each
+            worst = None
+            for cluster in range(k):
+                members = X[labels == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+                else:
+                    if worst is None:
+                        worst = iter(np.argsort(-distances.min(axis=1)))
+                    centroids[cluster] = X[next(worst)]
+        # Labels, and so inertia and distances, must match the final centroids
+        # even when max_iter ran out right after an update
+        distances = squared_distances(X, centroids)
+        labels = distances.argmin(axis=1)
+        inertia = float(distances[np.arange(len(X)), labels].sum())
+        if best is None or inertia < best[2]:
+            best = (labels, centroids.copy(), inertia)
+    return best
+
+
+def choose_k(n):
+    """CAMPAIGN_SEGMENTS when set, else ~sqrt(n/2) capped at MAX_SEGMENTS"""
+    configured = int(os.getenv("CAMPAIGN_SEGMENTS", "0"))
+    k = configured or round(math.sqrt(n / 2))
+    return max(1, min(k, MAX_SEGMENTS, n))
+
+
+def _top(counter, total, limit=5):
+    return [{"value": value, "share": round(count / total, 2)} for value, count in counter.most_common(limit)]
+
+
+def describe_segments(customers, X, labels, centroids):
+    """Per-cluster statistics and the samples nearest each centroid"""
+    distances = np.sqrt(squared_distances(X, centroids)[np.arange(len(X)), labels])
+    segments = []
+    for cluster in range(len(centroids)):
+        members = np.flatnonzero(labels == cluster)
+        if not len(members):
+            continue
+        docs = [customers[i] for i in members]
+        total = len(docs)
+        nearest = members[np.argsort(distances[members])[:SAMPLES_PER_SEGMENT]]
+        localities = Counter(locality_of(doc.get("address")) for doc in docs)
+        localities.pop(None, None)
+        segments.append({
+            "segment": cluster,
+            "size": total,
+            "cities": _top(Counter(city_of(doc) for doc in docs), total),
+            "sizes": _top(Counter(size_of(doc) for doc in docs), total),
+            "services": _top(Counter(term for doc in docs for term in service_terms(doc.get("description"))), total, 8),
+            "localities": _top(localities, total),
+            "mean_distance": round(float(distances[members].mean()), 4),
+            "distance_p95": round(float(np.percentile(distances[members], 95)), 4),
+            "samples": [
+                {
+                    "name": name_of(customers[i]),
+                    "city": customers[i].get("city", ""),
+                    "description": (customers[i].get("description") or "")[:160]
+                }
+                for i in nearest
+            ]
+        })
+    return segments, distances
+
+
+def _format_top(entries):
+    return ", ".join(f"{entry['value']} ({entry['share']:.0%})" for entry in entries) or "n/a"
+
+
+def build_naming_prompt(segments):
+    lines = []
+    for segment in segments:
+        samples = "; ".join(f"{s['name']}: {s['description']}" for s in segment["samples"])
+        lines.append(
+            f"Segment {segment['segment']} ({segment['size']} customers)\n"
+            f"  cities: {_format_top(segment['cities'])}\n"
+            f"  sizes: {_format_top(segment['sizes'])}\n"
+            f"  services: {_format_top(segment['services'])}\n"
+            f"  localities: {_format_top(segment['localities'])}\n"
+            f"  examples: {samples}"
+        )
+    segment_text = "\n\n".join(lines)
+    return f"""You are a professional CRM analyst and campaign strategist.
+
+Our customers (salons and parlours) have already been grouped into segments by
+location, size and the services they offer. For each segment below, name a
+marketing campaign that targets it.
+
+{segment_text}
+
+Reply with only a JSON array, one object per segment, in this form:
+[{{"segment": 0, "name": "short campaign name", "description": "one sentence describing the campaign focus and who it targets"}}]
+"""
+
+
+def default_segment_name(segment):
+    city = segment["cities"][0]["value"] if segment["cities"] else "unknown"
+    place = city.title() if city != "unknown" else "All areas"
+    services = ", ".join(entry["value"] for entry in segment["services"][:2]) or "general"
+    return {
+        "name": f"{place}: {services}",
+        "description": f"{segment['size']} customers ({place}) focused on {services}"
+    }
+
+
+def parse_segment_names(text, segments):
+    """segment -> {name, description} from the LLM reply, with generated fallbacks"""
+    names = {}
+    match = re.search(r"\[.*\]", text or "", re.DOTALL)
+    if match:
+        try:
+            for entry in json.loads(match.group(0)):
+                if isinstance(entry, dict) and "segment" in entry:
+                    names[int(entry["segment"])] = {
+                        "name": str(entry.get("name", "")).strip(),
+                        "description": str(entry.get("description", "")).strip()
+                    }
+        except (ValueError, TypeError):
+            names = {}
+    result = {}
+    for segment in segments:
+        named = names.get(segment["segment"])
+        if not named or not (named["name"] or named["description"]):
+            named = default_segment_name(segment)
+        result[segment["segment"]] = named
+    return result
+
+
+def segment_customers(customers, k=None):
+    """Fit the feature space and cluster customers (CPU-bound; run in a thread)"""
+    space = FeatureSpace.fit(customers)
+    X = space.transform(customers)
+    k = k or choose_k(len(customers))
+    labels, centroids, inertia = kmeans(X, k)
+    segments, distances = describe_segments(customers, X, labels, centroids)
+    return {
+        "space": space,
+        "labels": labels,
+        "centroids": centroids,
+        "inertia": inertia,
+        "distances": distances,
+        "segments": segments
+    }
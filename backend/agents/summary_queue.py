@@ -0,0 +1,293 @@
+"""Write-behind conversation summary updates: a durable per-customer queue in `summary_queue`
+drained by leased background workers."""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ASCENDING, ReturnDocument
+from database import db, convosummary_collection
+from agents.models import create_model
+from agents.llm_cache import generate_text
+from agents.llm_gateway import BATCH, LLMGatewayBusy, llm_gateway
+from versions import SUMMARIES, bump_versions
+from agents.prompt_builder import ITEM_TOKENS, TOKEN_BUDGET, estimate_tokens, fit_prompt
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+llm = create_model('gemini-2.5-flash', GEMINI_API_KEY)
+
+SUMMARY_QUEUE_COLLECTION = "summary_queue"
+POLL_SECONDS = 5
+MAX_BACKOFF_SECONDS = 300
+# Time left over from the longest possible pass for the Mongo reads and writes
+LEASE_MARGIN_SECONDS = 30
+
+
+def format_event(event):
+    who = "Agent (us)" if event.get("sender") == "me" else "Customer"
+    return f"- {event.get('date')}: [{event.get('type')}] {who}: {event.get('summary')}"
+
+
+def build_summary_prompt(previous_summary, events):
+    """One prompt that folds every pending event into the previous summary,
+    fitted to the prompt token budget"""
+    def render(summary, lines, omitted):
+        new_interactions = "\n".join(lines)
+        if omitted:
+            new_interactions = f"({omitted} earlier interactions omitted)\n" + new_interactions
+        return f"""
+PREVIOUS CONVERSATION SUMMARY:
+{summary or 'No previous summary'}
+
+NEW INTERACTIONS SINCE THAT SUMMARY (oldest first):
+{new_interactions}
+
+---
+
+Create a concise updated summary (max 250 words) that:
+1. Maintains key points from previous interactions
+2. Integrates the new interactions above, in order
+3. Highlights the customer's needs, concerns, or objections and their sentiment
+4. Tracks the stage of the conversation (cold, interested, negotiating, ready to buy, etc.)
+5. Identifies the next expected steps
+
+Keep it brief, focused on actionable insights, and written from a neutral, analytical perspective.
+"""
+
+    return fit_prompt("summary_update", render, previous_summary, events, format_event)
+
+
+def events_for_pass(pending):
+    """Oldest pending events that fit in half the prompt budget (at least one);
+    the rest stay queued for the next pass instead of being trimmed away"""
+    taken, tokens = [], 0
+    for event in pending:
+        tokens += min(estimate_tokens(format_event(event)), ITEM_TOKENS)
+        if taken and tokens > TOKEN_BUDGET // 2:
+            break
+        taken.append(event)
+    return taken
+
+
+class SummaryQueue:
+    def __init__(self, collection, max_workers=2, lease_seconds=120, llm_timeout=60, max_attempts=8):
+        self.collection = collection
+        self.max_workers = max_workers
+        # Gateway queue wait plus the model call itself
+        self.call_timeout = llm_gateway.queue_timeout + llm_timeout
+        self.lease = timedelta(seconds=max(lease_seconds, self.call_timeout + LEASE_MARGIN_SECONDS))
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = None
+        self._workers = []
+        self.counters = {
+            "enqueued": 0,
+            "events_summarized": 0,
+            "llm_calls": 0,
+            "failures": 0,
+            "leases_lost": 0,
+            "dead_lettered": 0
+        }
+
+    def start(self):
+        # Created here so the event belongs to the running event loop
+        self._wakeup = asyncio.Event()
+        for i in range(self.max_workers):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+        logger.info("Summary queue started with %d workers", self.max_workers)
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def enqueue(self, customer_id, sender, interaction_type, summary, date=None):
+        """Record that customer_id's summary needs to absorb this interaction"""
+        now = datetime.utcnow()
+        event = {
+            "id": ObjectId(),
+            "sender": sender,
+            "type": interaction_type,
+            "summary": summary,
+            "date": date or now
+        }
+        await self.collection.update_one(
+            {"_id": ObjectId(customer_id)},
+            {
+                "$push": {"pending": event},
+                "$set": {"updated_at": now},
+                # A new event gives a dead-lettered customer another try
+                "$unset": {"dead_lettered_at": ""},
+                "$setOnInsert": {"enqueued_at": now, "attempts": 0}
+            },
+            upsert=True
+        )
+        self.counters["enqueued"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return event["id"]
+
+    async def _claim(self, customer_id=None):
+        now = datetime.utcnow()
+        query = {
+            "pending.0": {"$exists": True},
+            "dead_lettered_at": None,
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+        }
+        if customer_id is not None:
+            query["_id"] = ObjectId(customer_id)
+        return await self.collection.find_one_and_update(
+            query,
+            {"$set": {"lease_until": now + self.lease, "leased_by": self.worker_id}},
+            sort=[("enqueued_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _process(self, doc):
+        customer_id = doc["_id"]
+        events = events_for_pass(doc["pending"])
+        try:
+            current = await convosummary_collection.find_one({"_id": customer_id}, {"summary": 1})
+            prompt = build_summary_prompt(current.get("summary", "") if current else "", events)
+            new_summary = await asyncio.wait_for(
+                generate_text(llm, prompt, priority=BATCH, agent="summary_queue"),
+                self.call_timeout
+            )
+            self.counters["llm_calls"] += 1
+
+            now = datetime.utcnow()
+            # The lease may have expired while the call ran and another worker
+            # may already have rewritten the summary; only write while holding it
+            held = await self.collection.find_one_and_update(
+                {"_id": customer_id, "leased_by": self.worker_id, "lease_until": {"$gt": now}},
+                {"$set": {"lease_until": now + self.lease}}
+            )
+            if held is None:
+                self.counters["leases_lost"] += 1
+                logger.warning("Summary lease for %s expired during the LLM call, discarding the result", customer_id)
+                return False
+
+            await convosummary_collection.update_one(
+                {"_id": customer_id},
+                {"$set": {"summary": new_summary, "last_updated": now}},
+                upsert=True
+            )
+            await bump_versions(db, SUMMARIES)
+            await self.collection.update_one(
+                {"_id": customer_id, "leased_by": self.worker_id},
+                {
+                    "$pull": {"pending": {"id": {"$in": [event["id"] for event in events]}}},
+                    "$set": {"attempts": 0, "enqueued_at": now, "updated_at": now},
+                    "$unset": {"lease_until": "", "leased_by": "", "last_error": ""}
+                }
+            )
+            # Only drop the document if nothing new arrived meanwhile
+            await self.collection.delete_one({"_id": customer_id, "pending": {"$size": 0}, "lease_until": None})
+            self.counters["events_summarized"] += len(events)
+            logger.info("Summary updated for %s from %d event(s)", customer_id, len(events))
+        except Exception as e:
+            self.counters["failures"] += 1
+            error = str(e) or type(e).__name__
+            if isinstance(e, LLMGatewayBusy):
+                # Backpressure, not a problem with this customer's summary
+                attempts = doc.get("attempts", 0)
+                backoff = e.retry_after
+            else:
+                attempts = doc.get("attempts", 0) + 1
+                backoff = min(MAX_BACKOFF_SECONDS, 2 ** attempts)
+            update = {
+                "attempts": attempts,
+                "last_error": error,
+                "lease_until": datetime.utcnow() + timedelta(seconds=backoff)
+            }
+            dead = attempts >= self.max_attempts
+            if dead:
+                update["dead_lettered_at"] = datetime.utcnow()
+            result = await self.collection.update_one(
+                {"_id": customer_id, "leased_by": self.worker_id},
+                {"$set": update, "$unset": {"leased_by": ""}}
+            )
+            if dead and result.modified_count:
+                self.counters["dead_lettered"] += 1
+                logger.error("Summary update for %s failed %d times, dead-lettered: %s", customer_id, attempts, error)
+            else:
+                logger.warning("Summary update for %s failed (attempt %d), retrying in %ss: %s", customer_id, attempts, backoff, error)
+            return False
+        return True
+
+    async def _worker(self, index):
+        while True:
+            try:
+                doc = await self._claim()
+                if doc is not None:
+                    await self._process(doc)
+                    continue
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Summary worker %d error", index)
+                await asyncio.sleep(POLL_SECONDS)
+
+    async def drain(self, customer_id, timeout=60):
+        """Process customer_id's pending events now (used by the terminal agents)"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while asyncio.get_running_loop().time() < deadline:
+            doc = await self._claim(customer_id)
+            if doc is not None:
+                await self._process(doc)
+                continue
+            remaining = await self.collection.find_one(
+                {"_id": ObjectId(customer_id), "pending.0": {"$exists": True}, "dead_lettered_at": None}, {"_id": 1}
+            )
+            if remaining is None:
+                return True
+            # Leased by another worker or backing off after a failure
+            await asyncio.sleep(1)
+        return False
+
+    async def stats(self):
+        now = datetime.utcnow()
+        pipeline = [
+            {"$group": {
+                "_id": None,
+                "customers": {"$sum": 1},
+                "events": {"$sum": {"$size": {"$ifNull": ["$pending", []]}}},
+                "oldest": {"$min": "$enqueued_at"},
+                "failing": {"$sum": {"$cond": [{"$gt": ["$attempts", 0]}, 1, 0]}},
+                "dead_lettered": {"$sum": {"$cond": [{"$ifNull": ["$dead_lettered_at", False]}, 1, 0]}}
+            }}
+        ]
+        result = await self.collection.aggregate(pipeline).to_list(1)
+        backlog = result[0] if result else {"customers": 0, "events": 0, "oldest": None, "failing": 0, "dead_lettered": 0}
+        return {
+            "worker": {**self.counters, "workers": len(self._workers)},
+            "backlog": {
+                "customers": backlog["customers"],
+                "events": backlog["events"],
+                "failing": backlog["failing"],
+                "dead_lettered": backlog["dead_lettered"],
+                "oldest_age_seconds": round((now - backlog["oldest"]).total_seconds(), 1) if backlog.get("oldest") else None
+            }
+        }
+
+
+summary_queue = SummaryQueue(
+    db[SUMMARY_QUEUE_COLLECTION],
+    max_workers=int(os.getenv("SUMMARY_WORKERS", "2")),
+    lease_seconds=int(os.getenv("SUMMARY_LEASE_SECONDS", "120")),
+    llm_timeout=float(os.getenv("SUMMARY_LLM_TIMEOUT_SECONDS", "60")),
+    max_attempts=int(os.getenv("SUMMARY_MAX_ATTEMPTS", "8"))
+)
@@ -0,0 +1,108 @@
+"""Benchmark the old serialize_docs/jsonable_encoder path against responses.py.
+
+    python bench_responses.py [documents] [repeats]
+"""
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from fastapi.encoders import jsonable_encoder
+
+from responses import decode_raw_batch, dumps, loads
+
+CITIES = ["Delhi", "Mumbai", "Bangalore", "Pune", "Jaipur"]
+SIZES = ["Small", "Medium", "Large"]
+
+
+def make_customers(n):
+    now = datetime(2025, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"Salon {i}",
+            "contact_number": f"98{i:08d}",
+            "address": f"{i} Main Road, Sector {i % 60}, pin 1100{i % 90:02d}",
+            "instagram_id": f"@salon{i}",
+            "description": "Hair extensions, keratin, clip-in and tape-in, bridal makeup",
+            "google_maps_link": f"https://maps.google.com/?q=salon{i}",
+            "email": f"salon{i}@example.com",
+            "city": random.choice(CITIES),
+            "size": random.choice(SIZES),
+            "created_at": now + timedelta(minutes=i)
+        }
+        for i in range(n)
+    ]
+
+
+def old_serialize_docs(docs):
+    # The removed main.serialize_docs: copy top-level ObjectIds to str
+    for doc in docs:
+        for key, value in doc.items():
+            if isinstance(value, ObjectId):
+                doc[key] = str(value)
+    return docs
+
+
+def old_response(docs):
+    docs = [dict(doc) for doc in docs]
+    return json.dumps(jsonable_encoder(old_serialize_docs(docs)), separators=(",", ":")).encode()
+
+
+def old_tool_roundtrip(docs):
+    return json.loads(json.dumps([dict(doc) for doc in docs], default=str))
+
+
+def new_response(docs):
+    return dumps(docs)
+
+
+def new_tool_roundtrip(docs):
+    return loads(dumps(docs))
+
+
+def raw_response(raw_docs):
+    return dumps(decode_raw_batch(raw_docs))
+
+
+def driver_decode_response(raw_docs):
+    # What the driver does without RawBSONDocument: one dict per document
+    return dumps([bson.decode(doc.raw) for doc in raw_docs])
+
+
+def bench(name, fn, arg, repeats):
+    fn(arg)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - started)
+    best = min(timings) * 1000
+    print(f"{name:<38} best {best:8.2f} ms   mean {sum(timings) / len(timings) * 1000:8.2f} ms")
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    docs = make_customers(n)
+    raw_docs = [RawBSONDocument(bson.encode(doc)) for doc in docs]
+
+    print(f"{n} customer documents, best of {repeats}")
+    old = bench("serialize_docs + jsonable_encoder + json", old_response, docs, repeats)
+    new = bench("responses.dumps (orjson)", new_response, docs, repeats)
+    bench("raw BSON, per-document decode + dumps", driver_decode_response, raw_docs, repeats)
+    raw = bench("raw BSON, batch decode_all + dumps", raw_response, raw_docs, repeats)
+    print(f"   response speed-up: {old / new:.1f}x from dicts, {old / raw:.1f}x from raw BSON (incl. decode)")
+
+    old_tool = bench("agent tool json.dumps/json.loads", old_tool_roundtrip, docs, repeats)
+    new_tool = bench("agent tool dumps_text/loads", new_tool_roundtrip, docs, repeats)
+    print(f"   tool round-trip speed-up: {old_tool / new_tool:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
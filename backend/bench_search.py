@@ -0,0 +1,93 @@
+"""Benchmark the in-process customer search index on synthetic customers.
+
+    python bench_search.py [customers] [queries]
+"""
+import random
+import resource
+import sys
+import time
+
+from bson import ObjectId
+
+from customer_search import CustomerSearchIndex
+
+FIRST = ["Glamour", "Glow", "Style", "Studio", "Looks", "Mirror", "Velvet", "Blush", "Shine", "Trends",
+         "Bliss", "Aura", "Crown", "Silk", "Elite", "Urban", "Royal", "Posh", "Diva", "Lush"]
+SECOND = ["Salon", "Parlour", "Hair Studio", "Beauty Lounge", "Unisex Salon", "Makeover", "Spa", "Clinic"]
+AREAS = ["Rajouri Garden", "Lajpat Nagar", "Karol Bagh", "Saket", "Dwarka", "Janakpuri", "Pitampura",
+         "Vasant Kunj", "Hauz Khas", "Connaught Place", "Greater Kailash", "Punjabi Bagh"]
+CITIES = ["Delhi", "Mumbai", "Bangalore", "Pune", "Jaipur", "Chandigarh"]
+SERVICES = ["hair extensions", "keratin", "bridal makeup", "nail art", "wigs", "hair patch", "clip-in",
+            "tape-in", "balayage", "smoothening", "facials", "waxing", "threading", "hair spa"]
+
+
+def make_customers(n, seed=7):
+    rng = random.Random(seed)
+    customers = []
+    for i in range(n):
+        name = f"{rng.choice(FIRST)} {rng.choice(SECOND)}"
+        if rng.random() < 0.5:
+            name += f" {rng.choice(AREAS).split()[0]}"
+        customers.append({
+            "_id": ObjectId(),
+            "name": name,
+            "city": rng.choice(CITIES),
+            "size": rng.choice(["Small", "Medium", "Large"]),
+            "instagram_id": f"@{name.lower().replace(' ', '')}{i}",
+            "address": f"{rng.randint(1, 300)}, {rng.choice(AREAS)}, {rng.choice(CITIES)} {110000 + rng.randint(1, 99)}",
+            "description": f"Offers {', '.join(rng.sample(SERVICES, 3))} and more"
+        })
+    return customers
+
+
+def make_queries(n, seed=11):
+    rng = random.Random(seed)
+    vocabulary = [word.lower() for word in FIRST + AREAS + SERVICES + SECOND for word in word.split()]
+    queries = []
+    for _ in range(n):
+        words = [rng.choice(vocabulary) for _ in range(rng.choice([1, 1, 2, 2, 3]))]
+        # Typeahead: the last word is still being typed
+        last = words[-1]
+        words[-1] = last[:rng.randint(2, len(last))] if len(last) > 2 else last
+        queries.append(" ".join(words))
+    return queries
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    customers = make_customers(n)
+    queries = make_queries(query_count)
+
+    index = CustomerSearchIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    index.add(customers)
+    index.search("warm up")
+    build_ms = (time.perf_counter() - started) * 1000
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{n} customers indexed in {build_ms:.0f} ms, ~{(rss_after - rss_before) / 1024:.0f} MB")
+    print(f"vocabulary: {index.stats()['vocabulary']}")
+
+    timings = []
+    empty = 0
+    for query in queries:
+        started = time.perf_counter()
+        results = index.search(query, limit=10)
+        timings.append((time.perf_counter() - started) * 1000)
+        empty += not results
+    print(f"{len(queries)} queries: p50 {percentile(timings, 50):.2f} ms, p95 {percentile(timings, 95):.2f} ms, "
+          f"p99 {percentile(timings, 99):.2f} ms, max {max(timings):.2f} ms ({empty} without results)")
+
+    for query in ["gl", "glamour sal", "rajouri", "keratin saket", "blush parlour kar"]:
+        results = index.search(query, limit=3)
+        print(f"  {query!r}: " + "; ".join(f"{doc['name']} ({score})" for score, doc in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Typeahead customer search from a per-worker in-process prefix index, with the customers_text index as fallback."""
+import asyncio
+import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from heapq import nsmallest
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from projections import LEGACY_NAME_FIELD, customer_name
+from versions import CUSTOMERS, current_versions
+
+logger = logging.getLogger(__name__)
+
+FIELD_WEIGHTS = {"name": 8, "instagram_id": 4, "address": 2, "description": 1}
+SEARCH_FIELDS = ("name", LEGACY_NAME_FIELD, "city", "size", "instagram_id", "address", "description")
+RESULT_FIELDS = ("name", LEGACY_NAME_FIELD, "city", "size", "instagram_id")
+MIN_PREFIX = int(os.getenv("SEARCH_MIN_PREFIX", "2"))
+CANDIDATE_CAP = int(os.getenv("SEARCH_CANDIDATE_CAP", "2000"))
+REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", "2"))
+# ObjectIds from different workers are only ordered to the second
+REFRESH_OVERLAP = timedelta(seconds=5)
+LOAD_BATCH_SIZE = 5000
+LOOKUP_CACHE_SIZE = int(os.getenv("SEARCH_LOOKUP_CACHE_SIZE", "2048"))
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+URL_NOISE = {"http", "https", "www", "com", "instagram", "in", "p"}
+
+
+def tokenize(text, field=None):
+    tokens = TOKEN_RE.findall(str(text or "").lower())
+    if field == "instagram_id":
+        tokens = [token for token in tokens if token not in URL_NOISE]
+    return tokens
+
+
+def field_value(customer, field):
+    return customer_name(customer) if field == "name" else customer.get(field)
+
+
+def result_doc(customer):
+    """Search result fields, with the legacy name column folded into name"""
+    return {
+        "_id": customer.get("_id"),
+        **{field: field_value(customer, field) for field in RESULT_FIELDS if field != LEGACY_NAME_FIELD}
+    }
+
+
+def _update_cached(cache, token, slot, whole_words=False):
+    """Add slot to every cached lookup that token satisfies"""
+    if not cache:
+        return
+    keys = [token[:end] for end in range(1, len(token) + 1)]
+    if whole_words:
+        keys.append("=" + token)
+    for key in keys:
+        cached = cache.get(key)
+        if cached is not None:
+            cached.add(slot)
+
+
+class FieldIndex:
+    """Sorted vocabulary plus posting lists for one field"""
+
+    def __init__(self):
+        self.postings = {}
+        self.vocabulary = []
+        self._dirty = False
+        # Set form of recent lookups ("=" + token for whole words); typeahead
+        # repeats the same prefixes as users type. Kept current by add().
+        self._cache = {}
+
+    def add(self, slot, tokens):
+        for token in set(tokens):
+            posting = self.postings.get(token)
+            if posting is None:
+                self.postings[token] = [slot]
+                self._dirty = True
+            else:
+                posting.append(slot)
+            _update_cached(self._cache, token, slot, whole_words=True)
+
+    def _sorted_vocabulary(self):
+        # New tokens are sorted in lazily, once per batch of inserts
+        if self._dirty:
+            self.vocabulary = sorted(self.postings)
+            self._dirty = False
+        return self.vocabulary
+
+    def match(self, term, prefix=True):
+        """Slots whose field has a token starting with (or, with prefix=False, equal to) term.
+
+        The returned set is shared with the cache; callers must not mutate it.
+        """
+        key = term if prefix else "=" + term
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        if not prefix:
+            slots = set(self.postings.get(term, ()))
+        else:
+            vocabulary = self._sorted_vocabulary()
+            start = bisect_left(vocabulary, term)
+            end = bisect_left(vocabulary, term + "\uffff", start)
+            slots = set().union(*(self.postings[token] for token in vocabulary[start:end]))
+        if len(self._cache) >= LOOKUP_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[key] = slots
+        return slots
+
+
+class CustomerSearchIndex:
+    def __init__(self):
+        self.fields = {field: FieldIndex() for field in FIELD_WEIGHTS}
+        self.docs = []
+        self.sort_names = []
+        self.slots = {}
+        self.version = None
+        self.ready = False
+        self.loaded_until = None
+        self.built_ms = None
+        # term -> slots matching it in any field, kept current like FieldIndex._cache
+        self._any_field_cache = {}
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self._build_task = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, customers):
+        """Index inserted customer documents; already indexed ones are skipped"""
+        added = 0
+        for customer in customers:
+            customer_id = customer.get("_id")
+            if customer_id is None or customer_id in self.slots:
+                continue
+            slot = len(self.docs)
+            self.slots[customer_id] = slot
+            doc = result_doc(customer)
+            self.docs.append(doc)
+            self.sort_names.append(str(doc["name"] or "").lower())
+            tokens = set()
+            for field, index in self.fields.items():
+                field_tokens = tokenize(field_value(customer, field), field)
+                index.add(slot, field_tokens)
+                tokens.update(field_tokens)
+            for token in tokens:
+                _update_cached(self._any_field_cache, token, slot)
+            added += 1
+        return added
+
+    def search(self, query, limit=10):
+        """Ranked [(score, doc)] for a typeahead query; every term matches as a prefix"""
+        terms = tokenize(query)
+        if not terms or (len(terms) == 1 and len(terms[0]) < MIN_PREFIX):
+            return []
+
+        per_term = []
+        for term in terms:
+            matches = {field: index.match(term) for field, index in self.fields.items()}
+            any_field = self._any_field_cache.get(term)
+            if any_field is None:
+                if len(self._any_field_cache) >= LOOKUP_CACHE_SIZE:
+                    self._any_field_cache.clear()
+                any_field = self._any_field_cache[term] = set().union(*matches.values())
+            per_term.append((term, matches, any_field))
+
+        candidates = None
+        for _, _, docs in sorted(per_term, key=lambda entry: len(entry[2])):
+            # The first set is shared with the cache; & makes new ones
+            candidates = docs if candidates is None else candidates & docs
+            if not candidates:
+                return []
+
+        if len(candidates) > CANDIDATE_CAP:
+            # Broad prefixes: prefer documents where every term hits the name
+            in_name = candidates.intersection(*(matches["name"] for _, matches, _ in per_term))
+            if len(in_name) >= limit:
+                candidates = in_name
+            candidates = set(islice(candidates, CANDIDATE_CAP))
+
+        # Per term, every candidate scores the weight of the best level it is in
+        scores = dict.fromkeys(candidates, 0)
+        for term, matches, _ in per_term:
+            levels = []
+            for field, weight in FIELD_WEIGHTS.items():
+                levels.append((weight * 2, self.fields[field].match(term, prefix=False)))
+                levels.append((weight, matches[field]))
+            levels.sort(key=lambda level: -level[0])
+            remaining = set(candidates)
+            for weight, slots in levels:
+                hit = remaining.intersection(slots)
+                if not hit:
+                    continue
+                for slot in hit:
+                    scores[slot] += weight
+                remaining -= hit
+                if not remaining:
+                    break
+
+        by_score = {}
+        for slot, score in scores.items():
+            by_score.setdefault(score, []).append(slot)
+        results = []
+        for score in sorted(by_score, reverse=True):
+            # Only the buckets that make the cut are ordered by name
+            for slot in nsmallest(limit - len(results), by_score[score], key=self.sort_names.__getitem__):
+                results.append((score, self.docs[slot]))
+            if len(results) >= limit:
+                break
+        return results
+
+    async def refresh(self, collection, db, force=False):
+        """Pull customers inserted since the last refresh (all of them on first use)"""
+        now = time.monotonic()
+        if not force and self.ready and now - self._checked_at < REFRESH_SECONDS:
+            return 0
+        async with self._lock:
+            if not force and self.ready and time.monotonic() - self._checked_at < REFRESH_SECONDS:
+                return 0
+            self._checked_at = time.monotonic()
+            version = (await current_versions(db, [CUSTOMERS]))[CUSTOMERS]
+            if self.ready and version == self.version:
+                return 0
+
+            started = time.perf_counter()
+            # Local adds don't move the watermark, so other workers' inserts
+            # from before them are still pulled
+            loaded_until = datetime.now(timezone.utc)
+            query = {}
+            if self.loaded_until is not None:
+                query["_id"] = {"$gte": ObjectId.from_datetime(self.loaded_until - REFRESH_OVERLAP)}
+            projection = {field: 1 for field in SEARCH_FIELDS}
+            added = 0
+            cursor = collection.find(query, projection).sort("_id", ASCENDING).batch_size(LOAD_BATCH_SIZE)
+            batch = []
+            async for customer in cursor:
+                batch.append(customer)
+                if len(batch) >= LOAD_BATCH_SIZE:
+                    added += self.add(batch)
+                    batch = []
+            added += self.add(batch)
+
+            self.version = version
+            self.loaded_until = loaded_until
+            if not self.ready:
+                self.built_ms = round((time.perf_counter() - started) * 1000, 1)
+                logger.info("Customer search index built: %d customers in %sms", len(self), self.built_ms)
+            self.ready = True
+            return added
+
+    def build_in_background(self, collection, db):
+        """Start the initial build unless it is done or already running"""
+        if self.ready or (self._build_task and not self._build_task.done()):
+            return
+        self._build_task = asyncio.create_task(self._build(collection, db))
+
+    async def _build(self, collection, db):
+        try:
+            await self.refresh(collection, db, force=True)
+        except Exception:
+            logger.exception("Customer search index build failed")
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "customers": len(self),
+            "built_ms": self.built_ms,
+            "vocabulary": {field: len(index.postings) for field, index in self.fields.items()}
+        }
+
+
+async def text_search(collection, query, limit=10):
+    """Fallback while the in-process index is building: the customers_text index"""
+    projection = {field: 1 for field in RESULT_FIELDS}
+    projection["score"] = {"$meta": "textScore"}
+    cursor = collection.find({"$text": {"$search": query}}, projection).sort([("score", {"$meta": "textScore"})]).limit(limit)
+    return [{**result_doc(doc), "score": doc["score"]} for doc in await cursor.to_list(limit)]
+
+
+customer_search = CustomerSearchIndex()
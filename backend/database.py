@@ -0,0 +1,135 @@
+"""Shared MongoDB client and connection pool for the API and every agent, one per worker process."""
+import logging
+import os
+import threading
+from collections import defaultdict
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from metrics import MongoCommandMetrics, record_pool_event
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+ATLAS_URI = os.getenv("MONGODB_URI")
+if not ATLAS_URI:
+    raise ValueError("ATLAS_URI not found in .env file")
+
+DB_NAME = "crm_db"
+
+POOL_ENV_OPTIONS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", 20),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", 0),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", 60000),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", 10000),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", None),
+}
+
+
+def pool_options():
+    """Read pool sizing and timeout options from the environment"""
+    options = {}
+    for option, (env_name, default) in POOL_ENV_OPTIONS.items():
+        value = os.getenv(env_name)
+        if value is not None and value != "":
+            options[option] = int(value)
+        elif default is not None:
+            options[option] = default
+    return options
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events per server address.
+
+    The driver calls these hooks from its own threads, hence the lock. Every
+    change is mirrored into the mongodb_pool_* Prometheus metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def _inc(self, address, key, amount=1):
+        server = f"{address[0]}:{address[1]}"
+        with self._lock:
+            self._stats[server][key] += amount
+        record_pool_event(server, key, amount)
+
+    def pool_created(self, event):
+        self._inc(event.address, "pools_created")
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc(event.address, "pools_cleared")
+
+    def pool_closed(self, event):
+        self._inc(event.address, "pools_closed")
+
+    def connection_created(self, event):
+        self._inc(event.address, "open")
+        self._inc(event.address, "created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc(event.address, "open", -1)
+        self._inc(event.address, "closed")
+
+    def connection_check_out_started(self, event):
+        self._inc(event.address, "waiting")
+
+    def connection_check_out_failed(self, event):
+        self._inc(event.address, "waiting", -1)
+        self._inc(event.address, "checkout_failed")
+
+    def connection_checked_out(self, event):
+        self._inc(event.address, "waiting", -1)
+        self._inc(event.address, "in_use")
+        self._inc(event.address, "checkouts")
+
+    def connection_checked_in(self, event):
+        self._inc(event.address, "in_use", -1)
+
+    def snapshot(self):
+        with self._lock:
+            return {address: dict(counters) for address, counters in self._stats.items()}
+
+
+pool_listener = PoolStatsListener()
+command_listener = MongoCommandMetrics()
+
+client = AsyncIOMotorClient(
+    ATLAS_URI, connect=False, event_listeners=[pool_listener, command_listener], **pool_options()
+)
+db = client[DB_NAME]
+customers_collection = db["customers"]
+campaigns_collection = db["campaigns"]
+mapcamp_collection = db["mapcamp"]
+interactions_collection = db["interactions"]
+convosummary_collection = db["convosummary"]
+
+
+async def connect():
+    """Open the pool: ping the server so the first request doesn't pay for it"""
+    await db.command("ping")
+    logger.info("MongoDB connected (pool options: %s)", pool_options())
+
+
+def close():
+    client.close()
+    logger.info("MongoDB connection closed")
+
+
+def pool_stats():
+    """Configured pool options plus live per-server connection counters"""
+    return {
+        "options": pool_options(),
+        "servers": pool_listener.snapshot()
+    }
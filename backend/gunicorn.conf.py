@@ -0,0 +1,24 @@
+"""gunicorn settings for the API: gunicorn main:app -c gunicorn.conf.py"""
+import glob
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))
+# Set before any worker imports prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/crm-prometheus")
+
+
+def on_starting(server):
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    # Samples from a previous run would otherwise be merged into this one
+    for stale in glob.glob(os.path.join(path, "*.db")):
+        os.remove(stale)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,158 @@
+"""Streaming TSV/CSV customer import, using the same header and cell clean-up rules as populate.py."""
+import asyncio
+import codecs
+import csv
+import logging
+import re
+from datetime import datetime
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+TSV_SPLIT = re.compile(r'\t{1,}')
+MAX_REPORTED_ERRORS = 1000
+
+# Normalized sheet headers that map onto Customer fields under another name
+HEADER_ALIASES = {
+    "salon__parlour": "name",
+    "salon_parlour": "name",
+    "salon": "name",
+    "business_name": "name",
+}
+
+
+def normalize_headers(header_line: str, delimiter: str = "\t") -> list[str]:
+    """Turn a raw header line into snake_case field names"""
+    header_line = header_line.replace('/', '').replace('|', '').strip()
+    if delimiter == "\t":
+        raw_headers = TSV_SPLIT.split(header_line)
+    else:
+        raw_headers = next(csv.reader([header_line], delimiter=delimiter))
+    return [h.strip().lower().replace(' ', '_').replace('-', '_') for h in raw_headers]
+
+
+def build_record(headers: list[str], values: list[str]) -> dict:
+    """Pair cleaned cell values with headers, padding or truncating the row"""
+    values = list(values)
+    # Fill missing trailing fields with an empty string
+    values.extend([''] * (len(headers) - len(values)))
+    values = values[:len(headers)]  # Truncate if there are extra fields
+
+    record = {}
+    for i, header in enumerate(headers):
+        # Clean up the value by replacing newlines/tabs with a space and stripping whitespace
+        cleaned_value = values[i].replace('\n', ' ').strip()
+        if header == 'instagram_id':
+            record['instagram_id'] = cleaned_value.replace('https://www.instagram.com/', '').replace('/', '')
+        else:
+            record[header] = cleaned_value
+    return record
+
+
+def detect_delimiter(filename: str, header_line: str) -> str:
+    lowered = (filename or "").lower()
+    if lowered.endswith(".csv"):
+        return ","
+    if lowered.endswith((".tsv", ".tab")):
+        return "\t"
+    return "\t" if "\t" in header_line else ","
+
+
+def _iter_rows(lines, delimiter):
+    """Yield split data rows from an iterator of text lines"""
+    if delimiter == "\t":
+        for line in lines:
+            if line.strip():
+                yield TSV_SPLIT.split(line.strip())
+    else:
+        for row in csv.reader(lines, delimiter=delimiter):
+            if any(cell.strip() for cell in row):
+                yield row
+
+
+def _next_chunk(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            break
+    return chunk
+
+
+def _first_line(lines):
+    for line in lines:
+        if line.strip():
+            return line
+    return None
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+
+
+async def import_customer_file(upload, collection, model, delimiter=None, chunk_size=1000, on_inserted=None):
+    """Stream an uploaded sheet into collection.
+
+    model validates each row (the API passes its Customer model) and
+    on_inserted, if given, is awaited with every batch of inserted documents.
+    """
+    lines = iter(codecs.getreader("utf-8-sig")(upload.file))
+    header_line = await asyncio.to_thread(_first_line, lines)
+    if header_line is None:
+        return {"rows": 0, "inserted": 0, "failed": 0, "errors": [], "errors_truncated": False}
+
+    delimiter = delimiter or detect_delimiter(upload.filename, header_line)
+    headers = [HEADER_ALIASES.get(h, h) for h in normalize_headers(header_line, delimiter)]
+    rows = _iter_rows(lines, delimiter)
+
+    summary = {"rows": 0, "inserted": 0, "failed": 0, "errors": [], "errors_truncated": False}
+
+    def report(row_number, message):
+        summary["failed"] += 1
+        if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+            summary["errors"].append({"row": row_number, "error": message})
+        else:
+            summary["errors_truncated"] = True
+
+    row_number = 1  # the header is row 1
+    while True:
+        # Reading the spooled upload is blocking file I/O, keep it off the event loop
+        chunk = await asyncio.to_thread(_next_chunk, rows, chunk_size)
+        if not chunk:
+            break
+
+        documents = []
+        document_rows = []
+        for values in chunk:
+            row_number += 1
+            summary["rows"] += 1
+            record = {k: v for k, v in build_record(headers, values).items() if v != ""}
+            try:
+                document = model(**record).dict(exclude_unset=True)
+            except ValidationError as e:
+                report(row_number, _validation_message(e))
+                continue
+            if not document.get("created_at"):
+                document["created_at"] = datetime.utcnow().isoformat()
+            documents.append(document)
+            document_rows.append(row_number)
+
+        if not documents:
+            continue
+
+        failed_indexes = set()
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed_indexes.add(error["index"])
+                report(document_rows[error["index"]], error.get("errmsg", "write error"))
+
+        inserted = [doc for i, doc in enumerate(documents) if i not in failed_indexes]
+        summary["inserted"] += len(inserted)
+        if on_inserted and inserted:
+            await on_inserted(inserted)
+        logger.info("Imported %d / %d rows so far", summary["inserted"], summary["rows"])
+
+    return summary
@@ -0,0 +1,142 @@
+"""Index registry for the crm_db collections, applied at startup, and an explain()-based check of the hot queries."""
+import logging
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# collection name -> list of (keys, options)
+INDEXES = {
+    "customers": [
+        ([("city", ASCENDING)], {"name": "customers_city"}),
+        ([("size", ASCENDING)], {"name": "customers_size"}),
+        # Covers keyset pages with ?fields=compact (see projections.py)
+        ([("_id", ASCENDING), ("city", ASCENDING), ("size", ASCENDING), ("name", ASCENDING)], {"name": "customers_id_city_size_name"}),
+        # Search fallback while the in-process index builds (see customer_search.py)
+        ([("name", TEXT), ("salon__parlour", TEXT), ("instagram_id", TEXT), ("address", TEXT), ("description", TEXT)],
+         {"name": "customers_text",
+          "weights": {"name": 8, "salon__parlour": 8, "instagram_id": 4, "address": 2, "description": 1}}),
+    ],
+    "campaigns": [
+        ([("campaign_id", ASCENDING)], {"name": "campaigns_campaign_id"}),
+    ],
+    "mapcamp": [
+        # Also serves campaign_id-only lookups through its prefix
+        ([("campaign_id", ASCENDING), ("customer_obj_id", ASCENDING)], {"name": "mapcamp_campaign_customer", "unique": True}),
+        ([("customer_obj_id", ASCENDING)], {"name": "mapcamp_customer_obj_id"}),
+    ],
+    "interaction_buckets": [
+        # _id breaks last_date ties between buckets in creation order
+        ([("customer_id", ASCENDING), ("last_date", DESCENDING), ("_id", DESCENDING)], {"name": "interaction_buckets_customer_last_date_id"}),
+        # At most one open (appendable) bucket per customer
+        ([("customer_id", ASCENDING)], {"name": "interaction_buckets_open_customer", "unique": True, "partialFilterExpression": {"open": True}}),
+    ],
+    "jobs": [
+        # Only one queued/running job per dedupe_key across all workers
+        ([("dedupe_key", ASCENDING)], {"name": "jobs_active_dedupe_key", "unique": True, "partialFilterExpression": {"active": True}}),
+        ([("created_at", ASCENDING)], {"name": "jobs_created_at_ttl", "expireAfterSeconds": 7 * 24 * 3600}),
+    ],
+    "next_action_drafts": [
+        # One draft per customer per campaign; also serves the campaign listing
+        ([("campaign_id", ASCENDING), ("customer_id", ASCENDING)], {"name": "next_action_drafts_campaign_customer", "unique": True}),
+        ([("campaign_id", ASCENDING), ("status", ASCENDING)], {"name": "next_action_drafts_campaign_status"}),
+    ],
+    "summary_queue": [
+        ([("enqueued_at", ASCENDING)], {"name": "summary_queue_enqueued_at"}),
+    ],
+    "segmentation_models": [
+        ([("active", ASCENDING), ("created_at", DESCENDING)], {"name": "segmentation_models_active_created_at"}),
+    ],
+    "llm_cache": [
+        ([("expires_at", ASCENDING)], {"name": "llm_cache_expires_at", "expireAfterSeconds": 0}),
+    ],
+}
+
+
+async def ensure_indexes(db, registry=None):
+    """Create every registered index, returning a per-index status report.
+
+    Failures (e.g. an existing index with the same name but different options)
+    are reported instead of raised so one bad index cannot stop the app.
+    """
+    registry = registry or INDEXES
+    report = []
+    for collection_name, specs in registry.items():
+        collection = db[collection_name]
+        for keys, options in specs:
+            entry = {"collection": collection_name, "name": options.get("name"), "keys": keys}
+            try:
+                await collection.create_index(keys, background=True, **options)
+                entry["status"] = "ok"
+            except OperationFailure as e:
+                entry["status"] = "error"
+                entry["error"] = str(e)
+                logger.warning("Could not create index %s on %s: %s", options.get("name"), collection_name, e)
+            report.append(entry)
+    return report
+
+
+def _plan_stages(node, stages=None):
+    """Collect every "stage" value found anywhere in an explain document"""
+    if stages is None:
+        stages = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and isinstance(value, str):
+                stages.append(value)
+            else:
+                _plan_stages(value, stages)
+    elif isinstance(node, list):
+        for item in node:
+            _plan_stages(item, stages)
+    return stages
+
+
+async def explain_query(db, query):
+    """Explain a single hot query description.
+
+    query is a dict with "name", "collection" and either "filter" (plus
+    optional "sort" and "projection") for a find, or "pipeline" for an aggregation.
+    """
+    collection = query["collection"]
+    if "pipeline" in query:
+        command = {"aggregate": collection, "pipeline": query["pipeline"], "cursor": {}}
+    else:
+        command = {"find": collection, "filter": query.get("filter", {})}
+        if query.get("sort"):
+            command["sort"] = query["sort"]
+        if query.get("projection"):
+            command["projection"] = query["projection"]
+
+    result = {"name": query["name"], "collection": collection}
+    try:
+        explained = await db.command("explain", command, verbosity="queryPlanner")
+        stages = _plan_stages(explained.get("queryPlanner", explained))
+        result["stages"] = sorted(set(stages))
+        result["collscan"] = "COLLSCAN" in stages
+        # Answered from the index alone: no document fetch
+        result["covered"] = "IXSCAN" in stages and "FETCH" not in stages
+    except OperationFailure as e:
+        result["error"] = str(e)
+    return result
+
+
+async def explain_queries(db, queries):
+    """Explain every hot query and flag the ones planned as COLLSCAN"""
+    results = [await explain_query(db, query) for query in queries]
+    return {
+        "queries": results,
+        "collscans": [r["name"] for r in results if r.get("collscan")]
+    }
+
+
+async def list_indexes(db, registry=None):
+    """Return the index names currently present on each registered collection"""
+    registry = registry or INDEXES
+    existing = {}
+    for collection_name in registry:
+        info = await db[collection_name].index_information()
+        existing[collection_name] = sorted(info.keys())
+    return existing
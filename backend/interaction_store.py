@@ -0,0 +1,301 @@
+"""Customer interactions stored in fixed-size, time-ordered buckets in `interaction_buckets`,
+paged by a (date, id) cursor and migrated online from the legacy `interactions` arrays."""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import db, interactions_collection
+from versions import INTERACTIONS, bump_versions
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_COLLECTION = "interaction_buckets"
+BUCKET_SIZE = int(os.getenv("INTERACTION_BUCKET_SIZE", "50"))
+MIGRATION_STALE_SECONDS = 60
+APPEND_RETRIES = 3
+CURSOR_SEPARATOR = "|"
+
+buckets_collection = db[BUCKETS_COLLECTION]
+
+# Customers this process has already confirmed have no legacy document
+_migrated = set()
+
+
+def _sender_key(sender):
+    """Sender values become field names under last_by_sender"""
+    return str(sender).replace(".", "_").lstrip("$")
+
+
+def _pointer(interaction):
+    return {
+        "type": interaction.get("type"),
+        "date": interaction.get("date"),
+        "summary": interaction.get("summary")
+    }
+
+
+async def _migrate_customer(customer_id):
+    """Move one customer's legacy interactions array into buckets"""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=MIGRATION_STALE_SECONDS)
+    legacy = await interactions_collection.find_one_and_update(
+        {
+            "_id": customer_id,
+            "interactions": {"$exists": True},
+            "$or": [{"migrating_at": {"$exists": False}}, {"migrating_at": {"$lt": stale}}]
+        },
+        {"$set": {"migrating_at": now}},
+        return_document=ReturnDocument.BEFORE
+    )
+    if legacy is None:
+        return False
+
+    # A previous attempt may have died after inserting some buckets
+    await buckets_collection.delete_many({"customer_id": customer_id, "legacy": True})
+
+    items = legacy.get("interactions", [])
+    buckets = []
+    for start in range(0, len(items), BUCKET_SIZE):
+        chunk = items[start:start + BUCKET_SIZE]
+        dates = [item["date"] for item in chunk if item.get("date")]
+        last_by_sender = {}
+        for item in chunk:
+            if item.get("sender"):
+                last_by_sender[_sender_key(item["sender"])] = _pointer(item)
+        buckets.append({
+            "customer_id": customer_id,
+            "count": len(chunk),
+            "first_date": min(dates) if dates else None,
+            "last_date": max(dates) if dates else None,
+            "interactions": chunk,
+            "last_by_sender": last_by_sender,
+            "legacy": True
+        })
+    if buckets:
+        await buckets_collection.insert_many(buckets)
+    await interactions_collection.delete_one({"_id": customer_id})
+    logger.info("Migrated %d interactions for %s into %d buckets", len(items), customer_id, len(buckets))
+    return True
+
+
+async def ensure_migrated(customer_id):
+    """Make sure the customer has no legacy interactions document left"""
+    if customer_id in _migrated:
+        return
+    for _ in range(50):
+        legacy = await interactions_collection.find_one({"_id": customer_id, "interactions": {"$exists": True}}, {"_id": 1})
+        if legacy is None or await _migrate_customer(customer_id):
+            _migrated.add(customer_id)
+            return
+        # Another worker is migrating this customer right now
+        await asyncio.sleep(0.1)
+
+
+async def ensure_migrated_many(customer_ids):
+    """ensure_migrated for many customers with one query for legacy documents"""
+    pending = [customer_id for customer_id in customer_ids if customer_id not in _migrated]
+    if not pending:
+        return
+    legacy = await interactions_collection.find(
+        {"_id": {"$in": pending}, "interactions": {"$exists": True}}, {"_id": 1}
+    ).to_list(None)
+    legacy_ids = {doc["_id"] for doc in legacy}
+    _migrated.update(customer_id for customer_id in pending if customer_id not in legacy_ids)
+    for customer_id in legacy_ids:
+        await ensure_migrated(customer_id)
+
+
+async def _close_full_buckets(customer_id):
+    await buckets_collection.update_many(
+        {"customer_id": customer_id, "open": True, "count": {"$gte": BUCKET_SIZE}},
+        {"$unset": {"open": ""}}
+    )
+
+
+async def append_interaction(customer_id, interaction):
+    """Append an interaction to the customer's open bucket"""
+    await ensure_migrated(customer_id)
+    interaction = {"id": ObjectId(), **interaction}
+    date = interaction.get("date") or datetime.utcnow()
+    update = {
+        "$push": {"interactions": interaction},
+        "$inc": {"count": 1},
+        "$min": {"first_date": date},
+        "$max": {"last_date": date}
+    }
+    if interaction.get("sender"):
+        update["$set"] = {f"last_by_sender.{_sender_key(interaction['sender'])}": _pointer(interaction)}
+    for attempt in range(APPEND_RETRIES + 1):
+        try:
+            bucket = await buckets_collection.find_one_and_update(
+                {"customer_id": customer_id, "open": True, "count": {"$lt": BUCKET_SIZE}},
+                update,
+                projection={"_id": 1, "count": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            # Another write opened the bucket first, or the open one just
+            # filled up and was not closed yet; close full ones and retry
+            if attempt == APPEND_RETRIES:
+                raise
+            await _close_full_buckets(customer_id)
+    if bucket["count"] >= BUCKET_SIZE:
+        await _close_full_buckets(customer_id)
+    await bump_versions(db, INTERACTIONS)
+    return bucket
+
+
+def encode_cursor(key):
+    date, item_id = key
+    return f"{date.isoformat()}{CURSOR_SEPARATOR}{item_id}"
+
+
+def decode_cursor(cursor):
+    """(date, id) from a next_before cursor; a bare date pages by date alone.
+    Raises ValueError for anything else."""
+    date, _, item_id = str(cursor).partition(CURSOR_SEPARATOR)
+    return datetime.fromisoformat(date), item_id or None
+
+
+def _keyed(bucket):
+    """(sort key, interaction) pairs of a bucket in insertion order"""
+    items = bucket.get("interactions", [])
+    # Entries without an id are identified by their position in the bucket,
+    # which works with a $slice projection because count is also projected
+    offset = bucket.get("count", len(items)) - len(items)
+    return [
+        ((item.get("date") or datetime.min, str(item["id"]) if item.get("id") else f"{bucket['_id']}.{offset + index:04d}"), item)
+        for index, item in enumerate(items)
+    ]
+
+
+async def recent_interactions(customer_id, limit=20, before=None):
+    """Return up to limit interactions older than the before cursor (oldest
+    first) and the cursor for the next older page, or None when there is
+    nothing older. before is a cursor string or a (date, id) pair."""
+    await ensure_migrated(customer_id)
+
+    query = {"customer_id": customer_id}
+    projection = {"interactions": 1, "count": 1}
+    if before is not None:
+        before_date, before_id = decode_cursor(before) if isinstance(before, str) else before
+        # Buckets starting at the boundary date may still hold older entries
+        query["first_date"] = {"$lte": before_date}
+    else:
+        # Only the tail of each bucket can be needed
+        projection = {"interactions": {"$slice": -limit}, "count": 1}
+
+    collected = []
+    cursor = buckets_collection.find(query, projection).sort([("last_date", DESCENDING), ("_id", DESCENDING)]).batch_size(2)
+    async for bucket in cursor:
+        items = _keyed(bucket)
+        if before is not None:
+            items = [
+                (key, item) for key, item in items
+                if key[0] != datetime.min and (key[0] < before_date or (before_id is not None and key[0] == before_date and key[1] < before_id))
+            ]
+        # Concurrent writes can push slightly out of date order
+        collected = sorted(items + collected, key=lambda entry: entry[0])
+        if len(collected) >= limit:
+            break
+
+    if len(collected) < limit:
+        return [item for _, item in collected], None
+    collected = collected[-limit:]
+    return [item for _, item in collected], encode_cursor(collected[0][0])
+
+
+async def recent_interactions_many(customer_ids, limit=5):
+    """Latest limit interactions (oldest first) for each of customer_ids;
+    customers without interactions map to an empty list."""
+    await ensure_migrated_many(customer_ids)
+    # Bucket sizes first, newest first per customer. Migrated and
+    # concurrently closed buckets can be partial, so take buckets until
+    # their counts cover limit instead of assuming they are full.
+    pipeline = [
+        {"$match": {"customer_id": {"$in": list(customer_ids)}}},
+        {"$sort": {"customer_id": 1, "last_date": -1, "_id": -1}},
+        {"$group": {"_id": "$customer_id", "buckets": {"$push": {"_id": "$_id", "count": "$count"}}}}
+    ]
+    needed = []
+    async for doc in buckets_collection.aggregate(pipeline):
+        total = 0
+        for bucket in doc["buckets"]:
+            needed.append(bucket["_id"])
+            total += bucket["count"]
+            if total >= limit:
+                break
+
+    collected = {customer_id: [] for customer_id in customer_ids}
+    if needed:
+        async for bucket in buckets_collection.find(
+            {"_id": {"$in": needed}}, {"customer_id": 1, "count": 1, "interactions": {"$slice": -limit}}
+        ):
+            collected[bucket["customer_id"]].extend(_keyed(bucket))
+    recent = {}
+    for customer_id, items in collected.items():
+        items.sort(key=lambda entry: entry[0])
+        recent[customer_id] = [item for _, item in items[-limit:]]
+    return recent
+
+
+async def count_interactions(customer_id):
+    await ensure_migrated(customer_id)
+    pipeline = [
+        {"$match": {"customer_id": customer_id}},
+        {"$group": {"_id": None, "total": {"$sum": "$count"}}}
+    ]
+    result = await buckets_collection.aggregate(pipeline).to_list(1)
+    return result[0]["total"] if result else 0
+
+
+async def last_interaction_by_sender(customer_id, sender):
+    """Most recent interaction from sender, read from the newest bucket's
+    last_by_sender pointer without loading any interaction arrays"""
+    await ensure_migrated(customer_id)
+    field = f"last_by_sender.{_sender_key(sender)}"
+    bucket = await buckets_collection.find_one(
+        {"customer_id": customer_id, field: {"$exists": True}},
+        {field: 1, "_id": 0},
+        sort=[("last_date", DESCENDING), ("_id", DESCENDING)]
+    )
+    if not bucket:
+        return None
+    return bucket["last_by_sender"][_sender_key(sender)]
+
+
+async def migrate_all(batch_size=500):
+    """Move every remaining legacy interactions document into buckets"""
+    migrated = 0
+    while True:
+        ids = await interactions_collection.find({"interactions": {"$exists": True}}, {"_id": 1}).limit(batch_size).to_list(batch_size)
+        if not ids:
+            break
+        progressed = False
+        for doc in ids:
+            if await _migrate_customer(doc["_id"]):
+                migrated += 1
+                progressed = True
+        print(f"   ...{migrated} customers migrated so far")
+        if not progressed:
+            # Everything left is being migrated online by a running worker
+            await asyncio.sleep(1)
+    print(f"✅ Interaction migration complete: {migrated} customers")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interaction bucket maintenance")
+    parser.add_argument("--migrate", action="store_true", help="move all legacy interaction arrays into buckets")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    if args.migrate:
+        asyncio.run(migrate_all(args.batch_size))
+    else:
+        parser.print_help()
@@ -0,0 +1,154 @@
+"""In-process background job runner whose status lives in the `jobs` collection, so any worker can report it."""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from database import db
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "jobs"
+HEARTBEAT_SECONDS = 30
+
+
+class JobQueueFull(Exception):
+    """Raised when the local job queue cannot accept another job"""
+
+
+class JobRunner:
+    def __init__(self, collection, max_workers=2, queue_size=100, stale_after_seconds=900):
+        self.collection = collection
+        self.max_workers = max_workers
+        self.stale_after = timedelta(seconds=stale_after_seconds)
+        self.queue_size = queue_size
+        self._queue = None
+        self._handlers = {}
+        self._workers = []
+
+    def register(self, kind, handler):
+        """handler(payload, progress) -> result dict; progress(stage, **fields) is awaitable"""
+        self._handlers[kind] = handler
+
+    def start(self):
+        # Created here so the queue belongs to the running event loop
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        for i in range(self.max_workers):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+        logger.info("Job runner started with %d workers", self.max_workers)
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def get(self, job_id):
+        return await self.collection.find_one({"_id": job_id})
+
+    async def submit(self, kind, payload=None, dedupe_key=None):
+        """Queue a job, returning (job document, deduplicated)"""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind {kind!r}")
+        if self._queue is None:
+            raise RuntimeError("Job runner is not started")
+
+        now = datetime.utcnow()
+        job_id = uuid.uuid4().hex
+        job = {
+            "_id": job_id,
+            "kind": kind,
+            "payload": payload or {},
+            "status": "queued",
+            "progress": {},
+            "dedupe_key": dedupe_key or job_id,
+            "active": True,
+            "created_at": now,
+            "updated_at": now
+        }
+
+        for attempt in range(2):
+            try:
+                await self.collection.insert_one(job)
+                break
+            except DuplicateKeyError:
+                existing = await self.collection.find_one({"dedupe_key": job["dedupe_key"], "active": True})
+                if existing is None:
+                    continue
+                if attempt == 0 and existing["updated_at"] < now - self.stale_after:
+                    await self._finish(existing["_id"], "failed", error="Job went stale (worker stopped heartbeating)")
+                    continue
+                return existing, True
+        else:
+            existing = await self.collection.find_one({"dedupe_key": job["dedupe_key"], "active": True})
+            return existing, True
+
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            await self._finish(job_id, "failed", error="Job queue is full")
+            raise JobQueueFull("Job queue is full, try again later")
+        return job, False
+
+    async def _finish(self, job_id, status, result=None, error=None):
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": job_id},
+            {
+                "$set": {"status": status, "result": result, "error": error, "finished_at": now, "updated_at": now},
+                "$unset": {"active": ""}
+            }
+        )
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            await self.collection.update_one({"_id": job_id}, {"$set": {"updated_at": datetime.utcnow()}})
+
+    async def _worker(self, index):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("Job worker %d crashed on %s", index, job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id):
+        job = await self.get(job_id)
+        if job is None or job["status"] != "queued":
+            return
+
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "running", "started_at": now, "updated_at": now}}
+        )
+
+        async def progress(stage, **fields):
+            await self.collection.update_one(
+                {"_id": job_id},
+                {"$set": {"progress": {"stage": stage, **fields}, "updated_at": datetime.utcnow()}}
+            )
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        logger.info("Job %s (%s) started", job_id, job["kind"])
+        try:
+            result = await self._handlers[job["kind"]](job.get("payload", {}), progress)
+            await self._finish(job_id, "succeeded", result=result)
+            logger.info("Job %s (%s) succeeded", job_id, job["kind"])
+        except Exception as e:
+            await self._finish(job_id, "failed", error=str(e))
+            logger.exception("Job %s (%s) failed", job_id, job["kind"])
+        finally:
+            heartbeat.cancel()
+
+
+job_runner = JobRunner(
+    db[JOBS_COLLECTION],
+    max_workers=int(os.getenv("JOB_WORKERS", "2")),
+    queue_size=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+    stale_after_seconds=int(os.getenv("JOB_STALE_SECONDS", "900"))
+)
@@ -1,24 +1,85 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 import pathlib
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
-from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime
-from dotenv import load_dotenv
 from bson import ObjectId
 from bson.errors import InvalidId
+from contextlib import asynccontextmanager
+from customer_search import customer_search, text_search
+from importer import import_customer_file
+from interaction_store import decode_cursor, recent_interactions
+from projections import CUSTOMER_PRESETS, customer_projection
+from versions import CAMPAIGNS, CUSTOMERS, INTERACTIONS, MAPPINGS, STATS, SUMMARIES, bump_versions, conditional_get
+from responses import dumps_text, json_response, ndjson_stream, raw_collection
+from jobs import JobQueueFull, job_runner
+from indexes import ensure_indexes, explain_queries, list_indexes
+from metrics import PrometheusMiddleware, metrics_payload
+import database
+from database import (
+    ATLAS_URI,
+    db,
+    customers_collection,
+    campaigns_collection,
+    mapcamp_collection,
+    convosummary_collection
+)
+from stats import group_count_pipeline, read_stats, rebuild_stats, record_customers_added, stats_rebuild_loop
+from agents import registry as workflow_registry
+from agents.campaign_assignment import campaign_assigner, drift_check_loop
+from agents.llm_gateway import LLMGatewayBusy, llm_gateway
+from agents.summary_queue import summary_queue
+import asyncio
+import logging
+import time
 import os
 
-app = FastAPI()
-"""PLEASE IGNR THE CLUTTERED CODE THIS MAIN.PY THINGS ARE PILED ONE AFTER THE ANOTHER WITHOUT ANY STRUCTURE"""
-load_dotenv()
-ATLAS_URI = os.getenv("MONGODB_URI")
-if not ATLAS_URI:
-    raise ValueError("ATLAS_URI not found in .env file")
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared Mongo pool, apply the index registry, compile the agent
+    workflows and start the job runner, summary queue workers, stats
+    rebuild and campaign drift check jobs for this worker"""
+    started = time.perf_counter()
+    await database.connect()
+    logger.info("Startup: mongo connect %.0fms", (time.perf_counter() - started) * 1000)
+
+    stage = time.perf_counter()
+    report = await ensure_indexes(db)
+    failed = [entry["name"] for entry in report if entry["status"] != "ok"]
+    logger.info("Indexes ensured: %d ok, %d failed %s", len(report) - len(failed), len(failed), failed if failed else "")
+    logger.info("Startup: indexes %.0fms", (time.perf_counter() - stage) * 1000)
+
+    stage = time.perf_counter()
+    workflow_registry.warm_up()
+    logger.info("Startup: workflows %.0fms", (time.perf_counter() - stage) * 1000)
+    logger.info("Startup: total %.0fms", (time.perf_counter() - started) * 1000)
+
+    job_runner.register("campaign_creation", run_campaign_creation_job)
+    job_runner.register("campaign_next_actions", run_campaign_next_actions_job)
+    job_runner.start()
+    summary_queue.start()
+    customer_search.build_in_background(customers_collection, db)
+
+    stats_task = asyncio.create_task(stats_rebuild_loop(db, int(os.getenv("STATS_REBUILD_INTERVAL", "3600"))))
+    drift_task = asyncio.create_task(drift_check_loop(campaign_assigner, int(os.getenv("CAMPAIGN_DRIFT_CHECK_INTERVAL", "3600"))))
+    yield
+    stats_task.cancel()
+    drift_task.cancel()
+    await job_runner.stop()
+    await summary_queue.stop()
+    database.close()
 
+app = FastAPI(lifespan=lifespan)
+"""PLEASE IGNR THE CLUTTERED CODE THIS MAIN.PY THINGS ARE PILED ONE AFTER THE ANOTHER WITHOUT ANY STRUCTURE"""
 # Configure allowed origins
 origins = [
     "http://localhost:5500",
@@ -36,29 +97,8 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization", "Accept"],
     expose_headers=["*"]
 )
-
-client = AsyncIOMotorClient(ATLAS_URI)
-db = client["crm_db"]
-customers_collection = db["customers"]
-campaigns_collection = db["campaigns"]
-mapcamp_collection = db["mapcamp"]
-interactions_collection = db["interactions"]
-convosummary_collection = db["convosummary"]
-
-def serialize_doc(doc):
-    """Convert a single MongoDB document to JSON-serializable format"""
-    if doc is None:
-        return None
-    doc["_id"] = str(doc["_id"])
-    return doc
-
-def serialize_docs(docs):
-    """Convert multiple MongoDB documents to JSON-serializable format"""
-    return [serialize_doc(doc) for doc in docs]
-
-def serialize_customer(customer):
-    """Convert customer document to JSON-serializable format"""
-    return serialize_doc(customer)
+# Added last so it wraps CORS too and times the whole request
+app.add_middleware(PrometheusMiddleware)
 
 class CustomerIdsRequest(BaseModel):
     ids: List[str]
@@ -75,6 +115,20 @@ class Customer(BaseModel):
     size: Optional[str] = None
     created_at: Optional[str] = None
 
+async def assign_to_campaigns(customers):
+    """Place new customers into the nearest existing campaign; never fails the insert"""
+    try:
+        return await campaign_assigner.assign(customers)
+    except Exception:
+        logger.exception("Campaign assignment failed for %d customers", len(customers))
+        return {}
+
+async def on_customers_imported(customers):
+    await record_customers_added(db, customers)
+    await bump_versions(db, CUSTOMERS)
+    customer_search.add(customers)
+    await assign_to_campaigns(customers)
+
 @app.post("/api/customers")
 async def create_customer(customer: Customer):
     try:
@@ -83,35 +137,134 @@ async def create_customer(customer: Customer):
         if not customer_data.get("created_at"):
             customer_data["created_at"] = datetime.utcnow().isoformat()
 
-        print("customer_data:", customer_data)
-
         # Save to MongoDB Atlas
         result = await customers_collection.insert_one(customer_data)
-        print("inserted_id:", result.inserted_id, "type:", type(result.inserted_id))
+        await record_customers_added(db, [customer_data])
+        await bump_versions(db, CUSTOMERS)
+        customer_search.add([customer_data])
+        campaign_id = await assign_to_campaigns([customer_data])
 
         # Convert ObjectId to string for JSON response
         customer_data["_id"] = str(result.inserted_id)
         
-        response = {"status": "Customer created", "customer": customer_data}
-        print("response:", response)
-        return response
+        return {"status": "Customer created", "customer": customer_data, "campaign_id": campaign_id.get(result.inserted_id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create customer: {str(e)}")
 
+@app.post("/api/customers/import")
+async def import_customers(
+    file: UploadFile = File(...),
+    delimiter: Optional[str] = Query(None, description="',' or 'tab'; detected from the file name/header when omitted"),
+    chunk_size: int = Query(1000, ge=1, le=10000)
+):
+    """Bulk import customers from an uploaded TSV/CSV sheet, streamed in chunks"""
+    if delimiter == "tab":
+        delimiter = "\t"
+    try:
+        logger.info("Importing customers from %s", file.filename)
+        result = await import_customer_file(
+            file,
+            customers_collection,
+            Customer,
+            delimiter=delimiter,
+            chunk_size=chunk_size,
+            on_inserted=on_customers_imported
+        )
+        logger.info("Import finished: %d inserted, %d failed", result["inserted"], result["failed"])
+        return {"status": "success", **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to import customers: {str(e)}")
+
+FIELDS_DESCRIPTION = f"Preset ({', '.join(CUSTOMER_PRESETS)}) or comma-separated customer fields"
+
+def fields_projection(fields: Optional[str]) -> Optional[dict]:
+    """Mongo projection for a ?fields= value, 400 on unknown fields"""
+    try:
+        return customer_projection(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+CUSTOMERS_PAGE_SIZE = 100
+CUSTOMERS_MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 @app.get("/api/customers")
-async def get_customers():
-    customers = await customers_collection.find().to_list(100)
-    return serialize_docs(customers)
+async def get_customers(
+    request: Request,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=CUSTOMERS_MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """List customers with keyset pagination on _id.
+
+    Pass the last _id of a page as ?after= to get the next one; the cursor for
+    the next page is returned in the X-Next-Cursor header. Clients sending
+    Accept: application/x-ndjson get the documents streamed one per line
+    from raw BSON batches (the whole collection unless ?limit= is given).
+    ?fields=compact is answered from the customers_id_city_size_name index alone.
+    """
+    projection = fields_projection(fields)
+    query = {}
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor format")
+
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        cursor = raw_collection(customers_collection).find(query, projection).sort("_id", 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return StreamingResponse(ndjson_stream(cursor), media_type=NDJSON_MEDIA_TYPE)
+
+    page_size = limit or CUSTOMERS_PAGE_SIZE
+    customers = await customers_collection.find(query, projection).sort("_id", 1).limit(page_size).to_list(page_size)
+    headers = {}
+    if len(customers) == page_size:
+        headers["X-Next-Cursor"] = str(customers[-1]["_id"])
+    return json_response(customers, headers=headers)
+
+# Declared before /api/customers/{customer_id} so "search" isn't taken for an id
+@app.get("/api/customers/search")
+async def search_customers(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Typeahead search over name, instagram_id, address and description"""
+    try:
+        started = time.perf_counter()
+        if customer_search.ready:
+            await customer_search.refresh(customers_collection, db)
+            results = [{**doc, "score": score} for score, doc in customer_search.search(q, limit)]
+            engine = "memory"
+        else:
+            customer_search.build_in_background(customers_collection, db)
+            results = await text_search(customers_collection, q, limit)
+            engine = "text"
+        return json_response({
+            "query": q,
+            "engine": engine,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2),
+            "results": results
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching customers: {str(e)}")
 
 @app.get("/api/customers/{customer_id}")
-async def get_customer_by_id(customer_id: str):
+async def get_customer_by_id(request: Request, customer_id: str, fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)):
     """Fetch a single customer by ID"""
+    projection = fields_projection(fields)
     try:
         object_id = ObjectId(customer_id)
-        customer = await customers_collection.find_one({"_id": object_id})
+        not_modified, headers = await conditional_get(db, request, [CUSTOMERS], "customer")
+        if not_modified:
+            return not_modified
+        customer = await customers_collection.find_one({"_id": object_id}, projection)
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
-        return serialize_doc(customer)
+        return json_response(customer, headers=headers)
+    except HTTPException:
+        raise
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid customer ID format")
     except Exception as e:
@@ -119,23 +272,40 @@ async def get_customer_by_id(customer_id: str):
 
 # Campaign Dashboard API Routes
 @app.get("/api/campaigns")
-async def get_campaigns():
+async def get_campaigns(request: Request):
     """Fetch all campaigns from MongoDB"""
     try:
+        not_modified, headers = await conditional_get(db, request, [CAMPAIGNS], "campaigns")
+        if not_modified:
+            return not_modified
         campaigns = await campaigns_collection.find().sort("campaign_id", 1).to_list(1000)
-        print(f"Found {len(campaigns)} campaigns")
-        return serialize_docs(campaigns)
+        logger.debug("Found %d campaigns", len(campaigns))
+        return json_response(campaigns, headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching campaigns: {str(e)}")
 
+# Declared before /api/campaigns/{campaign_id} so "drift" isn't parsed as an id
+@app.get("/api/campaigns/drift")
+async def get_campaign_drift():
+    """Check whether new customers still fit the campaigns; says when a full rebuild is worth it"""
+    try:
+        return json_response(await campaign_assigner.check_drift())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error checking campaign drift: {str(e)}")
+
 @app.get("/api/campaigns/{campaign_id}")
-async def get_campaign(campaign_id: int):
+async def get_campaign(request: Request, campaign_id: int):
     """Fetch specific campaign by ID"""
     try:
+        not_modified, headers = await conditional_get(db, request, [CAMPAIGNS], "campaign")
+        if not_modified:
+            return not_modified
         campaign = await campaigns_collection.find_one({"campaign_id": campaign_id})
         if not campaign:
             raise HTTPException(status_code=404, detail="Campaign not found")
-        return serialize_doc(campaign)
+        return json_response(campaign, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching campaign: {str(e)}")
 
@@ -147,7 +317,7 @@ async def get_campaign_mapping(campaign_id: Optional[int] = None):
         if campaign_id:
             query["campaign_id"] = campaign_id
         mappings = await mapcamp_collection.find(query).to_list(1000)
-        return serialize_docs(mappings)
+        return json_response(mappings)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching campaign mapping: {str(e)}")
 
@@ -157,59 +327,105 @@ async def get_customers_by_ids(request: CustomerIdsRequest):
     try:
         object_ids = [ObjectId(id_str) for id_str in request.ids]
         customers = await customers_collection.find({"_id": {"$in": object_ids}}).to_list(1000)
-        return serialize_docs(customers)
+        return json_response(customers)
     except InvalidId as e:
         raise HTTPException(status_code=400, detail=f"Invalid ObjectId: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching customers: {str(e)}")
 
+def campaign_customers_pipeline(campaign_id: int, skip: int = 0, limit: Optional[int] = None, projection: Optional[dict] = None):
+    """Build the mapcamp -> customers join for one campaign.
+
+    Paging is applied to the mappings before the $lookup so only the requested
+    members are joined. customer_obj_id is stored as an ObjectId (see
+    migrate_mapcamp.py for older string mappings), so the join is a plain
+    indexed equality lookup on customers._id.
+    """
+    pipeline = [
+        {"$match": {"campaign_id": campaign_id}},
+        {"$sort": {"_id": 1}},
+    ]
+    if skip:
+        pipeline.append({"$skip": skip})
+    if limit:
+        pipeline.append({"$limit": limit})
+
+    lookup = {
+        "from": customers_collection.name,
+        "localField": "customer_obj_id",
+        "foreignField": "_id",
+        "as": "customer"
+    }
+    if projection:
+        # Concise localField + pipeline syntax needs MongoDB 5.0+
+        lookup["pipeline"] = [{"$project": projection}]
+
+    pipeline += [
+        {"$lookup": lookup},
+        {"$unwind": "$customer"},
+        {"$replaceRoot": {"newRoot": "$customer"}}
+    ]
+    return pipeline
+
 @app.get("/api/campaigns/{campaign_id}/customers")
-async def get_campaign_customers(campaign_id: int):
-    """Fetch all customers for a specific campaign"""
+async def get_campaign_customers(
+    request: Request,
+    campaign_id: int,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=CUSTOMERS_MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """Fetch one page of a campaign's customers in a single aggregation.
+
+    Pages hold ?limit= customers (default CUSTOMERS_PAGE_SIZE). X-Total-Count
+    is the campaign's size and X-Next-Skip, present while more remain, is the
+    ?skip= for the next page. Clients sending Accept: application/x-ndjson get
+    the whole campaign (unless ?limit= is given) streamed one per line.
+    """
+    projection = fields_projection(fields)
     try:
-        mappings = await mapcamp_collection.find({"campaign_id": campaign_id}).to_list(1000)
-        if not mappings:
-            return []
-        customer_ids = [ObjectId(mapping["customer_obj_id"]) for mapping in mappings]
-        customers = await customers_collection.find({"_id": {"$in": customer_ids}}).to_list(1000)
-        return serialize_docs(customers)
+        not_modified, headers = await conditional_get(db, request, [MAPPINGS, CUSTOMERS], "campaign_customers")
+        if not_modified:
+            return not_modified
+
+        if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+            pipeline = campaign_customers_pipeline(campaign_id, skip=skip, limit=limit, projection=projection)
+            cursor = raw_collection(mapcamp_collection).aggregate(pipeline)
+            return StreamingResponse(ndjson_stream(cursor), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+        page_size = limit or CUSTOMERS_PAGE_SIZE
+        pipeline = campaign_customers_pipeline(campaign_id, skip=skip, limit=page_size, projection=projection)
+        customers, total = await asyncio.gather(
+            mapcamp_collection.aggregate(pipeline).to_list(page_size),
+            mapcamp_collection.count_documents({"campaign_id": campaign_id})
+        )
+        headers["X-Total-Count"] = str(total)
+        if skip + page_size < total:
+            headers["X-Next-Skip"] = str(skip + page_size)
+        return json_response(customers, headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching campaign customers: {str(e)}")
 
 @app.get("/api/stats")
-async def get_dashboard_stats():
-    """Get dashboard statistics"""
+async def get_dashboard_stats(request: Request):
+    """Get dashboard statistics from the materialized stats read model"""
     try:
-        print("Fetching dashboard stats...")
-        total_campaigns = await campaigns_collection.count_documents({})
-        print(f"Total campaigns: {total_campaigns}")
-        total_customers = await customers_collection.count_documents({})
-        print(f"Total customers: {total_customers}")
-        total_mappings = await mapcamp_collection.count_documents({})
-        print(f"Total mappings: {total_mappings}")
-        
-        city_pipeline = [
-            {"$group": {"_id": "$city", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
-        cities = await customers_collection.aggregate(city_pipeline).to_list(100)
-        
-        size_pipeline = [
-            {"$group": {"_id": "$size", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
-        sizes = await customers_collection.aggregate(size_pipeline).to_list(100)
-        
-        return {
-            "total_campaigns": total_campaigns,
-            "total_customers": total_customers,
-            "total_mappings": total_mappings,
-            "customers_by_city": cities,
-            "customers_by_size": sizes
-        }
+        not_modified, headers = await conditional_get(db, request, [CUSTOMERS, CAMPAIGNS, MAPPINGS, STATS], "stats")
+        if not_modified:
+            return not_modified
+        return json_response(await read_stats(db), headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
 
+@app.post("/api/stats/rebuild")
+async def rebuild_dashboard_stats():
+    """Recompute the stats read model from the source collections"""
+    try:
+        totals = await rebuild_stats(db)
+        return {"status": "success", "totals": totals}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rebuilding stats: {str(e)}")
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
@@ -230,57 +446,141 @@ async def debug():
         await db.command("ping")
         campaign_count = await campaigns_collection.count_documents({})
         first_campaign = await campaigns_collection.find_one()
-        return {
+        return json_response({
             "database_connected": True,
             "campaign_count": campaign_count,
-            "first_campaign": serialize_doc(first_campaign) if first_campaign else None,
+            "first_campaign": first_campaign,
             "atlas_uri_set": bool(ATLAS_URI)
-        }
+        })
     except Exception as e:
         return {
             "error": str(e),
             "atlas_uri_set": bool(ATLAS_URI)
         }
 
+def hot_queries():
+    """The queries the API issues on every page view, in explain() form"""
+    sample_campaign_id = 1
+    sample_id = ObjectId("000000000000000000000000")
+    return [
+        {"name": "customers_page", "collection": "customers", "filter": {"_id": {"$gt": sample_id}}, "sort": {"_id": 1}},
+        {"name": "customers_page_compact", "collection": "customers", "filter": {"_id": {"$gt": sample_id}}, "sort": {"_id": 1},
+         "projection": customer_projection("compact")},
+        {"name": "customer_by_id", "collection": "customers", "filter": {"_id": sample_id}},
+        {"name": "campaigns_list", "collection": "campaigns", "filter": {}, "sort": {"campaign_id": 1}},
+        {"name": "campaign_by_id", "collection": "campaigns", "filter": {"campaign_id": sample_campaign_id}},
+        {"name": "mapcamp_by_campaign", "collection": "mapcamp", "filter": {"campaign_id": sample_campaign_id}},
+        {"name": "campaign_customers", "collection": "mapcamp", "pipeline": campaign_customers_pipeline(sample_campaign_id)},
+        {"name": "stats_by_city", "collection": "customers", "pipeline": group_count_pipeline("city")},
+        {"name": "stats_by_size", "collection": "customers", "pipeline": group_count_pipeline("size")},
+        {"name": "interactions_by_customer", "collection": "interaction_buckets", "filter": {"customer_id": sample_id}, "sort": {"last_date": -1, "_id": -1}},
+        {"name": "summary_by_customer", "collection": "convosummary", "filter": {"_id": sample_id}},
+    ]
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint: HTTP, MongoDB and LLM metrics of every worker.
+
+    Plain def so merging the per-worker files runs in the threadpool.
+    """
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/api/debug/pool")
+async def debug_pool():
+    """Shared MongoDB connection pool configuration and live counters for this worker"""
+    return {"pid": os.getpid(), **database.pool_stats()}
+
+@app.get("/api/debug/llm")
+async def debug_llm():
+    """LLM response cache counters, gateway queue metrics and prompt sizes for this worker"""
+    from agents.llm_cache import llm_cache
+    from agents.prompt_builder import prompt_stats
+    return {"pid": os.getpid(), "cache": llm_cache.stats(), "gateway": llm_gateway.stats(), "prompts": prompt_stats()}
+
+@app.get("/api/debug/summary-queue")
+async def debug_summary_queue():
+    """Write-behind summary backlog and this worker's processing counters"""
+    try:
+        return {"pid": os.getpid(), **(await summary_queue.stats())}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading summary queue: {str(e)}")
+
+@app.get("/api/debug/workflows")
+async def debug_workflows():
+    """Per-workflow import/compile timings recorded at startup for this worker"""
+    return {"pid": os.getpid(), "workflows": workflow_registry.timings()}
+
+@app.get("/api/debug/indexes")
+async def debug_indexes():
+    """Show registered indexes and explain() every hot query, flagging COLLSCAN plans"""
+    try:
+        explained = await explain_queries(db, hot_queries())
+        return {
+            "indexes": await list_indexes(db),
+            **explained
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error explaining queries: {str(e)}")
+
 @app.get("/api/customers/{customer_id}/interactions")
-async def get_customer_interactions(customer_id: str):
-    """Get all interactions for a specific customer"""
+async def get_customer_interactions(
+    request: Request,
+    customer_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Get a page of interactions for a customer, newest page first.
+
+    Pass the returned next_before cursor as ?before= to fetch the next older
+    page; it is null once the history is exhausted.
+    """
     try:
         # Convert customer_id string to ObjectId
         object_id = ObjectId(customer_id)
+        try:
+            cursor = decode_cursor(before) if before else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid before cursor; pass next_before from the previous page")
+        not_modified, headers = await conditional_get(db, request, [INTERACTIONS, SUMMARIES], "interactions")
+        if not_modified:
+            return not_modified
         
-        # Fetch interactions document (stored with _id as customer ObjectId)
-        interaction_doc = await interactions_collection.find_one({"_id": object_id})
-        
-        # Extract interactions array from the document
-        interactions_list = []
-        if interaction_doc and "interactions" in interaction_doc:
-            interactions_list = interaction_doc["interactions"]
-            # Add timestamp field if it doesn't exist (use 'date' field)
-            for interaction in interactions_list:
-                if "timestamp" not in interaction and "date" in interaction:
-                    interaction["timestamp"] = interaction["date"]
+        # Reads only the bucket(s) holding the requested page
+        interactions_list, next_before = await recent_interactions(object_id, limit=limit, before=cursor)
+        # Add timestamp field if it doesn't exist (use 'date' field)
+        for interaction in interactions_list:
+            if "timestamp" not in interaction and "date" in interaction:
+                interaction["timestamp"] = interaction["date"]
         
         # Fetch conversation summary (also stored with _id as customer ObjectId)
         summary_doc = await convosummary_collection.find_one({"_id": object_id})
         summary_text = summary_doc.get("summary") if summary_doc else None
         
-        return {
+        return json_response({
             "interactions": interactions_list,
-            "summary": summary_text
-        }
+            "summary": summary_text,
+            "next_before": next_before
+        }, headers=headers)
+    except HTTPException:
+        raise
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid customer ID format")
     except Exception as e:
-        print(f"Error fetching interactions for customer {customer_id}: {str(e)}")
+        logger.exception("Error fetching interactions for customer %s", customer_id)
         raise HTTPException(status_code=500, detail=f"Error fetching interactions: {str(e)}")
 
+def llm_busy(e: LLMGatewayBusy) -> HTTPException:
+    """429 for a model call the gateway rejected instead of queueing"""
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 class NextActionRequest(BaseModel):
     customer_id: str
     approval: Optional[str] = None
     suggestion: Optional[str] = None
     interaction_type: Optional[str] = None
     customer_response: Optional[str] = None
+    bypass_cache: bool = False
 
 @app.post("/api/customers/{customer_id}/next-action")
 async def generate_next_action(customer_id: str, request: NextActionRequest):
@@ -294,83 +594,161 @@ async def generate_next_action(customer_id: str, request: NextActionRequest):
             store_interaction_node,
             AgentState
         )
+        from agents.context import request_scope
         
-        # Create initial state
-        state = AgentState(
-            messages=[],
-            customer_id=customer_id,
-            has_history=False,
-            interaction_data={},
-            conversation_summary="",
-            next_action="",
-            user_approved=False
-        )
+        # Customer context is loaded once per request and shared by the nodes
+        with request_scope():
+            # Create initial state
+            state = AgentState(
+                messages=[],
+                customer_id=customer_id,
+                has_history=False,
+                interaction_data={},
+                conversation_summary="",
+                next_action="",
+                user_approved=False,
+                bypass_cache=request.bypass_cache
+            )
         
-        # Check if this is an approval request
-        if request.approval:
-            if request.approval.lower() == "ok":
-                # User approved - store the suggestion
-                state["next_action"] = request.suggestion or ""
-                state["user_approved"] = True
-                await store_interaction_node(state)
+            # Check if this is an approval request
+            if request.approval:
+                if request.approval.lower() == "ok":
+                    # User approved - store the suggestion
+                    state["next_action"] = request.suggestion or ""
+                    state["user_approved"] = True
+                    await store_interaction_node(state)
                 
-                return {
-                    "status": "success",
-                    "message": "Action stored successfully",
-                    "suggestion": state["next_action"]
-                }
-            else:
-                # User requested changes - regenerate with feedback
-                print(f"✏️ Regenerating with feedback: {request.approval}")
+                    return {
+                        "status": "success",
+                        "message": "Action stored successfully",
+                        "suggestion": state["next_action"],
+                        "summary_status": "queued"
+                    }
+                else:
+                    # User requested changes - regenerate with feedback
+                    logger.info("Regenerating with feedback: %s", request.approval)
                 
-                # Add user feedback as a message
-                from langchain_core.messages import HumanMessage
-                state["messages"] = [HumanMessage(content=f"Please modify the suggestion: {request.approval}")]
+                    # Add user feedback as a message
+                    from langchain_core.messages import HumanMessage
+                    state["messages"] = [HumanMessage(content=f"Please modify the suggestion: {request.approval}")]
+                    # A regenerate request always wants a fresh answer, not the cached one
+                    state["bypass_cache"] = True
                 
-                # Re-run the workflow with feedback
-                state = await check_customer_node(state)
-                state = await fetch_context_node(state)
-                state = await generate_suggestion_node(state)
+                    # Re-run the workflow with feedback
+                    state = await check_customer_node(state)
+                    state = await fetch_context_node(state)
+                    state = await generate_suggestion_node(state)
                 
-                return {
-                    "status": "success",
-                    "suggestion": state.get("next_action", ""),
-                    "needs_approval": True
-                }
+                    return {
+                        "status": "success",
+                        "suggestion": state.get("next_action", ""),
+                        "needs_approval": True
+                    }
         
-        # Otherwise, generate new suggestion (run workflow nodes manually without present_to_user)
-        # Step 1: Check customer history
-        state = await check_customer_node(state)
+            # Otherwise, generate new suggestion (run workflow nodes manually without present_to_user)
+            # Step 1: Check customer history
+            state = await check_customer_node(state)
         
-        # Step 2: Fetch context
-        state = await fetch_context_node(state)
+            # Step 2: Fetch context
+            state = await fetch_context_node(state)
         
-        # Step 3: Generate suggestion
-        state = await generate_suggestion_node(state)
+            # Step 3: Generate suggestion
+            state = await generate_suggestion_node(state)
         
-        # Return suggestion to frontend for approval
-        return {
-            "status": "success",
-            "suggestion": state.get("next_action", ""),
-            "needs_approval": True
-        }
+            # Return suggestion to frontend for approval
+            return {
+                "status": "success",
+                "suggestion": state.get("next_action", ""),
+                "needs_approval": True
+            }
         
+    except LLMGatewayBusy as e:
+        raise llm_busy(e)
+    except Exception as e:
+        logger.exception("Error in next-action endpoint")
+        raise HTTPException(status_code=500, detail=f"Error running next action agent: {str(e)}")
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {dumps_text(data)}\n\n"
+
+@app.get("/api/customers/{customer_id}/next-action/stream")
+async def stream_next_action(customer_id: str, bypass_cache: bool = False):
+    """Stream the next action suggestion as server-sent events.
+
+    Emits `token` events ({"text"}) while the model generates, then one
+    `suggestion` event with the full text, or an `error` event.
+    """
+    try:
+        from agents.nextmove import (
+            check_customer_node,
+            fetch_context_node,
+            build_suggestion_prompt,
+            llm,
+            AgentState
+        )
+        from agents.context import load_customer_context, request_scope
+        from agents.llm_cache import stream_text
+
+        if not ObjectId.is_valid(customer_id):
+            raise HTTPException(status_code=400, detail="Invalid customer ID format")
+
+        # Context is loaded before the response starts so lookup errors and
+        # unknown customers get a proper status code; the nodes below reuse
+        # it from the request scope (check_customer_node swallows errors)
+        with request_scope():
+            context = await load_customer_context(customer_id)
+            if not context["exists"]:
+                raise HTTPException(status_code=404, detail="Customer not found")
+            state = AgentState(
+                messages=[],
+                customer_id=customer_id,
+                has_history=False,
+                interaction_data={},
+                conversation_summary="",
+                next_action="",
+                user_approved=False,
+                bypass_cache=bypass_cache
+            )
+            state = await check_customer_node(state)
+            state = await fetch_context_node(state)
+        prompt = build_suggestion_prompt(state)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in next-action endpoint: {str(e)}")
+        logger.exception("Error in next-action stream endpoint")
         raise HTTPException(status_code=500, detail=f"Error running next action agent: {str(e)}")
 
+    async def events():
+        parts = []
+        try:
+            async for text in stream_text(llm, prompt, bypass_cache=bypass_cache, agent="nextmove"):
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+            yield sse_event("suggestion", {"suggestion": "".join(parts), "needs_approval": True})
+        except LLMGatewayBusy as e:
+            yield sse_event("error", {"detail": str(e), "status": 429, "retry_after": e.retry_after})
+        except Exception as e:
+            logger.exception("Error streaming next action")
+            yield sse_event("error", {"detail": f"Error running next action agent: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/customers/{customer_id}/add-response")
 async def add_customer_response(customer_id: str, request: NextActionRequest):
     """Add a customer response using the adder agent"""
     try:
-        from agents.adder import create_customer_response_workflow, CustomerResponseState
-        import asyncio
+        from agents.adder import CustomerResponseState
         
         if not request.interaction_type or not request.customer_response:
             raise HTTPException(status_code=400, detail="interaction_type and customer_response are required")
         
-        # Create and run workflow
-        workflow = create_customer_response_workflow()
+        # Graph is compiled once per worker at startup; the write-behind variant
+        # stores the response and leaves the summary to the summary queue workers
+        workflow = workflow_registry.get_workflow("adder_write_behind")
         
         initial_state = CustomerResponseState(
             messages=[],
@@ -382,34 +760,145 @@ async def add_customer_response(customer_id: str, request: NextActionRequest):
             updated_summary=""
         )
         
-        final_state = await workflow.ainvoke(initial_state)
+        await workflow.ainvoke(initial_state)
         
         return {
             "status": "success",
-            "updated_summary": final_state.get("updated_summary", "")
+            "summary_status": "queued"
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding customer response: {str(e)}")
 
-@app.post("/api/campaigns/create")
+async def run_campaign_creation_job(payload, progress):
+    """Job handler: run the campaign_creator agent and fail the job on error"""
+    from agents.campaign_creator import run_campaign_creation
+
+    result = await run_campaign_creation(progress=progress)
+    if result.get("status") == "error":
+        raise RuntimeError(result.get("message", "Campaign creation failed"))
+    return result
+
+@app.post("/api/campaigns/create", status_code=202)
 async def create_campaigns():
-    """Trigger campaign creation using the campaign_creator agent"""
+    """Submit campaign creation as a background job; poll /api/jobs/{job_id} for status"""
     try:
-        from agents.campaign_creator import run_campaign_creation
-        
-        # Run the campaign creation workflow
-        result = await run_campaign_creation()
-        
+        # Every run rebuilds all campaigns, so concurrent submissions share one job
+        job, deduplicated = await job_runner.submit("campaign_creation", dedupe_key="campaign_creation")
         return {
-            "status": "success",
-            "message": "Campaigns created successfully",
-            "data": result
+            "status": "accepted",
+            "message": "Campaign creation already in progress" if deduplicated else "Campaign creation started",
+            "job_id": job["_id"],
+            "deduplicated": deduplicated,
+            "job": job
         }
-        
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating campaigns: {str(e)}")
 
+async def run_campaign_next_actions_job(payload, progress):
+    """Job handler: generate draft next actions for every customer in a campaign"""
+    from agents.campaign_next_actions import run_campaign_next_actions
+
+    return await run_campaign_next_actions(
+        payload["campaign_id"],
+        progress=progress,
+        concurrency=payload.get("concurrency"),
+        bypass_cache=payload.get("bypass_cache", False)
+    )
+
+class CampaignNextActionsRequest(BaseModel):
+    concurrency: Optional[int] = None
+    bypass_cache: bool = False
+
+@app.post("/api/campaigns/{campaign_id}/next-actions", status_code=202)
+async def generate_campaign_next_actions(campaign_id: int, request: Optional[CampaignNextActionsRequest] = None):
+    """Submit draft next-action generation for all customers in a campaign as a
+    background job; poll /api/jobs/{job_id} for progress and the throughput report"""
+    request = request or CampaignNextActionsRequest()
+    if request.concurrency is not None and not 1 <= request.concurrency <= 32:
+        raise HTTPException(status_code=400, detail="concurrency must be between 1 and 32")
+    try:
+        campaign = await campaigns_collection.find_one({"campaign_id": campaign_id}, {"_id": 1})
+        if not campaign:
+            raise HTTPException(status_code=404, detail="Campaign not found")
+
+        job, deduplicated = await job_runner.submit(
+            "campaign_next_actions",
+            payload={"campaign_id": campaign_id, "concurrency": request.concurrency, "bypass_cache": request.bypass_cache},
+            dedupe_key=f"campaign_next_actions:{campaign_id}"
+        )
+        return {
+            "status": "accepted",
+            "message": "Next actions already being generated" if deduplicated else "Next action generation started",
+            "job_id": job["_id"],
+            "deduplicated": deduplicated,
+            "job": job
+        }
+    except HTTPException:
+        raise
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating campaign next actions: {str(e)}")
+
+@app.get("/api/campaigns/{campaign_id}/next-actions")
+async def get_campaign_next_actions(
+    campaign_id: int,
+    status: Optional[str] = Query(None, description="draft, approving, approved or failed"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """List the stored next-action drafts for a campaign"""
+    try:
+        from agents.campaign_next_actions import drafts_collection
+
+        query = {"campaign_id": campaign_id}
+        if status:
+            query["status"] = status
+        drafts = await drafts_collection.find(query).sort("customer_id", 1).skip(skip).limit(limit).to_list(limit)
+        return json_response(drafts)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching campaign next actions: {str(e)}")
+
+class ApproveDraftRequest(BaseModel):
+    suggestion: Optional[str] = None
+
+@app.post("/api/campaigns/{campaign_id}/next-actions/{customer_id}/approve")
+async def approve_campaign_next_action(campaign_id: int, customer_id: str, request: Optional[ApproveDraftRequest] = None):
+    """Approve a draft (optionally edited) and store it as the customer's next interaction"""
+    try:
+        from agents.campaign_next_actions import approve_draft
+
+        draft = await approve_draft(campaign_id, customer_id, suggestion=request.suggestion if request else None)
+        if draft is None:
+            raise HTTPException(status_code=404, detail="Draft not found")
+        return json_response({"status": "success", "message": "Action stored successfully", "draft": draft})
+    except HTTPException:
+        raise
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid customer ID format")
+    except LLMGatewayBusy as e:
+        raise llm_busy(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error approving next action: {str(e)}")
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, progress and result of a background job"""
+    try:
+        job = await job_runner.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching job: {str(e)}")
+
 # Mount the frontend static files
 frontend_path = pathlib.Path(__file__).parent.parent / "frontend"
 app.mount("/", StaticFiles(directory=str(frontend_path), html=True), name="frontend")
@@ -0,0 +1,180 @@
+"""Prometheus metrics for HTTP, MongoDB and the LLM calls, served at GET /metrics and merged across gunicorn workers."""
+import os
+import threading
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from pymongo import monitoring
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route template and status",
+    ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time until the response body was fully sent",
+    ["method", "route"]
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests currently being handled",
+    ["method"], multiprocess_mode="livesum"
+)
+
+MONGO_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trips as reported by the driver",
+    ["command", "collection"], buckets=MONGO_BUCKETS
+)
+MONGO_FAILURES = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error",
+    ["command", "collection"]
+)
+
+POOL_CONNECTIONS = Gauge(
+    "mongodb_pool_connections", "Connections per server by state (open, in_use, waiting)",
+    ["address", "state"], multiprocess_mode="livesum"
+)
+POOL_EVENTS = Counter(
+    "mongodb_pool_events_total", "Connection pool events per server",
+    ["address", "event"]
+)
+POOL_GAUGES = {"open", "in_use", "waiting"}
+
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "generate_content_async calls, including streaming until the last chunk",
+    ["agent", "priority", "outcome"], buckets=LLM_BUCKETS
+)
+LLM_REQUESTS = Counter(
+    "llm_requests_total", "generate_content_async calls by outcome (ok, error, busy)",
+    ["agent", "priority", "outcome"]
+)
+LLM_CACHE_LOOKUPS = Counter(
+    "llm_cache_lookups_total", "LLM response cache lookups by result",
+    ["result"]
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_gateway_queue_depth", "Calls waiting for an LLM gateway slot",
+    ["priority"], multiprocess_mode="livesum"
+)
+LLM_IN_FLIGHT = Gauge(
+    "llm_gateway_in_flight", "Admitted LLM calls currently running",
+    multiprocess_mode="livesum"
+)
+LLM_QUEUE_WAIT = Histogram(
+    "llm_gateway_wait_seconds", "Time from asking for an LLM slot to being admitted",
+    ["priority"], buckets=WAIT_BUCKETS
+)
+LLM_REJECTIONS = Counter(
+    "llm_gateway_rejections_total", "LLM calls refused by the gateway",
+    ["priority", "reason"]
+)
+
+
+def route_label(scope, status):
+    """Route template of the matched endpoint; bounded so label cardinality stays low"""
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    # Everything else is the "/" StaticFiles mount
+    return "<unmatched>" if status == 404 else "<static>"
+
+
+class PrometheusMiddleware:
+    """Pure ASGI middleware, so streaming responses are timed to their last chunk"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.labels(method).dec()
+            route = route_label(scope, status)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+
+
+def command_collection(command_name, command):
+    """Collection a command targets; "" for database or admin commands"""
+    target = command.get(command_name)
+    if command_name == "getMore":
+        target = command.get("collection")
+    return target if isinstance(target, str) else ""
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command per command name and collection.
+
+    Only started events carry the command document, so its collection is
+    remembered until the matching succeeded/failed event. The driver calls
+    these hooks from its own threads, hence the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def started(self, event):
+        collection = command_collection(event.command_name, event.command)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event):
+        with self._lock:
+            collection = self._pending.pop((event.connection_id, event.request_id), "")
+        MONGO_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+        return collection
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        MONGO_FAILURES.labels(event.command_name, collection).inc()
+
+
+def record_pool_event(address, key, amount=1):
+    """Mirror one PoolStatsListener counter change into Prometheus"""
+    if key in POOL_GAUGES:
+        POOL_CONNECTIONS.labels(address, key).inc(amount)
+    else:
+        POOL_EVENTS.labels(address, key).inc(amount)
+
+
+def metrics_payload():
+    """(body, content type) for a scrape, merged across workers when multiprocess"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
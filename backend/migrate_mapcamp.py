@@ -0,0 +1,128 @@
+"""Rewrite mapcamp.customer_obj_id from strings to ObjectIds (resumable).
+
+Usage (from the backend directory):
+    python migrate_mapcamp.py [--batch-size 1000] [--dry-run]
+"""
+import argparse
+import asyncio
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import db, mapcamp_collection
+from indexes import INDEXES, ensure_indexes
+from stats import rebuild_stats
+
+DUPLICATE_KEY = 11000
+
+
+async def convert_string_ids(batch_size, dry_run=False):
+    """Convert string customer_obj_id values in _id order, batch by batch"""
+    converted = duplicates = invalid = 0
+    last_id = None
+
+    while True:
+        query = {"customer_obj_id": {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await mapcamp_collection.find(query, {"customer_obj_id": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        operations = []
+        operation_ids = []
+        for mapping in batch:
+            try:
+                object_id = ObjectId(mapping["customer_obj_id"])
+            except InvalidId:
+                invalid += 1
+                print(f"⚠️ Skipping mapping {mapping['_id']}: invalid customer_obj_id {mapping['customer_obj_id']!r}")
+                continue
+            operations.append(UpdateOne({"_id": mapping["_id"]}, {"$set": {"customer_obj_id": object_id}}))
+            operation_ids.append(mapping["_id"])
+
+        if dry_run or not operations:
+            converted += len(operations)
+            continue
+
+        try:
+            result = await mapcamp_collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+        except BulkWriteError as e:
+            # The unique index already exists and the ObjectId form of this
+            # mapping is present, so the string copy is redundant.
+            converted += e.details.get("nModified", 0)
+            dup_ids = [operation_ids[error["index"]] for error in e.details["writeErrors"] if error["code"] == DUPLICATE_KEY]
+            other_errors = [error for error in e.details["writeErrors"] if error["code"] != DUPLICATE_KEY]
+            if dup_ids:
+                await mapcamp_collection.delete_many({"_id": {"$in": dup_ids}})
+                duplicates += len(dup_ids)
+            if other_errors:
+                raise
+
+        print(f"   ...{converted} converted so far")
+
+    return {"converted": converted, "duplicates_removed": duplicates, "invalid": invalid}
+
+
+async def remove_duplicates(batch_size, dry_run=False):
+    """Keep the oldest mapping for every (campaign_id, customer_obj_id) pair"""
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"campaign_id": "$campaign_id", "customer_obj_id": "$customer_obj_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    removed = 0
+    operations = []
+    async for group in mapcamp_collection.aggregate(pipeline, allowDiskUse=True):
+        for duplicate_id in group["ids"][1:]:
+            operations.append(DeleteOne({"_id": duplicate_id}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                await mapcamp_collection.bulk_write(operations, ordered=False)
+            removed += len(operations)
+            operations = []
+    if operations:
+        if not dry_run:
+            await mapcamp_collection.bulk_write(operations, ordered=False)
+        removed += len(operations)
+    return removed
+
+
+async def migrate(batch_size, dry_run=False):
+    print("=" * 60)
+    print(f"🔄 Migrating mapcamp customer ids (batch size {batch_size}{', dry run' if dry_run else ''})")
+    print("=" * 60)
+
+    result = await convert_string_ids(batch_size, dry_run)
+    print(f"✅ Converted {result['converted']} mappings ({result['invalid']} invalid, {result['duplicates_removed']} duplicates removed)")
+
+    removed = await remove_duplicates(batch_size, dry_run)
+    print(f"✅ Removed {removed} duplicate mappings")
+
+    if dry_run:
+        print("Dry run: indexes and stats left untouched.")
+        return
+
+    report = await ensure_indexes(db, {"mapcamp": INDEXES["mapcamp"]})
+    for entry in report:
+        print(f"   Index {entry['name']}: {entry['status']}")
+    await rebuild_stats(db)
+    print("\n🎉 mapcamp migration completed!")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert mapcamp.customer_obj_id to ObjectId and enforce uniqueness")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
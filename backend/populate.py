@@ -1,7 +1,6 @@
-import re
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from importer import TSV_SPLIT, build_record, normalize_headers
 
 # --- Configuration ---
 # Replace this with your actual MongoDB Atlas connection string
@@ -52,41 +51,11 @@ def parse_data(data_text: str) -> list[dict]:
     if not lines:
         return []
 
-  
-    header_line = lines[0].replace('/', '').replace('|', '').strip()
+    # Same header/cell rules as the streaming import endpoint (importer.py)
+    headers = normalize_headers(lines[0])
 
-    headers = [h.strip().lower().replace(' ', '_').replace('-', '_') for h in re.split(r'\t{1,}', header_line)]
-
-    records = []
-    
     # Iterate through the data lines, starting from the second line (index 1)
-    for line in lines[1:]:
-
-        values = re.split(r'\t{1,}', line)
-        
-        # Fill missing trailing fields with an empty string
-        values.extend([''] * (len(headers) - len(values)))
-        values = values[:len(headers)] # Truncate if there are extra fields
-
-        record = {}
-        for i, header in enumerate(headers):
-            # Clean up the value by replacing newlines/tabs with a space and stripping whitespace
-            cleaned_value = values[i].replace('\n', ' ').strip()
-            if header == 'instagram_id':
-                record['instagram_id'] = cleaned_value.replace('https://www.instagram.com/', '').replace('/', '')
-            elif header == 'name':
-                record['name'] = cleaned_value
-            elif header == 'google_maps_link':
-                record['google_maps_link'] = cleaned_value
-            else:
-                record[header] = cleaned_value
-        
-        if 'name' in record:
-            record['name'] = record.pop('name')
-
-        records.append(record)
-
-    return records
+    return [build_record(headers, TSV_SPLIT.split(line)) for line in lines[1:]]
 
 
 async def populate_mongodb(data: list[dict]):
@@ -0,0 +1,45 @@
+"""?fields= presets and field lists for the customer read endpoints, turned into MongoDB projections."""
+CUSTOMER_FIELDS = (
+    "name", "contact_number", "address", "instagram_id", "description",
+    "google_maps_link", "email", "city", "size", "created_at"
+)
+
+CUSTOMER_PRESETS = {
+    "list": ("name", "city", "size", "contact_number", "instagram_id"),
+    "compact": ("name", "city", "size"),
+    "detail": None,
+}
+
+# Name column of sheets loaded by populate.py, before the importer mapped it
+# to name; such customers still have no name field
+LEGACY_NAME_FIELD = "salon__parlour"
+
+# Fields the campaign segmentation reads
+SEGMENTATION_FIELDS = ("name", LEGACY_NAME_FIELD, "city", "size", "description", "address")
+
+
+def customer_name(customer):
+    return customer.get("name") or customer.get(LEGACY_NAME_FIELD) or ""
+
+
+def to_projection(fields):
+    return {field: 1 for field in fields}
+
+
+def customer_projection(fields):
+    """Projection for a ?fields= value; None means the whole document"""
+    if not fields:
+        return None
+    fields = fields.strip()
+    if fields in CUSTOMER_PRESETS:
+        preset = CUSTOMER_PRESETS[fields]
+        return to_projection(preset) if preset else None
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field != "_id" and field not in CUSTOMER_FIELDS]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields {', '.join(unknown)}; use a preset ({', '.join(CUSTOMER_PRESETS)}) "
+            f"or any of {', '.join(CUSTOMER_FIELDS)}"
+        )
+    return to_projection(field for field in requested if field != "_id") or {"_id": 1}
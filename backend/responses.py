@@ -0,0 +1,76 @@
+"""orjson encoding of Mongo documents (ObjectId, datetime, Decimal128, raw BSON) for API responses and agent tools."""
+import bson
+import orjson
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.decimal128 import Decimal128
+from bson.raw_bson import RawBSONDocument
+from fastapi.responses import JSONResponse
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+DECODE_CODEC_OPTIONS = CodecOptions()
+NDJSON_BATCH_SIZE = 500
+
+
+def encode_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, RawBSONDocument):
+        return bson.decode(obj.raw, DECODE_CODEC_OPTIONS)
+    if isinstance(obj, Decimal128):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj):
+    """JSON bytes for obj, with BSON types encoded"""
+    return orjson.dumps(obj, default=encode_default, option=OPTIONS)
+
+
+def dumps_text(obj):
+    """JSON str for obj, for the agent tools that hand text to LangChain"""
+    return dumps(obj).decode()
+
+
+loads = orjson.loads
+
+
+class BSONJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+def json_response(content, status_code=200, headers=None):
+    """Response for Mongo documents that bypasses jsonable_encoder"""
+    return BSONJSONResponse(content, status_code=status_code, headers=headers)
+
+
+def raw_collection(collection):
+    """The same collection, returning undecoded RawBSONDocument results"""
+    return collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+
+def decode_raw_batch(docs):
+    """Decode a batch of RawBSONDocuments in a single C call"""
+    return bson.decode_all(b"".join(doc.raw for doc in docs), DECODE_CODEC_OPTIONS)
+
+
+def _ndjson_chunk(docs):
+    if isinstance(docs[0], RawBSONDocument):
+        docs = decode_raw_batch(docs)
+    return b"".join(dumps(doc) + b"\n" for doc in docs)
+
+
+async def ndjson_stream(cursor, batch_size=NDJSON_BATCH_SIZE):
+    """Yield a Motor cursor as NDJSON, one chunk of lines per batch of documents"""
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield _ndjson_chunk(batch)
+            batch = []
+    if batch:
+        yield _ndjson_chunk(batch)
@@ -1,2 +1,5 @@
 #!/bin/bash
-gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
\ No newline at end of file
+# Workers, bind address and the shared Prometheus metrics directory are set in gunicorn.conf.py;
+# WEB_CONCURRENCY is also read by the LLM gateway to split its budgets per worker
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+gunicorn main:app -c gunicorn.conf.py
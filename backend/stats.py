@@ -0,0 +1,138 @@
+"""Materialized dashboard statistics in the `stats` collection, kept current with $inc on write."""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from pymongo import UpdateOne
+from versions import STATS, bump_versions
+
+logger = logging.getLogger(__name__)
+
+STATS_COLLECTION = "stats"
+TOTALS_ID = "totals"
+GROUP_FIELDS = ("city", "size")
+
+
+def _group_id(field, value):
+    return {"field": field, "value": value}
+
+
+def group_count_pipeline(field):
+    """Count customers per value of field.
+
+    The leading $sort lets the planner walk the customers_<field> index
+    (covered, no document fetch) instead of scanning the collection.
+    """
+    return [
+        {"$sort": {field: 1}},
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}}
+    ]
+
+
+async def _apply(db, operations):
+    """Run counter updates; failures are logged and left for the rebuild job"""
+    if not operations:
+        return
+    try:
+        await db[STATS_COLLECTION].bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.warning("Stats update failed (will be fixed by next rebuild): %s", e)
+
+
+async def record_customers_added(db, customers):
+    """Count newly inserted customer documents into totals and city/size groups"""
+    if not customers:
+        return
+    operations = [UpdateOne({"_id": TOTALS_ID}, {"$inc": {"customers": len(customers)}}, upsert=True)]
+    for field in GROUP_FIELDS:
+        counts = Counter(customer.get(field) for customer in customers)
+        for value, count in counts.items():
+            operations.append(UpdateOne({"_id": _group_id(field, value)}, {"$inc": {"count": count}}, upsert=True))
+    await _apply(db, operations)
+
+
+async def record_campaigns_added(db, count=1):
+    await _apply(db, [UpdateOne({"_id": TOTALS_ID}, {"$inc": {"campaigns": count}}, upsert=True)])
+
+
+async def record_mappings_added(db, count=1):
+    await _apply(db, [UpdateOne({"_id": TOTALS_ID}, {"$inc": {"mappings": count}}, upsert=True)])
+
+
+async def reset_campaign_stats(db):
+    """Zero campaign and mapping totals after the campaign collections are cleared"""
+    await _apply(db, [UpdateOne({"_id": TOTALS_ID}, {"$set": {"campaigns": 0, "mappings": 0}}, upsert=True)])
+
+
+async def rebuild_stats(db):
+    """Recompute the whole read model from the source collections"""
+    logger.info("Rebuilding dashboard stats")
+    customers = db["customers"]
+    totals = {
+        "customers": await customers.count_documents({}),
+        "campaigns": await db["campaigns"].count_documents({}),
+        "mappings": await db["mapcamp"].count_documents({}),
+        "rebuilt_at": datetime.utcnow()
+    }
+
+    operations = [UpdateOne({"_id": TOTALS_ID}, {"$set": totals}, upsert=True)]
+    seen = []
+    for field in GROUP_FIELDS:
+        async for group in customers.aggregate(group_count_pipeline(field)):
+            group_id = _group_id(field, group["_id"])
+            seen.append(group_id)
+            operations.append(UpdateOne({"_id": group_id}, {"$set": {"count": group["count"]}}, upsert=True))
+
+    stats_collection = db[STATS_COLLECTION]
+    await stats_collection.bulk_write(operations, ordered=False)
+    # Drop groups whose value no longer exists on any customer
+    await stats_collection.delete_many({"_id": {"$ne": TOTALS_ID, "$nin": seen}})
+    await bump_versions(db, STATS)
+    logger.info("Stats rebuilt: %d customers, %d campaigns, %d mappings", totals["customers"], totals["campaigns"], totals["mappings"])
+    return totals
+
+
+async def read_stats(db):
+    """Return the dashboard payload from the read model, rebuilding it if absent"""
+    docs = await db[STATS_COLLECTION].find().to_list(None)
+    if not any(doc["_id"] == TOTALS_ID for doc in docs):
+        await rebuild_stats(db)
+        docs = await db[STATS_COLLECTION].find().to_list(None)
+
+    totals = {}
+    groups = {field: [] for field in GROUP_FIELDS}
+    for doc in docs:
+        if doc["_id"] == TOTALS_ID:
+            totals = doc
+        elif isinstance(doc["_id"], dict) and doc["_id"].get("field") in groups and doc.get("count", 0) > 0:
+            groups[doc["_id"]["field"]].append({"_id": doc["_id"]["value"], "count": doc["count"]})
+
+    for field in GROUP_FIELDS:
+        groups[field].sort(key=lambda group: group["count"], reverse=True)
+
+    return {
+        "total_campaigns": totals.get("campaigns", 0),
+        "total_customers": totals.get("customers", 0),
+        "total_mappings": totals.get("mappings", 0),
+        "customers_by_city": groups["city"],
+        "customers_by_size": groups["size"]
+    }
+
+
+async def stats_rebuild_loop(db, interval_seconds):
+    """Background job: rebuild on startup if missing, then every interval_seconds"""
+    try:
+        if not await db[STATS_COLLECTION].find_one({"_id": TOTALS_ID}):
+            await rebuild_stats(db)
+    except Exception:
+        logger.exception("Initial stats rebuild failed")
+
+    if interval_seconds <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await rebuild_stats(db)
+        except Exception:
+            logger.exception("Periodic stats rebuild failed")
@@ -0,0 +1,35 @@
+"""Shared fixtures: the API against an in-memory MongoDB and the offline fake model."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ["LLM_BACKEND"] = "fake"
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+import motor.motor_asyncio  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+
+@pytest.fixture
+def app():
+    import main
+    return main.app
+
+
+@pytest.fixture
+def db():
+    import database
+    return database.db
+
+
+@pytest.fixture
+def client(app):
+    from fastapi.testclient import TestClient
+    # Not used as a context manager: the lifespan (index builds, background
+    # workers) is not needed and would run against the mock
+    return TestClient(app)
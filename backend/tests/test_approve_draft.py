@@ -0,0 +1,101 @@
+"""approve_draft() claims, stores and rolls back batch next-action drafts"""
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import agents.nextmove
+from agents.campaign_next_actions import APPROVING_TIMEOUT, approve_draft, drafts_collection
+from interaction_store import recent_interactions
+
+
+def insert_draft(db, status, updated_at=None):
+    customer_id = ObjectId()
+    now = datetime.utcnow()
+
+    async def insert():
+        await db["customers"].insert_one({"_id": customer_id, "name": "Glow Salon", "city": "Delhi", "size": "Small"})
+        await drafts_collection.insert_one({
+            "campaign_id": 1,
+            "customer_id": customer_id,
+            "status": status,
+            "suggestion": "Send an email with the spring offer",
+            "error": None,
+            "created_at": now,
+            "updated_at": updated_at or now
+        })
+
+    asyncio.run(insert())
+    return customer_id
+
+
+def draft_and_history(customer_id):
+    async def read():
+        draft = await drafts_collection.find_one({"campaign_id": 1, "customer_id": customer_id})
+        interactions, _ = await recent_interactions(customer_id, limit=10)
+        return draft, interactions
+
+    return asyncio.run(read())
+
+
+def test_approves_draft_and_stores_interaction(db):
+    customer_id = insert_draft(db, "draft")
+
+    approved = asyncio.run(approve_draft(1, str(customer_id)))
+
+    assert approved["status"] == "approved"
+    draft, interactions = draft_and_history(customer_id)
+    assert draft["status"] == "approved"
+    assert [item["summary"] for item in interactions] == ["Send an email with the spring offer"]
+
+
+def test_fresh_approving_draft_is_left_alone(db):
+    customer_id = insert_draft(db, "approving")
+
+    result = asyncio.run(approve_draft(1, str(customer_id)))
+
+    assert result["status"] == "approving"
+    assert draft_and_history(customer_id)[1] == []
+
+
+def test_stale_approving_draft_can_be_approved(db):
+    customer_id = insert_draft(db, "approving", updated_at=datetime.utcnow() - APPROVING_TIMEOUT - timedelta(hours=1))
+
+    approved = asyncio.run(approve_draft(1, str(customer_id)))
+
+    assert approved["status"] == "approved"
+    assert len(draft_and_history(customer_id)[1]) == 1
+
+
+def test_failed_write_rolls_the_draft_back(db, monkeypatch):
+    customer_id = insert_draft(db, "draft")
+
+    async def fail(customer_id, interaction):
+        raise RuntimeError("write concern error")
+
+    monkeypatch.setattr(agents.nextmove, "append_interaction", fail)
+    try:
+        asyncio.run(approve_draft(1, str(customer_id)))
+    except RuntimeError as e:
+        assert "write concern error" in str(e)
+    else:
+        raise AssertionError("approve_draft should fail when the interaction is not stored")
+
+    draft, interactions = draft_and_history(customer_id)
+    assert draft["status"] == "draft"
+    assert interactions == []
+
+
+def test_failed_write_on_stale_approving_draft_rolls_back_to_draft(db, monkeypatch):
+    customer_id = insert_draft(db, "approving", updated_at=datetime.utcnow() - APPROVING_TIMEOUT - timedelta(hours=1))
+
+    async def fail(customer_id, interaction):
+        raise RuntimeError("write concern error")
+
+    monkeypatch.setattr(agents.nextmove, "append_interaction", fail)
+    try:
+        asyncio.run(approve_draft(1, str(customer_id)))
+    except RuntimeError:
+        pass
+
+    assert draft_and_history(customer_id)[0]["status"] == "draft"
@@ -0,0 +1,26 @@
+"""run_campaign_creation() clears state keyed by the reused campaign ids"""
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+from agents.campaign_creator import run_campaign_creation
+from agents.campaign_next_actions import drafts_collection
+
+
+def test_rebuild_clears_next_action_drafts(db):
+    async def run():
+        await drafts_collection.insert_one({
+            "campaign_id": 1,
+            "customer_id": ObjectId(),
+            "status": "approved",
+            "suggestion": "Call about the old campaign",
+            "updated_at": datetime.utcnow()
+        })
+        result = await run_campaign_creation()
+        return result, await drafts_collection.count_documents({})
+
+    result, drafts = asyncio.run(run())
+
+    assert result["status"] == "success"
+    assert drafts == 0
@@ -0,0 +1,128 @@
+"""Bucketed interaction storage: rollover, cursor paging, legacy migration"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+import interaction_store
+from interaction_store import (
+    append_interaction,
+    buckets_collection,
+    count_interactions,
+    last_interaction_by_sender,
+    recent_interactions,
+    recent_interactions_many,
+)
+
+START = datetime(2024, 1, 1, 9, 0)
+
+
+@pytest.fixture(autouse=True)
+def small_buckets(monkeypatch):
+    monkeypatch.setattr(interaction_store, "BUCKET_SIZE", 3)
+
+
+def interaction(n, sender="me", date=None):
+    return {"sender": sender, "type": "email", "date": date or START + timedelta(minutes=n), "summary": f"message {n}"}
+
+
+def append_all(customer_id, interactions):
+    async def append():
+        for item in interactions:
+            await append_interaction(customer_id, item)
+
+    asyncio.run(append())
+
+
+def summaries(interactions):
+    return [item["summary"] for item in interactions]
+
+
+def test_full_buckets_roll_over_to_a_new_open_bucket():
+    customer_id = ObjectId()
+    append_all(customer_id, [interaction(n) for n in range(7)])
+
+    async def read():
+        buckets = await buckets_collection.find({"customer_id": customer_id}).sort("first_date", 1).to_list(None)
+        return buckets, await count_interactions(customer_id)
+
+    buckets, total = asyncio.run(read())
+    assert [bucket["count"] for bucket in buckets] == [3, 3, 1]
+    assert [bool(bucket.get("open")) for bucket in buckets] == [False, False, True]
+    assert total == 7
+
+
+def test_cursor_pages_through_tied_dates_without_gaps():
+    customer_id = ObjectId()
+    same_time = START + timedelta(hours=1)
+    append_all(customer_id, [interaction(n) for n in range(2)] + [interaction(n, date=same_time) for n in range(2, 7)])
+
+    async def page_all():
+        pages, before = [], None
+        while True:
+            items, before = await recent_interactions(customer_id, limit=2, before=before)
+            pages.append(summaries(items))
+            if before is None:
+                return pages
+
+    pages = asyncio.run(page_all())
+    seen = [summary for page in reversed(pages) for summary in page]
+    assert sorted(seen) == [f"message {n}" for n in range(7)]
+    assert len(seen) == len(set(seen))
+    assert all(len(page) == 2 for page in pages[:-1])
+
+
+def test_legacy_interactions_are_migrated_on_first_read(db):
+    customer_id = ObjectId()
+    legacy = [interaction(n) for n in range(5)]
+    asyncio.run(db["interactions"].insert_one({"_id": customer_id, "interactions": legacy}))
+
+    items, before = asyncio.run(recent_interactions(customer_id, limit=10))
+
+    assert summaries(items) == summaries(legacy)
+    assert before is None
+    assert asyncio.run(db["interactions"].find_one({"_id": customer_id})) is None
+    assert asyncio.run(count_interactions(customer_id)) == 5
+
+
+def test_batch_reads_take_enough_partial_legacy_buckets(db, monkeypatch):
+    monkeypatch.setattr(interaction_store, "BUCKET_SIZE", 4)
+    customer_id, other_id = ObjectId(), ObjectId()
+    # Migrated into a full bucket of 4 and a partial one of 1; the next
+    # write opens a third bucket, so the two newest hold only 2 entries
+    asyncio.run(db["interactions"].insert_one({"_id": customer_id, "interactions": [interaction(n) for n in range(5)]}))
+    append_all(customer_id, [interaction(5)])
+
+    recent = asyncio.run(recent_interactions_many([customer_id, other_id], limit=3))
+
+    assert summaries(recent[customer_id]) == ["message 3", "message 4", "message 5"]
+    assert recent[other_id] == []
+
+
+def test_batch_reads_match_single_customer_reads():
+    customer_id = ObjectId()
+    append_all(customer_id, [interaction(n) for n in range(8)])
+
+    single, _ = asyncio.run(recent_interactions(customer_id, limit=5))
+    batch = asyncio.run(recent_interactions_many([customer_id], limit=5))
+
+    assert summaries(batch[customer_id]) == summaries(single) == [f"message {n}" for n in range(3, 8)]
+
+
+def test_last_by_sender_reads_the_newest_bucket_that_has_the_sender():
+    customer_id = ObjectId()
+    append_all(customer_id, [
+        interaction(0, sender="customer"),
+        interaction(1, sender="me"),
+        interaction(2, sender="customer"),
+        interaction(3, sender="me"),
+        interaction(4, sender="me"),
+    ])
+
+    last_customer = asyncio.run(last_interaction_by_sender(customer_id, "customer"))
+    last_me = asyncio.run(last_interaction_by_sender(customer_id, "me"))
+
+    assert last_customer["summary"] == "message 2"
+    assert last_me["summary"] == "message 4"
+    assert asyncio.run(last_interaction_by_sender(customer_id, "nobody")) is None
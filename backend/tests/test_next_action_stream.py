@@ -0,0 +1,82 @@
+"""GET /api/customers/{id}/next-action/stream with the fake model"""
+import asyncio
+import json
+
+from bson import ObjectId
+
+from agents.llm_gateway import LLMGatewayBusy
+from agents.models import FakeGenerativeModel
+
+
+def read_events(response):
+    """[(event, data)] from a server-sent events body"""
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def insert_customer(db):
+    customer_id = ObjectId()
+    asyncio.run(db["customers"].insert_one({"_id": customer_id, "name": "Glow Salon", "city": "Delhi", "size": "Small"}))
+    return str(customer_id)
+
+
+def test_streams_tokens_then_suggestion(client, db):
+    customer_id = insert_customer(db)
+
+    response = client.get(f"/api/customers/{customer_id}/next-action/stream", params={"bypass_cache": True})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = read_events(response)
+    names = [name for name, _ in events]
+    assert names[-1] == "suggestion"
+    assert set(names[:-1]) == {"token"} and len(names) > 2
+
+    tokens = "".join(data["text"] for _, data in events[:-1])
+    suggestion = events[-1][1]
+    assert suggestion["needs_approval"] is True
+    assert suggestion["suggestion"] == tokens
+    assert "Recommended Action" in tokens
+
+
+def test_model_failure_ends_with_error_event(client, db, monkeypatch):
+    customer_id = insert_customer(db)
+
+    async def fail(self, prompt, stream=False):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(FakeGenerativeModel, "generate_content_async", fail)
+    response = client.get(f"/api/customers/{customer_id}/next-action/stream", params={"bypass_cache": True})
+
+    assert response.status_code == 200
+    events = read_events(response)
+    assert [name for name, _ in events] == ["error"]
+    assert "model unavailable" in events[0][1]["detail"]
+
+
+def test_busy_gateway_reports_retry_after(client, db, monkeypatch):
+    customer_id = insert_customer(db)
+
+    async def busy(self, prompt, stream=False):
+        raise LLMGatewayBusy("LLM queue is full, try again later", retry_after=3)
+
+    monkeypatch.setattr(FakeGenerativeModel, "generate_content_async", busy)
+    events = read_events(client.get(f"/api/customers/{customer_id}/next-action/stream", params={"bypass_cache": True}))
+
+    assert events == [("error", {"detail": "LLM queue is full, try again later", "status": 429, "retry_after": 3})]
+
+
+def test_invalid_customer_id_is_rejected_before_streaming(client):
+    response = client.get("/api/customers/not-an-id/next-action/stream")
+
+    assert response.status_code == 400
+
+
+def test_unknown_customer_is_404_before_streaming(client):
+    response = client.get(f"/api/customers/{ObjectId()}/next-action/stream")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Customer not found"
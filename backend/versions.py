@@ -0,0 +1,73 @@
+"""Per-collection change versions in `change_versions`, and the ETag/If-None-Match handling built on them."""
+import hashlib
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi import Response
+from pymongo import UpdateOne
+
+VERSIONS_COLLECTION = "change_versions"
+
+CUSTOMERS = "customers"
+CAMPAIGNS = "campaigns"
+MAPPINGS = "mapcamp"
+INTERACTIONS = "interactions"
+SUMMARIES = "convosummary"
+STATS = "stats"
+
+# Browsers keep the response but revalidate with If-None-Match every time
+# ("no-cache"); the dashboard numbers may be a few seconds stale
+CACHE_CONTROL = {
+    "campaigns": "private, no-cache",
+    "campaign": "private, no-cache",
+    "campaign_customers": "private, no-cache",
+    "customer": "private, no-cache",
+    "interactions": "private, no-cache",
+    "stats": "private, max-age=15",
+}
+
+
+async def bump_versions(db, *names):
+    """Record that the named collections changed"""
+    now = datetime.utcnow()
+    await db[VERSIONS_COLLECTION].bulk_write([
+        UpdateOne(
+            {"_id": name},
+            {"$inc": {"version": 1}, "$set": {"updated_at": now}, "$setOnInsert": {"epoch": ObjectId()}},
+            upsert=True
+        )
+        for name in names
+    ], ordered=False)
+
+
+async def current_versions(db, names):
+    docs = await db[VERSIONS_COLLECTION].find({"_id": {"$in": list(names)}}, {"version": 1, "epoch": 1}).to_list(None)
+    found = {doc["_id"]: f"{doc.get('epoch')}:{doc['version']}" for doc in docs}
+    return {name: found.get(name, "0") for name in names}
+
+
+def make_etag(path, query, versions):
+    key = "|".join([path, query] + [f"{name}={versions[name]}" for name in sorted(versions)])
+    return f'"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+async def conditional_get(db, request, names, route):
+    """(304 response or None, caching headers for the full response)"""
+    versions = await current_versions(db, names)
+    headers = {
+        "ETag": make_etag(request.url.path, request.url.query, versions),
+        "Cache-Control": CACHE_CONTROL[route]
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers), headers
+    return None, headers